@@ -7,6 +7,7 @@ Created on Sat Jun 17 11:24:41 2023
 """
 
 from typing import List, Tuple
+import numpy as np
 
 
 class EIP1559TFM:
@@ -75,6 +76,77 @@ class EIP1559MultiDimensionalMechanism:
     def get_fees(self):
         return [self.tfms[i].base_fee for i in range(len(self.tfms))]
 
+class BatchedEIP1559Mechanism:
+    def __init__(self, dimensions: List[Tuple[int, float, float, float, float]], n_replicates: int = 1,
+                 history_length: int = 0):
+        """
+        Multi-Dimensional EIP1559 Mechanism for many independent trajectories at once.
+
+        Base fees are held as an (n_replicates, n_lanes) array and every call to
+        update_fees advances all of them with a single vectorized update, which
+        is the same as EIP1559TFM.update_fee applied to each entry.
+
+        Args:
+            dimensions: A list of tuples representing the dimensions of each block.
+                Each tuple contains the Id, base fee, min fee, target, and capacity of a block's TFM.
+            n_replicates: Number of trajectories advanced in lockstep.
+            history_length: Number of updates to preallocate the base fee history for.
+                The history grows if more updates are made.
+        """
+        Id, base_fee, min_fee, target, capacity = (np.array(column, dtype=float) for column in zip(*dimensions))
+        assert np.all(target > 0)
+        assert np.all(capacity > target)
+
+        self.Id = Id.astype(int)
+        self.min_fee = min_fee
+        self.target = target
+        self.capacity = capacity
+        self.n_replicates = n_replicates
+        self.base_fees = np.tile(base_fee, (n_replicates, 1))
+
+        self._history = np.empty((history_length + 1, n_replicates, len(target)))
+        self._history[0] = self.base_fees
+        self._n_history = 1
+
+    def update_fees(self, gas_used) -> np.ndarray:
+        """
+        Calculates the fees of every trajectory based on the gas used in each lane.
+
+        Args:
+            gas_used: Gas used per lane, as an (n_replicates, n_lanes) array, or a
+                list with one entry per lane when there is a single trajectory.
+
+        Returns:
+            np.ndarray: The new base fees, with the same shape as gas_used.
+        """
+        gas_used = np.asarray(gas_used, dtype=float)
+        increment = (gas_used - self.target) / self.target
+
+        base_fees = self.base_fees * (1 + increment / 8)
+        np.maximum(base_fees, self.min_fee, out=base_fees)
+        self.base_fees = base_fees.reshape(self.n_replicates, len(self.target))
+
+        if self._n_history == len(self._history):
+            self._history = np.concatenate([self._history, np.empty_like(self._history)])
+        self._history[self._n_history] = self.base_fees
+        self._n_history += 1
+
+        return base_fees.reshape(gas_used.shape)
+
+    def get_fees(self) -> np.ndarray:
+        """
+        Current base fees, one row per trajectory (a single row when n_replicates is 1).
+        """
+        return self.base_fees[0] if self.n_replicates == 1 else self.base_fees
+
+    @property
+    def base_fee_history(self) -> np.ndarray:
+        """
+        Base fees after each update (the first entry are the initial ones), as an
+        (n_updates + 1, n_replicates, n_lanes) array.
+        """
+        return self._history[:self._n_history]
+
 
 if __name__=='__main__':
     import matplotlib.pyplot as plt
@@ -5,9 +5,100 @@ Created on Fri Jun 16 12:12:43 2023
 
 @author: juanpablomadrigalcianci
 """
+import numpy as np
+from params import opcode_gas
+ETH_OPCODES = opcode_gas()
 
-from params import eth_opcodes
-ETH_OPCODES = eth_opcodes()
+# Groups of table opcodes that lane rules can refer to. 'compute' is every table
+# opcode outside the other groups and 'foreign' every opcode outside the table (e.g. 'SP').
+OPCODE_GROUPS = {
+    'storage': ('SLOAD', 'SSTORE', 'BALANCE', 'SELFBALANCE', 'EXTCODESIZE', 'EXTCODECOPY', 'EXTCODEHASH',
+                'BLOCKHASH'),
+    'logs': ('LOG0', 'LOG1', 'LOG2', 'LOG3', 'LOG4'),
+    'calls': ('CREATE', 'CREATE2', 'CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL', 'SELFDESTRUCT'),
+}
+GROUPS = ('storage', 'compute', 'logs', 'calls', 'foreign')
+
+# Current model: table opcodes go to lane 1, everything else to lane 0
+DEFAULT_LANE_RULES = {'storage': 1, 'compute': 1, 'logs': 1, 'calls': 1, 'foreign': 0}
+
+
+class LaneClassifier:
+    def __init__(self, rules: dict = None, N_lanes: int = None, names: list = None):
+        """
+        Maps opcodes to lanes, for any number of lanes.
+
+        The rules are compiled once into a dense array with the lane of every
+        table opcode, so the lanes of many opcodes are found with a single
+        indexing operation.
+
+        Args:
+            rules (dict): Lane of each group ('storage', 'compute', 'logs',
+                'calls', 'foreign') and of individual opcodes, given by name or
+                by table index. Opcode rules take precedence over group rules.
+                Defaults to DEFAULT_LANE_RULES.
+            N_lanes (int): Number of lanes. Defaults to the highest lane in the rules plus one.
+            names (list): Names of the table opcodes. Defaults to params.eth_opcodes().
+
+        Raises:
+            ValueError: If a rule refers to an unknown group or opcode, if the
+                rules do not assign a lane to every opcode, or if a lane is out of range.
+        """
+        if rules is None:
+            rules = DEFAULT_LANE_RULES
+        if names is None:
+            names = list(ETH_OPCODES.keys())
+        self.names = list(names)
+        self.rules = dict(rules)
+        index = {name: i for i, name in enumerate(self.names)}
+
+        group_of = {name: 'compute' for name in self.names}
+        for group, members in OPCODE_GROUPS.items():
+            for name in members:
+                if name in group_of:
+                    group_of[name] = group
+
+        self.lookup = np.full(len(self.names), -1, dtype=np.intp)
+        self.foreign_lane = -1
+        for key, lane in self.rules.items():
+            if key in GROUPS:
+                continue
+            if isinstance(key, (int, np.integer)) and 0 <= key < len(self.names):
+                self.lookup[key] = lane
+            elif key in index:
+                self.lookup[index[key]] = lane
+            else:
+                raise ValueError(f"Unknown opcode or group '{key}' in the lane rules")
+        for i, name in enumerate(self.names):
+            if self.lookup[i] < 0 and group_of[name] in self.rules:
+                self.lookup[i] = self.rules[group_of[name]]
+        if 'foreign' in self.rules:
+            self.foreign_lane = self.rules['foreign']
+
+        if np.any(self.lookup < 0) or self.foreign_lane < 0:
+            raise ValueError("The lane rules must assign a lane to every opcode, including 'foreign'")
+        if N_lanes is None:
+            N_lanes = int(max(self.lookup.max(initial=0), self.foreign_lane)) + 1
+        if self.lookup.max(initial=0) >= N_lanes or self.foreign_lane >= N_lanes:
+            raise ValueError(f"The lane rules use lanes beyond the {N_lanes} available")
+        self.N_lanes = N_lanes
+        self._index = index
+
+    def lane(self, name: str) -> int:
+        """
+        Lane of an opcode, given by name.
+        """
+        i = self._index.get(name)
+        return self.foreign_lane if i is None else int(self.lookup[i])
+
+    def lanes(self, opcode_ids) -> np.ndarray:
+        """
+        Lanes of an array of table opcodes, given by table index.
+        """
+        return self.lookup[opcode_ids]
+
+
+DEFAULT_CLASSIFIER = LaneClassifier()
 
 
 def classify(name: str = None, opcode_id: int = None):
@@ -22,18 +113,9 @@ def classify(name: str = None, opcode_id: int = None):
         int: The lane number representing the opcode group.
     """
     if name is not None:
-        # TODO: Model only considers 2 lanes at the moment, this needs to change
-        if name in ETH_OPCODES:
-            lane = 1
-        else:
-            lane = 0
+        lane = DEFAULT_CLASSIFIER.lane(name)
 
     else:
         raise ValueError("Opcode name must be provided")
 
     return lane
-
-
-    
-    
-    
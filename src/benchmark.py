@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the block building and fee update hot paths.
+
+Every scenario is run over a grid of sizes (number of messages, items or
+updates) and lane counts, and reports its wall time, the peak memory it
+allocates and the net number of memory blocks it leaves allocated (blocks
+allocated minus blocks freed, so a scenario that allocates and frees heavily
+reports about 0: CPython has no count of allocations, peak_bytes is the
+measure of allocation pressure). Results are
+written as JSON so that two versions can be compared automatically:
+
+    python benchmark.py --output new.json
+    python benchmark.py --compare old.json new.json
+
+Scenarios that build Python objects per message, or solve the problem exactly,
+are only run up to a size limit (see SCENARIOS), unless --no-limits is given.
+
+The cold import time of the entry point modules is checked against a budget
+(see IMPORT_BUDGETS), each in a fresh interpreter:
+
+    python benchmark.py --imports
+"""
+from typing import Callable, Dict, List
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+# Scenario name to (setup, maximum size). setup(size, N_lanes, rng) returns a
+# function preparing a fresh state and returning the callable to be timed.
+SCENARIOS: Dict[str, tuple] = {}
+
+DEFAULT_SIZES = (10**2, 10**3, 10**4, 10**5, 10**6)
+DEFAULT_LANES = (1, 2, 4, 8)
+
+# Module to the budget of its cold import time, in seconds
+IMPORT_BUDGETS = {'simulation': 0.5, 'mainLoop': 0.5, 'ensemble': 0.5, 'sweep': 0.5}
+# Optional heavy dependencies, only to be imported on first use
+LAZY_MODULES = ('matplotlib', 'tqdm', 'pulp', 'pyarrow')
+
+
+def scenario(name: str, max_size: int = 10**6):
+    """
+    Registers a scenario setup function under a name.
+    """
+    def register(setup):
+        SCENARIOS[name] = (setup, max_size)
+        return setup
+    return register
+
+
+def _knapsack_instance(size, N_lanes, rng):
+    values = rng.random(size)
+    weights = rng.random((size, N_lanes)) * 1e6
+    capacity = (weights.sum(axis=0) * 0.1).tolist()
+    return values, weights, capacity
+
+
+def _messages(size, N_lanes, rng):
+    from message import Message
+
+    gas_used = rng.random((size, N_lanes)) * 1e9
+    gas_fee_cap = 1e-10 * (1 + 0.2 * rng.random((size, N_lanes)))
+    return Message.batch('msg', gas_fee_cap, gas_fee_cap - 1e-10, gas_used, rng=rng)
+
+
+@scenario('knapsack_exact', max_size=10**2)
+def _knapsack_exact(size, N_lanes, rng):
+    from knapsack import multidimensional_knapsack
+
+    values, weights, capacity = _knapsack_instance(size, N_lanes, rng)
+    values, weights = values.tolist(), weights.tolist()
+    return lambda: lambda: multidimensional_knapsack(values, weights, capacity)
+
+
+@scenario('knapsack_approx', max_size=10**5)
+def _knapsack_approx(size, N_lanes, rng):
+    from knapsack import multidimensional_knapsack_approx
+
+    values, weights, capacity = _knapsack_instance(size, N_lanes, rng)
+    values, weights = values.tolist(), weights.tolist()
+    return lambda: lambda: multidimensional_knapsack_approx(values, weights, capacity)
+
+
+@scenario('knapsack_approx_vectorized')
+def _knapsack_approx_vectorized(size, N_lanes, rng):
+    from knapsack import multidimensional_knapsack_approx_vectorized
+
+    values, weights, capacity = _knapsack_instance(size, N_lanes, rng)
+    return lambda: lambda: multidimensional_knapsack_approx_vectorized(values, weights, capacity)
+
+
+@scenario('knapsack_lp', max_size=10**5)
+def _knapsack_lp(size, N_lanes, rng):
+    from knapsack import multidimensional_knapsack_lp
+
+    values, weights, capacity = _knapsack_instance(size, N_lanes, rng)
+    return lambda: lambda: multidimensional_knapsack_lp(values, weights, capacity)
+
+
+@scenario('knapsack_dual')
+def _knapsack_dual(size, N_lanes, rng):
+    from knapsack import multidimensional_knapsack_dual
+
+    values, weights, capacity = _knapsack_instance(size, N_lanes, rng)
+    return lambda: lambda: multidimensional_knapsack_dual(values, weights, capacity)[0]
+
+
+@scenario('mempool_remove', max_size=10**5)
+def _mempool_remove(size, N_lanes, rng):
+    from mempool import Mempool
+
+    messages = _messages(size, N_lanes, rng)
+
+    def prepare():
+        mempool = Mempool(messages, N_lanes=N_lanes, capacity=size)
+        chosen = [messages[i] for i in rng.choice(size, max(size // 10, 1), replace=False)]
+        return lambda: mempool.remove(chosen)
+    return prepare
+
+
+@scenario('mempool_knapsack_parameters', max_size=10**5)
+def _mempool_knapsack_parameters(size, N_lanes, rng):
+    from mempool import Mempool
+
+    messages = _messages(size, N_lanes, rng)
+
+    def prepare():
+        # Remove some messages so that the pool has to be compacted
+        mempool = Mempool(messages, N_lanes=N_lanes, capacity=size)
+        mempool.remove_indices(np.sort(rng.choice(size, max(size // 10, 1), replace=False)))
+        return mempool.get_parameters_for_knapsack
+    return prepare
+
+
+@scenario('mempool_capped_insert')
+def _mempool_capped_insert(size, N_lanes, rng):
+    from mempool import Mempool
+
+    messages = _messages(size, N_lanes, rng)
+    arrivals = [_messages(10, N_lanes, rng) for _ in range(100)]
+
+    def prepare():
+        # A full pool evicting its lowest ratio messages on each insertion of 10
+        mempool = Mempool(messages, N_lanes=N_lanes, capacity=2 * size, eviction_policy='lowest_ratio',
+                          max_length=size)
+
+        def run():
+            for batch in arrivals:
+                mempool.add_messages(batch)
+        return run
+    return prepare
+
+
+@scenario('message_construction', max_size=10**5)
+def _message_construction(size, N_lanes, rng):
+    from message import Message
+
+    gas_used = rng.random((size, N_lanes)) * 1e9
+    gas_fee_cap = 1e-10 * (1 + 0.2 * rng.random((size, N_lanes)))
+    gas_premium = gas_fee_cap - 1e-10
+    return lambda: lambda: Message.batch('msg', gas_fee_cap, gas_premium, gas_used, rng=rng)
+
+
+@scenario('message_generation', max_size=10**5)
+def _message_generation(size, N_lanes, rng):
+    from demand import MessageGenerator
+
+    generator = MessageGenerator(N_lanes, rng=rng)
+    base_fees = [1e-10] * N_lanes
+    return lambda: lambda: generator.generate(size, base_fees)
+
+
+@scenario('block_gas_used', max_size=10**5)
+def _block_gas_used(size, N_lanes, rng):
+    from block import Block
+
+    block = Block(_messages(size, N_lanes, rng), N_lanes=N_lanes)
+    return lambda: block.get_gas_used
+
+
+@scenario('update_fees', max_size=10**5)
+def _update_fees(size, N_lanes, rng):
+    import params
+    from TFM import EIP1559MultiDimensionalMechanism
+
+    env_params = _env_params(N_lanes)
+    gas_used = (rng.random((size, N_lanes)) * np.array(env_params['lane_widths'])).tolist()
+
+    def prepare():
+        tfm = EIP1559MultiDimensionalMechanism(params.gas_lanes_params(env_params))
+
+        def run():
+            for g in gas_used:
+                tfm.update_fees(g)
+        return run
+    return prepare
+
+
+@scenario('update_fees_batched')
+def _update_fees_batched(size, N_lanes, rng):
+    import params
+    from TFM import BatchedEIP1559Mechanism
+
+    env_params = _env_params(N_lanes)
+    gas_used = rng.random((size, N_lanes)) * np.array(env_params['lane_widths'])
+
+    def prepare():
+        tfm = BatchedEIP1559Mechanism(params.gas_lanes_params(env_params), n_replicates=size)
+        return lambda: tfm.update_fees(gas_used)
+    return prepare
+
+
+def _env_params(N_lanes):
+    import params
+
+    env_params = params.env_params()
+    env_params['N_lanes'] = N_lanes
+    for key in ('lane_widths', 'lane_targets', 'initial_base_fee', 'min_fee'):
+        env_params[key] = [env_params[key][0]] * N_lanes
+    return env_params
+
+
+def measure(prepare: Callable, repeat: int = 3) -> Dict:
+    """
+    Times a scenario and measures its memory use.
+
+    Args:
+        prepare: Function returning the callable to be measured, on a fresh state.
+        repeat: Number of timed runs. The memory is measured on an extra run.
+
+    Returns:
+        dict: Minimum and median wall time in seconds, peak and retained bytes
+        allocated by the run, and net number of memory blocks it left allocated
+        (not the number of allocations it made).
+    """
+    times = []
+    for _ in range(repeat):
+        run = prepare()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    run = prepare()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    result = run()
+    current, peak = tracemalloc.get_traced_memory()
+    net_blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    del result
+
+    return {'time_min': min(times), 'time_median': float(np.median(times)),
+            'peak_bytes': peak - base, 'retained_bytes': current - base, 'net_blocks': net_blocks}
+
+
+def measure_import(module: str, repeat: int = 3) -> Dict:
+    """
+    Measures the cold import time of a module, in fresh interpreters.
+
+    Args:
+        module: Name of the module.
+        repeat: Number of interpreters.
+
+    Returns:
+        dict: Minimum import time in seconds, the lazy modules it loaded, and
+        whether it exceeds its budget (or loads a lazy module).
+    """
+    code = ("import sys, time; start = time.perf_counter(); import {}; "
+            "print(time.perf_counter() - start, *[m for m in {!r} if m in sys.modules])").format(module, LAZY_MODULES)
+    times, loaded = [], set()
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True).stdout.split()
+        times.append(float(out[0]))
+        loaded.update(out[1:])
+    budget = IMPORT_BUDGETS.get(module, float('inf'))
+    return {'module': module, 'time_min': min(times), 'budget': budget, 'loaded': sorted(loaded),
+            'over_budget': min(times) > budget or bool(loaded)}
+
+
+def run_benchmarks(scenarios: List[str] = None, sizes=DEFAULT_SIZES, lanes=DEFAULT_LANES, repeat: int = 3,
+                   seed: int = 0, limits: bool = True, verbose: bool = False) -> Dict:
+    """
+    Runs the benchmark grid.
+
+    Args:
+        scenarios: Names of the scenarios to run. Defaults to all of them.
+        sizes: Sizes to run every scenario with.
+        lanes: Lane counts to run every scenario with.
+        repeat: Number of timed runs per point.
+        seed: Seed of the random instances.
+        limits: If True, sizes above the limit of a scenario are skipped.
+        verbose: If True, every result is printed as it is obtained.
+
+    Returns:
+        dict: 'meta' (versions and machine) and 'results' (one dict per point).
+    """
+    from sweep import code_version
+
+    if scenarios is None:
+        scenarios = list(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios {sorted(unknown)}")
+
+    results = []
+    for name in scenarios:
+        setup, max_size = SCENARIOS[name]
+        for N_lanes in lanes:
+            for size in sizes:
+                if limits and size > max_size:
+                    continue
+                rng = np.random.default_rng(seed)
+                result = {'scenario': name, 'size': int(size), 'N_lanes': int(N_lanes), 'repeat': repeat}
+                result.update(measure(setup(int(size), int(N_lanes), rng), repeat))
+                results.append(result)
+                if verbose:
+                    print(f"{name:30s} size={size:>8d} lanes={N_lanes} "
+                          f"time={result['time_min']:.4g}s peak={result['peak_bytes'] / 1e6:.3g}MB "
+                          f"net_blocks={result['net_blocks']}", flush=True)
+
+    meta = {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.platform(), 'code_version': code_version()}
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 1.2) -> List[Dict]:
+    """
+    Compares two benchmark results point by point.
+
+    Args:
+        baseline: Output of run_benchmarks for the reference version.
+        current: Output of run_benchmarks for the new version.
+        threshold: Ratio of the minimum times above which a point is a regression.
+
+    Returns:
+        list: One dict per point present in both results, with the time and
+        peak memory ratios (current / baseline) and a 'regression' flag.
+    """
+    key = lambda r: (r['scenario'], r['size'], r['N_lanes'])
+    reference = {key(r): r for r in baseline['results']}
+    rows = []
+    for r in current['results']:
+        b = reference.get(key(r))
+        if b is None:
+            continue
+        time_ratio = r['time_min'] / b['time_min'] if b['time_min'] > 0 else float('inf')
+        memory_ratio = r['peak_bytes'] / b['peak_bytes'] if b['peak_bytes'] > 0 else float('nan')
+        rows.append({'scenario': r['scenario'], 'size': r['size'], 'N_lanes': r['N_lanes'],
+                     'time_ratio': time_ratio, 'memory_ratio': memory_ratio,
+                     'regression': time_ratio > threshold})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), help='scenarios to run (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument('--lanes', nargs='+', type=int, default=list(DEFAULT_LANES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-limits', action='store_true', help='ignore the size limits of the scenarios')
+    parser.add_argument('--output', help='path of the JSON results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two JSON results instead of running the benchmarks')
+    parser.add_argument('--threshold', type=float, default=1.2, help='time ratio flagged as a regression')
+    parser.add_argument('--imports', action='store_true',
+                        help='check the cold import time of IMPORT_BUDGETS instead of running the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        rows = [measure_import(module, args.repeat) for module in IMPORT_BUDGETS]
+        for row in rows:
+            flag = 'OVER BUDGET' if row['over_budget'] else ''
+            print(f"{row['module']:30s} import={row['time_min']:.3f}s budget={row['budget']:.3f}s "
+                  f"loaded={','.join(row['loaded']) or '-'} {flag}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'imports': rows}, f, indent=1)
+        return 1 if any(row['over_budget'] for row in rows) else 0
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        rows = compare(baseline, current, args.threshold)
+        for row in rows:
+            flag = 'REGRESSION' if row['regression'] else ''
+            print(f"{row['scenario']:30s} size={row['size']:>8d} lanes={row['N_lanes']} "
+                  f"time x{row['time_ratio']:.2f} memory x{row['memory_ratio']:.2f} {flag}")
+        return 1 if any(row['regression'] for row in rows) else 0
+
+    results = run_benchmarks(args.scenarios, args.sizes, args.lanes, args.repeat, args.seed,
+                             limits=not args.no_limits, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
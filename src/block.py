@@ -1,31 +1,45 @@
 from typing import List
+import numpy as np
 from message import Message
 
 class Block:
-    def __init__(self, messages: List[Message], N_lanes: int = 2):
+    def __init__(self, messages: List[Message], N_lanes: int = 2, arrivals=None):
         """
         Initializes the Block with a list of messages.
 
         Args:
             messages: List of messages.
             N_lanes: Number of lanes in the block.
+            arrivals: Optional step at which each message entered the mempool.
         """
         self.messages = messages
         self.N_lanes = N_lanes
+        self.arrivals = None if arrivals is None else np.asarray(arrivals)
         self.gas_used = self.get_gas_used()
 
-    def get_gas_used(self) -> List[int]:
+    def get_gas_used(self) -> np.ndarray:
         """
         Computes the total gas used in each lane of the block.
 
         Returns:
-            A list of gas used values for each lane.
+            An array of gas used values for each lane.
         """
-        total_gas_used = [0] * self.N_lanes
-        for message in self.messages:
-            for i in range(self.N_lanes):
-                total_gas_used[i] += message.gas_used[i]
-        return total_gas_used
+        if not self.messages:
+            return np.zeros(self.N_lanes)
+        return np.sum([message.gas_used for message in self.messages], axis=0)
+
+    def get_revenue(self) -> float:
+        """
+        Computes the premiums collected by the proposer of the block.
+
+        Returns:
+            The sum over messages and lanes of the gas premium times the gas used.
+        """
+        if not self.messages:
+            return 0.
+        premiums = np.array([message.gas_premium for message in self.messages])
+        gas_used = np.array([message.gas_used for message in self.messages])
+        return float(np.sum(premiums * gas_used))
 
 if __name__ == '__main__':
     from opcodes import Opcode
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched generation of random messages.
+
+Instead of building one Opcode object per sampled opcode, the generator draws
+the opcodes of a whole step as index arrays into the opcode table and reduces
+them to per-message, per-lane gas vectors with a single np.bincount.
+
+RandomDemand combines a generator with the sampling of the number of arrivals
+and of the capacity shocks of every step.
+"""
+from typing import List
+import numpy as np
+from message import Message
+from opcodes import OPCODE_GAS, OPCODE_LANES, FOREIGN_LANE, OPCODE_TABLE
+from aux import LaneClassifier
+
+
+class MessageGenerator:
+    def __init__(self, N_lanes: int, rate_opcodes: float = 100, rate_sps: float = 2, sp_gas: float = 1e8,
+                 lane_rules: dict = None, rng: np.random.Generator = None, fee_rng: np.random.Generator = None):
+        """
+        Generates random messages with opcodes sampled uniformly from the opcode table.
+
+        Args:
+            N_lanes (int): Number of lanes of the gas vectors.
+            rate_opcodes (float): Poisson rate of the number of table opcodes per message.
+            rate_sps (float): Poisson rate of the number of 'SP' opcodes per message.
+            sp_gas (float): Scale of the (uniform) gas used by an 'SP' opcode.
+            lane_rules (dict, optional): Rules of an aux.LaneClassifier mapping the
+                opcodes to the N_lanes lanes. By default table opcodes go to lane 1
+                and 'SP' opcodes to lane 0 (everything to lane 0 with a single lane).
+            rng (np.random.Generator, optional): Stream of the opcodes. Defaults to the global np.random state.
+            fee_rng (np.random.Generator, optional): Stream of the fee caps and gas limit
+                overestimation. Defaults to rng.
+        """
+        self.N_lanes = N_lanes
+        self.rate_opcodes = rate_opcodes
+        self.rate_sps = rate_sps
+        self.sp_gas = sp_gas
+        self.rng = rng
+        self.fee_rng = rng if fee_rng is None else fee_rng
+
+        if lane_rules is not None:
+            classifier = LaneClassifier(lane_rules, N_lanes, OPCODE_TABLE.names)
+            self.opcode_lanes = classifier.lookup
+            self.foreign_lane = classifier.foreign_lane
+        elif N_lanes > 1:
+            self.opcode_lanes = OPCODE_LANES
+            self.foreign_lane = FOREIGN_LANE
+        else:
+            self.opcode_lanes = np.zeros_like(OPCODE_LANES)
+            self.foreign_lane = 0
+
+    def generate(self, N_messages: int, base_fees: list) -> List[Message]:
+        """
+        Generates a batch of random messages.
+
+        With the global np.random state, the random numbers are drawn message by
+        message in the same order as the Opcode based generator, so under a fixed
+        seed both produce the same messages. With Generators, every kind of draw
+        is made for the whole batch at once. In both cases opcode lookup and gas
+        accounting are done for the whole batch at once.
+
+        Args:
+            N_messages (int): Number of messages to generate.
+            base_fees (list): Current base fee of each lane.
+
+        Returns:
+            list: The generated messages.
+        """
+        base_fees = np.asarray(base_fees, dtype=float)
+        if self.rng is None:
+            n_opcodes, n_sps, opcode_ids, sp_gas, fee_factors, limit_factors = \
+                self._draw_global(N_messages, len(base_fees))
+        else:
+            n_opcodes, n_sps, opcode_ids, sp_gas, fee_factors, limit_factors = \
+                self._draw(N_messages, len(base_fees))
+
+        gas_used = self.reduce_gas(n_opcodes, n_sps, opcode_ids, sp_gas)
+        gas_limit = (gas_used * (1 + 0.2 * limit_factors)).astype(np.int64)
+        gas_fee_cap = base_fees * (1 + 0.2 * fee_factors)
+        gas_premium = gas_fee_cap - base_fees
+
+        MESSAGE_NAME = 'msg'
+        return Message.batch(MESSAGE_NAME, gas_fee_cap, gas_premium, gas_used, gas_limit,
+                             opcode_ids=[ids.astype(OPCODE_TABLE.dtype) for ids in opcode_ids], custom_gas=sp_gas)
+
+    def _draw_global(self, N_messages, n_fees):
+        n_table = len(OPCODE_GAS)
+        opcode_ids = []
+        sp_gas = []
+        fee_factors = np.empty((N_messages, n_fees))
+        limit_factors = np.empty((N_messages, self.N_lanes))
+        n_opcodes = np.empty(N_messages, dtype=np.intp)
+        n_sps = np.empty(N_messages, dtype=np.intp)
+
+        for n in range(N_messages):
+            n_opcodes[n] = np.random.poisson(self.rate_opcodes)
+            n_sps[n] = np.random.poisson(self.rate_sps)
+            opcode_ids.append(np.random.randint(0, n_table, n_opcodes[n]))
+            sp_gas.append(self.sp_gas * np.random.random(n_sps[n]))
+            fee_factors[n] = np.random.random(n_fees)
+            limit_factors[n] = np.random.random(self.N_lanes)
+        return n_opcodes, n_sps, opcode_ids, sp_gas, fee_factors, limit_factors
+
+    def _draw(self, N_messages, n_fees):
+        n_opcodes = self.rng.poisson(self.rate_opcodes, N_messages)
+        n_sps = self.rng.poisson(self.rate_sps, N_messages)
+        opcode_ids = np.split(self.rng.integers(0, len(OPCODE_GAS), n_opcodes.sum()), np.cumsum(n_opcodes)[:-1])
+        sp_gas = np.split(self.sp_gas * self.rng.random(n_sps.sum()), np.cumsum(n_sps)[:-1])
+        fee_factors = self.fee_rng.random((N_messages, n_fees))
+        limit_factors = self.fee_rng.random((N_messages, self.N_lanes))
+        return n_opcodes, n_sps, opcode_ids, sp_gas, fee_factors, limit_factors
+
+    def reduce_gas(self, n_opcodes: np.ndarray, n_sps: np.ndarray, opcode_ids: list, sp_gas: list) -> np.ndarray:
+        """
+        Reduces the sampled opcodes of a batch into per-message, per-lane gas.
+
+        Table opcodes come before 'SP' opcodes in the concatenated arrays, so each
+        (message, lane) bin accumulates its terms in the same order as
+        Message.get_gas_used does.
+
+        Args:
+            n_opcodes: Number of table opcodes of each message.
+            n_sps: Number of 'SP' opcodes of each message.
+            opcode_ids: Table indices sampled for each message.
+            sp_gas: Gas used by the 'SP' opcodes of each message.
+
+        Returns:
+            np.ndarray: Array of shape (N_messages, N_lanes) with the gas used.
+        """
+        N_messages = len(n_opcodes)
+        ids = np.concatenate(opcode_ids) if N_messages else np.empty(0, dtype=np.intp)
+        foreign_gas = np.concatenate(sp_gas) if N_messages else np.empty(0)
+
+        owner = np.concatenate([np.repeat(np.arange(N_messages), n_opcodes),
+                                np.repeat(np.arange(N_messages), n_sps)])
+        lanes = np.concatenate([self.opcode_lanes[ids],
+                                np.full(len(foreign_gas), self.foreign_lane, dtype=np.intp)])
+        gas = np.concatenate([OPCODE_GAS[ids], foreign_gas])
+
+        bins = owner * self.N_lanes + lanes
+        gas_used = np.bincount(bins, weights=gas, minlength=N_messages * self.N_lanes)
+        return gas_used.reshape(N_messages, self.N_lanes)
+
+
+def sample_oom(rng=None):
+    """
+    Samples a tiny threshold, uniform below 10**-r for a random r in 7..9.
+    """
+    if rng is None:
+        r = np.random.randint(7, 10)
+        return np.random.random() * 10 ** -r
+    r = rng.integers(7, 10)
+    return rng.random() * 10.0 ** -r
+
+
+def sample_capacity(base_fees, lane_widths, rng=None):
+    """
+    Half the capacity of the lanes (times a random factor) with probability
+    one half, unless all the base fees are below a tiny random threshold.
+
+    With a Generator, the same number of random numbers is drawn at every step,
+    so the shocks do not depend on the base fees of the run.
+    """
+    if rng is None:
+        if np.random.random() < 0.5:
+            bfs = np.array(base_fees)
+            if all(bfs < sample_oom()):
+                return lane_widths
+            return list(np.array(lane_widths) * 0.5 * np.random.random())
+        return lane_widths
+
+    shock, oom, scale = rng.random(), sample_oom(rng), rng.random()
+    if shock < 0.5 and not all(np.array(base_fees) < oom):
+        return list(np.array(lane_widths) * 0.5 * scale)
+    return lane_widths
+
+
+class RandomDemand:
+    def __init__(self, env_params: dict, generator: MessageGenerator, streams=None):
+        """
+        Demand source sampling the arrivals and the capacity of every step.
+
+        A demand source implements next_step(base_fees), which returns the
+        messages arriving at a step and the capacity of each lane for its block
+        (see also demand_trace.TraceReplay).
+
+        Args:
+            env_params (dict): Environment parameters of the simulation.
+            generator (MessageGenerator): Generator of the arriving messages.
+            streams (rng.RandomStreams, optional): Streams of the arrivals and
+                capacity shocks. Defaults to the global np.random state.
+        """
+        self.env_params = env_params
+        self.generator = generator
+        self.streams = streams
+
+    def next_step(self, base_fees):
+        # samples number of messages to be added to the Mempool
+        rng = np.random if self.streams is None else self.streams.arrivals
+        N_messages = rng.poisson(self.env_params['rate_messages'])
+        list_of_messages = self.generator.generate(N_messages, base_fees)
+
+        # Half the capacity of the lanes if a certain condition is met
+        capacity = sample_capacity(base_fees, self.env_params['lane_widths'],
+                                   None if self.streams is None else self.streams.capacity)
+        return list_of_messages, capacity
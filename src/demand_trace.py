@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Record and replay of the demand of a simulation.
+
+TraceWriter appends, step by step, the messages arriving in the mempool and the
+capacity of the block to a single binary file. TraceReplay memory-maps the file
+and hands the same arrivals back to the simulation, without sampling any opcode,
+so several block building or fee update variants can be compared on exactly the
+same demand at a fraction of the cost of generating it.
+
+File layout (little endian):
+    MAGIC
+    messages    float64 (n_messages, 4 * N_lanes): gas_used, gas_limit,
+                gas_fee_cap and gas_premium of each message, in arrival order
+    offsets     int64 (n_steps + 1): first message of each step
+    capacity    float64 (n_steps, N_lanes): lane capacity of each step
+    footer      MAGIC, N_lanes, n_steps, n_messages, offset of the step table
+
+Fee caps are recorded as absolute values, so on replay they do not follow the
+base fees of the replayed run.
+"""
+import struct
+from typing import List, Tuple
+import numpy as np
+from message import Message
+
+MAGIC = b'GLTRACE1'
+_FOOTER = struct.Struct('<8sqqqq')
+
+
+class TraceWriter:
+    def __init__(self, path: str, N_lanes: int):
+        """
+        Records the arrivals of a simulation to a trace file.
+
+        The file is only complete (readable) once the writer is closed; use it
+        as a context manager.
+
+        Args:
+            path (str): Path of the trace file.
+            N_lanes (int): Number of lanes.
+        """
+        self.path = path
+        self.N_lanes = N_lanes
+        self.n_messages = 0
+        self._offsets = [0]
+        self._capacity = []
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_step(self, messages: List[Message], capacity):
+        """
+        Appends the arrivals of a step.
+
+        Args:
+            messages (list): The messages arriving at the step.
+            capacity: Capacity of each lane for the block of the step.
+        """
+        if messages:
+            rows = np.empty((len(messages), 4 * self.N_lanes))
+            L = self.N_lanes
+            rows[:, :L] = [m.gas_used for m in messages]
+            rows[:, L:2 * L] = [m.gas_limit for m in messages]
+            rows[:, 2 * L:3 * L] = [m.gas_fee_cap for m in messages]
+            rows[:, 3 * L:] = [m.gas_premium for m in messages]
+            self._file.write(rows.astype('<f8').tobytes())
+            self.n_messages += len(messages)
+        self._offsets.append(self.n_messages)
+        self._capacity.append(np.asarray(capacity, dtype=float))
+
+    def close(self):
+        """
+        Writes the step table and the footer and closes the file.
+        """
+        if self._file is None:
+            return
+        table_offset = self._file.tell()
+        self._file.write(np.asarray(self._offsets, dtype='<i8').tobytes())
+        self._file.write(np.asarray(self._capacity, dtype='<f8').reshape(-1, self.N_lanes).tobytes())
+        self._file.write(_FOOTER.pack(MAGIC, self.N_lanes, len(self._capacity), self.n_messages, table_offset))
+        self._file.close()
+        self._file = None
+
+
+class TraceReplay:
+    def __init__(self, path: str, loop: bool = False):
+        """
+        Demand source replaying a trace file.
+
+        Args:
+            path (str): Path of a file written by TraceWriter.
+            loop (bool): If True, the trace starts over when it is exhausted.
+                Otherwise running past its end raises an IndexError.
+
+        Raises:
+            ValueError: If the file is not a complete trace.
+        """
+        with open(path, 'rb') as f:
+            f.seek(-_FOOTER.size, 2)
+            magic, N_lanes, n_steps, n_messages, table_offset = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a complete demand trace")
+        self.path = path
+        self.N_lanes = N_lanes
+        self.n_steps = n_steps
+        self.n_messages = n_messages
+        self.loop = loop
+        self.step = 0
+
+        L = N_lanes
+        self._messages = np.memmap(path, dtype='<f8', mode='r', offset=len(MAGIC), shape=(n_messages, 4 * L)) \
+            if n_messages else np.empty((0, 4 * L))
+        self._offsets = np.memmap(path, dtype='<i8', mode='r', offset=table_offset, shape=(n_steps + 1,))
+        self._capacity = np.memmap(path, dtype='<f8', mode='r', offset=table_offset + 8 * (n_steps + 1),
+                                   shape=(n_steps, L)) if n_steps else np.empty((0, L))
+
+    def __len__(self):
+        return self.n_steps
+
+    def arrivals(self, step: int) -> Tuple[List[Message], list]:
+        """
+        Returns the arrivals and the lane capacity of a step of the trace.
+        """
+        L = self.N_lanes
+        rows = self._messages[self._offsets[step]:self._offsets[step + 1]]
+        messages = Message.batch('msg', rows[:, 2 * L:3 * L], rows[:, 3 * L:], rows[:, :L], rows[:, L:2 * L])
+        return messages, self._capacity[step].tolist()
+
+    def next_step(self, base_fees) -> Tuple[List[Message], list]:
+        """
+        Returns the arrivals and the lane capacity of the next step.
+
+        Args:
+            base_fees: Current base fees (unused, the fee caps are replayed as recorded).
+        """
+        if self.step == self.n_steps:
+            if not self.loop:
+                raise IndexError("The demand trace is exhausted")
+            self.step = 0
+        step = self.step
+        self.step += 1
+        return self.arrivals(step)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo ensembles of the gas lanes simulation.
+
+Each replicate runs in a worker process with its own components and its own
+random stream, spawned from a single SeedSequence. Workers stream their per-step
+metrics back to the parent in chunks, where they are folded into online
+statistics (mean, standard deviation and quantile bands per step), so the
+per-replicate histories are never kept in memory.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from queue import Empty
+from typing import Iterator, List, Sequence
+import numpy as np
+import params
+from online_stats import RunningMoments, P2Quantile
+from recorder import MetricsRecorder
+from simulation import Simulation
+
+
+def metric_names(N_lanes: int) -> List[str]:
+    """
+    Names of the per-step metrics reported by replicate_metrics.
+    """
+    return ([f'base_fee_{i}' for i in range(N_lanes)]
+            + [f'gas_used_{i}' for i in range(N_lanes)]
+            + ['mempool_size', 'mempool_gas'])
+
+
+def replicate_metrics(seed: np.random.SeedSequence, n_steps: int, max_mempool_length: int = 2000,
+                      strategy: str = 'greedy', env_params: dict = None) -> Iterator[np.ndarray]:
+    """
+    Runs one independent trajectory of the simulation.
+
+    Args:
+        seed: Seed of the replicate.
+        n_steps: Number of steps to simulate.
+        max_mempool_length: Maximum number of messages kept in the mempool.
+        strategy: Block building strategy of the miner.
+        env_params: Environment parameters. Defaults to params.env_params().
+
+    Yields:
+        np.ndarray: The metrics of each step, in the order of metric_names.
+    """
+    if env_params is None:
+        env_params = params.env_params()
+    N_lanes = env_params['N_lanes']
+
+    # The metrics are streamed to the caller, the recorder only keeps the last block
+    simulation = Simulation(env_params, seed=seed, max_mempool_length=max_mempool_length, strategy=strategy,
+                            recorder=MetricsRecorder(N_lanes, capacity=1, ring=True))
+    for _ in range(n_steps):
+        block = simulation.step()
+        gas_used = block.gas_used if block is not None else [0] * N_lanes
+        yield np.concatenate([simulation.tfm.get_fees(), gas_used,
+                              [len(simulation.mempool), np.sum(simulation.mempool.calculate_total_gas_used())]])
+
+
+def _run_replicate(seed, n_steps, max_mempool_length, strategy, env_params, chunk_size, queue):
+    chunk = []
+    start = 0
+    for step, metrics in enumerate(replicate_metrics(seed, n_steps, max_mempool_length, strategy, env_params)):
+        chunk.append(metrics)
+        if len(chunk) == chunk_size:
+            queue.put((start, np.array(chunk)))
+            start, chunk = step + 1, []
+    if chunk:
+        queue.put((start, np.array(chunk)))
+
+
+class EnsembleSummary:
+    def __init__(self, n_steps: int, names: List[str], quantiles: Sequence[float] = (0.05, 0.5, 0.95)):
+        """
+        Per-step statistics of an ensemble of trajectories, updated online.
+
+        Args:
+            n_steps: Number of steps of the trajectories.
+            names: Names of the metrics.
+            quantiles: Quantiles to be estimated for each step and metric.
+        """
+        self.names = list(names)
+        shape = (n_steps, len(names))
+        self.moments = RunningMoments(shape)
+        self.quantiles = {p: P2Quantile(p, shape) for p in quantiles}
+
+    def update(self, start: int, chunk: np.ndarray):
+        """
+        Adds a chunk of consecutive steps of one replicate.
+
+        Args:
+            start: Step of the first row of the chunk.
+            chunk: Array of shape (steps, metrics).
+        """
+        index = slice(start, start + len(chunk))
+        self.moments.update(chunk, index)
+        for estimator in self.quantiles.values():
+            estimator.update(chunk, index)
+
+    @property
+    def n_replicates(self) -> np.ndarray:
+        """
+        Number of replicates folded in at each step.
+        """
+        return self.moments.count[:, 0]
+
+    def mean(self, name: str) -> np.ndarray:
+        return self.moments.mean[:, self.names.index(name)]
+
+    def std(self, name: str) -> np.ndarray:
+        return self.moments.std[:, self.names.index(name)]
+
+    def quantile(self, name: str, p: float) -> np.ndarray:
+        return self.quantiles[p].value[:, self.names.index(name)]
+
+
+def run_ensemble(n_replicates: int, n_steps: int = None, seed=None, max_workers: int = None,
+                 quantiles: Sequence[float] = (0.05, 0.5, 0.95), chunk_size: int = 64,
+                 max_mempool_length: int = 2000, strategy: str = 'greedy',
+                 env_params: dict = None) -> EnsembleSummary:
+    """
+    Runs independent replicates of the simulation in a process pool.
+
+    Args:
+        n_replicates: Number of trajectories.
+        n_steps: Steps per trajectory. Defaults to N_steps of params.env_params().
+        seed: Entropy of the root SeedSequence (None draws fresh entropy).
+        max_workers: Number of worker processes. Defaults to the number of cores.
+        quantiles: Quantiles to be estimated for each step and metric.
+        chunk_size: Number of steps sent back to the parent at once.
+        max_mempool_length: Maximum number of messages kept in the mempool.
+        strategy: Block building strategy of the miners.
+        env_params: Environment parameters. Defaults to params.env_params().
+
+    Returns:
+        EnsembleSummary: The per-step statistics of the ensemble.
+    """
+    if env_params is None:
+        env_params = params.env_params()
+    if n_steps is None:
+        n_steps = env_params['N_steps']
+    seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+    summary = EnsembleSummary(n_steps, metric_names(env_params['N_lanes']), quantiles)
+
+    with Manager() as manager, ProcessPoolExecutor(max_workers=max_workers) as pool:
+        queue = manager.Queue()
+        pending = {pool.submit(_run_replicate, s, n_steps, max_mempool_length, strategy, env_params,
+                               chunk_size, queue)
+                   for s in seeds}
+        while pending or not queue.empty():
+            try:
+                start, chunk = queue.get(timeout=0.1)
+            except Empty:
+                done = {f for f in pending if f.done()}
+                for f in done:
+                    f.result()
+                pending -= done
+                continue
+            summary.update(start, chunk)
+
+    return summary
+
+
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
+    summary = run_ensemble(n_replicates=8, n_steps=500, seed=0)
+    for i in range(params.env_params()['N_lanes']):
+        name = f'base_fee_{i}'
+        plt.semilogy(summary.quantile(name, 0.5), label=f'lane {i}')
+        plt.fill_between(range(len(summary.n_replicates)), summary.quantile(name, 0.05),
+                         summary.quantile(name, 0.95), alpha=0.3)
+    plt.xlabel("Epochs")
+    plt.ylabel("Base Fee")
+    plt.title("Evolution of Base Fee (median and 90% band)")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
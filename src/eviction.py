@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Eviction policies of the mempool.
+
+An EvictionIndex is a mempool listener keeping the messages in a min-heap on an
+eviction priority, so the k messages to be dropped first are found in
+O(k log n). Removed messages are deleted lazily: their heap entries are skipped
+when they reach the top, and the heap is rebuilt when stale entries outnumber
+the live ones.
+
+The priority of the 'underpriced' policy depends on the base fees, so it is
+not stored. As in pruning.PruningIndex, the messages are kept in one min-heap
+on the fee cap per lane (pruning.FeeCapHeaps), which does not change with the base fees: the lowest
+priority message is the top of one of the lane heaps, the one with the lowest
+fee cap relative to the base fee of its lane. Base fee updates cost O(1) and
+evicting k messages O(k N_lanes log n).
+"""
+from typing import List
+import heapq
+import numpy as np
+from pruning import FeeCapHeaps, push_all
+
+
+def _fifo(columns, keys, base_fees):
+    return keys.astype(float)
+
+
+def _lowest_premium(columns, keys, base_fees):
+    return columns['value']
+
+
+def _lowest_ratio(columns, keys, base_fees):
+    gas = np.asarray(columns['gas_limit'], dtype=float).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(gas > 0, columns['value'] / gas, np.inf)
+
+
+def _underpriced(columns, keys, base_fees):
+    # Relative headroom of the fee cap over the base fee in the tightest lane,
+    # negative for messages that cannot currently be included
+    base_fees = np.asarray(base_fees, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        headroom = np.asarray(columns['gas_fee_cap']) / base_fees - 1
+    return np.min(np.where(base_fees > 0, headroom, np.inf), axis=1)
+
+
+# Policy name to the function computing the priority of messages (lowest evicted first)
+POLICIES = {
+    'fifo': _fifo,
+    'lowest_premium': _lowest_premium,
+    'lowest_ratio': _lowest_ratio,
+    'underpriced': _underpriced,
+}
+# Policies whose priorities change with the base fees
+PRICE_DEPENDENT = ('underpriced',)
+
+
+class EvictionIndex:
+    def __init__(self, policy: str = 'fifo', base_fees=None):
+        """
+        Min-heap of the messages of a mempool on their eviction priority.
+
+        Policies:
+            fifo: oldest first.
+            lowest_premium: lowest total premium first.
+            lowest_ratio: lowest premium per unit of gas limit first.
+            underpriced: lowest fee cap relative to the base fee, in the lane
+                where it is tightest, first. Messages priced out of some lane
+                go first. Compared with the base fees given to reprice at
+                eviction time.
+
+        Ties are broken by age (oldest first).
+
+        Args:
+            policy (str): One of POLICIES.
+            base_fees: Current base fees, needed by the 'underpriced' policy.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown eviction policy '{policy}', expected one of {sorted(POLICIES)}")
+        if policy in PRICE_DEPENDENT and base_fees is None:
+            raise ValueError(f"The '{policy}' policy needs the current base fees")
+        self.policy = policy
+        self.base_fees = None if base_fees is None else np.asarray(base_fees, dtype=float)
+        self._priority_of = POLICIES[policy]
+        self._heap = []
+        self._priority = {}
+        # Fee cap heaps of the 'underpriced' policy, one per lane
+        self._lanes = None
+
+    def __len__(self):
+        return len(self._priority)
+
+    def on_insert(self, keys, columns: dict):
+        keys = np.asarray(keys)
+        if self.policy in PRICE_DEPENDENT:
+            caps = np.asarray(columns['gas_fee_cap'], dtype=float).reshape(len(keys), -1)
+            if self._lanes is None:
+                self._lanes = FeeCapHeaps(caps.shape[1], self._priority)
+            self._priority.update(dict.fromkeys(keys.tolist()))
+            self._lanes.push(keys.tolist(), caps)
+            return
+        priorities = self._priorities(columns, keys)
+        entries = list(zip(priorities.tolist(), keys.tolist()))
+        self._priority.update((k, p) for p, k in entries)
+        push_all(self._heap, entries)
+
+    def on_remove(self, keys):
+        # Keys returned by worst or below are already gone from the index
+        for key in np.asarray(keys).tolist():
+            self._priority.pop(key, None)
+        if self._lanes is not None:
+            self._lanes.compact()
+        elif len(self._heap) > 2 * len(self._priority) + 64:
+            self._rebuild()
+
+    def worst(self, k: int) -> List[int]:
+        """
+        Removes the k lowest priority messages from the index.
+
+        Args:
+            k (int): Number of messages.
+
+        Returns:
+            list: Their mempool keys, lowest priority first. The caller is
+            expected to remove them from the mempool.
+        """
+        k = min(int(k), len(self._priority))
+        if self.policy in PRICE_DEPENDENT:
+            return self._pop_underpriced(k)
+        keys = []
+        while len(keys) < k:
+            priority, key = heapq.heappop(self._heap)
+            if self._priority.get(key) == priority:
+                keys.append(key)
+                del self._priority[key]
+        return keys
+
+    def below(self, threshold: float) -> List[int]:
+        """
+        Removes from the index all the messages with a priority below a threshold.
+
+        Returns:
+            list: Their mempool keys, lowest priority first.
+        """
+        if self.policy in PRICE_DEPENDENT:
+            return self._pop_underpriced(len(self._priority), threshold)
+        keys = []
+        while self._heap and self._heap[0][0] < threshold:
+            priority, key = heapq.heappop(self._heap)
+            if self._priority.get(key) == priority:
+                keys.append(key)
+                del self._priority[key]
+        return keys
+
+    def reprice(self, mempool, base_fees):
+        """
+        Sets the base fees against which the priorities of price dependent
+        policies are compared. Costs O(1): no priority is stored for them.
+
+        Args:
+            mempool (Mempool): The mempool the index is attached to.
+            base_fees: The new base fees.
+        """
+        self.base_fees = np.asarray(base_fees, dtype=float)
+
+    def _pop_underpriced(self, k: int, threshold: float = None) -> List[int]:
+        # The lowest (fee cap / base fee, key) over the lane tops is the lowest
+        # (priority, key) over all the messages, since the priority of a
+        # message is its lowest fee cap / base fee - 1 over the lanes
+        base_fees = self.base_fees.tolist()
+        lanes = [lane for lane, base_fee in enumerate(base_fees) if base_fee > 0]
+        if not lanes:
+            # Every priority is infinite: oldest first
+            keys = heapq.nsmallest(k, self._priority) if threshold is None else []
+            for key in keys:
+                del self._priority[key]
+            return keys
+        keys = []
+        while len(keys) < k:
+            best = None
+            for lane in lanes:
+                top = self._lanes.top(lane)
+                if top is not None and (best is None or (top[0] / base_fees[lane], top[1]) < best[:2]):
+                    best = (top[0] / base_fees[lane], top[1], lane)
+            if best is None or (threshold is not None and not best[0] - 1 < threshold):
+                break
+            self._lanes.pop(best[2])
+            del self._priority[best[1]]
+            keys.append(best[1])
+        return keys
+
+    def _priorities(self, columns, keys):
+        priorities = np.array(self._priority_of(columns, keys, self.base_fees), dtype=float)
+        # NaN never compares equal, its heap entries would never be recognised as live
+        priorities[np.isnan(priorities)] = np.inf
+        return priorities
+
+    def _rebuild(self):
+        self._heap = [(p, k) for k, p in self._priority.items()]
+        heapq.heapify(self._heap)
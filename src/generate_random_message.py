@@ -12,21 +12,17 @@ from mempool import Mempool
 from miner import Miner
 from opcodes import Opcode
 import params
-from TFM import EIP1559MultiDimensionalMechanism 
-ENV_PARAMS=params.env_params()
-LANE_PARAMS=params.gas_lanes_params()
-N_steps=ENV_PARAMS['N_steps']
 
 
-# Instantiates the code
-mempool=Mempool()
-miner=Miner(account_balance=0)
-opcodes_names=list(params.eth_opcodes().keys())
-
-
-
-def generate_random_messages(base_fees, rate_messages,rate_opcodes):
-        #TODO: This is a placeholder
+def generate_random_messages(base_fees, rate_messages,rate_opcodes,opcodes_names=None):
+        """
+        Generates a Poisson(rate_messages) number of random messages, each with
+        a Poisson(rate_opcodes) number of opcodes drawn uniformly from opcodes_names
+        (all the opcodes of params.eth_opcodes() by default) and a fee cap up to
+        20% above the base fee of each lane.
+        """
+        if opcodes_names is None:
+            opcodes_names=list(params.eth_opcodes().keys())
 
         N_messages=np.random.poisson(rate_messages)
         list_of_messages=[]
@@ -45,7 +41,15 @@ def generate_random_messages(base_fees, rate_messages,rate_opcodes):
             list_of_messages.append(Message(MESSAGE_NAME, gas_fee_cap, gas_premium, oc_list))
         return list_of_messages
     
-B0=ENV_PARAMS['initial_base_fee']
-A=generate_random_messages(B0,100,10)
+if __name__ == '__main__':
+    ENV_PARAMS=params.env_params()
+
+    # Instantiates the code
+    mempool=Mempool()
+    miner=Miner(account_balance=0)
+
+    B0=ENV_PARAMS['initial_base_fee']
+    A=generate_random_messages(B0,100,10)
+    mempool.add_messages(A)
 
 
@@ -1,5 +1,15 @@
-from pulp import *
-from typing import List, Optional
+from typing import List, Optional, Tuple
+import bisect
+import numpy as np
+
+
+def _pulp():
+    # PuLP (and CBC) are only needed by the exact solvers, import them on first use
+    try:
+        import pulp
+    except ImportError as e:
+        raise ImportError("The exact knapsack solvers need PuLP: pip install pulp") from e
+    return pulp
 
 def multidimensional_knapsack(values: List[float], weights: List[List[float]], capacity: List[float]) -> Optional[List[str]]:
     """
@@ -19,24 +29,25 @@ def multidimensional_knapsack(values: List[float], weights: List[List[float]], c
         A list of strings representing the indices of the chosen items,
         or None if no optimal solution is found.
     """
+    pulp = _pulp()
     num_items = len(values)
     num_dimensions = len(capacity)
 
     # Create the 'prob' variable to contain the problem data
-    prob = LpProblem("Multidimensional Knapsack Problem", LpMaximize)
+    prob = pulp.LpProblem("Multidimensional Knapsack Problem", pulp.LpMaximize)
 
     # Create decision variables
-    item_vars = LpVariable.dicts("Chosen", range(num_items), cat=LpBinary)
+    item_vars = pulp.LpVariable.dicts("Chosen", range(num_items), cat=pulp.LpBinary)
 
     # The objective function is added to 'prob'
-    prob += lpSum(values[i] * item_vars[i] for i in range(num_items)), "Total value of items"
+    prob += pulp.lpSum(values[i] * item_vars[i] for i in range(num_items)), "Total value of items"
 
     # The capacity constraints are added to 'prob'
     for d in range(num_dimensions):
-        prob += lpSum(weights[i][d] * item_vars[i] for i in range(num_items)) <= capacity[d], f"weight_{d}"
+        prob += pulp.lpSum(weights[i][d] * item_vars[i] for i in range(num_items)) <= capacity[d], f"weight_{d}"
 
     # The problem is solved using PuLP's choice of Solver
-    prob.solve(PULP_CBC_CMD(msg=0))
+    prob.solve(pulp.PULP_CBC_CMD(msg=0, keepFiles=False))
 
 
     # The status of the solution is printed to the screen
@@ -93,7 +104,701 @@ def multidimensional_knapsack_approx(values: List[float], weights: List[List[flo
     return [i for i in range(num_items) if chosen_items[i] == 1]
 
 
+def multidimensional_knapsack_approx_vectorized(values, weights, capacity: List[float]) -> List[int]:
+    """
+    NumPy implementation of multidimensional_knapsack_approx.
+
+    The ratios and the sort are computed on arrays and the greedy fill is done by
+    greedy_fill, which accepts whole runs of items per NumPy call. The selection
+    is identical to multidimensional_knapsack_approx for non-negative weights.
+
+    Args:
+        values: A sequence of values for each item.
+        weights: An (n, d) array (or list of lists) with the weights of each item in each dimension.
+        capacity: A list of capacities for each dimension.
+
+    Returns:
+        A list with the indices of the chosen items, in increasing order.
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape(len(values), len(capacity))
+
+    # The smallest ratio over the lanes divides by the largest weight (by the
+    # smallest one for a negative value), which gives the same floats with a
+    # single division. Column by column reductions are much faster than axis=1.
+    bottleneck = weights[:, 0].copy()
+    for d in range(1, weights.shape[1]):
+        np.maximum(bottleneck, weights[:, d], out=bottleneck)
+    negative = values < 0
+    if negative.any():
+        smallest = weights[:, 0].copy()
+        for d in range(1, weights.shape[1]):
+            np.minimum(smallest, weights[:, d], out=smallest)
+        bottleneck[negative] = smallest[negative]
+    ratio = values / (bottleneck + 1)
+    items = argsort_descending(ratio)
+
+    # np.take gathers rows several times faster than fancy indexing
+    chosen = greedy_fill(np.take(weights, items, axis=0), capacity)
+    return np.sort(items[chosen]).tolist()
+
+
+def argsort_descending(scores: np.ndarray) -> np.ndarray:
+    """
+    Indices that sort the scores in decreasing order, ties broken by increasing index.
+
+    Same order as a stable sort on -scores, but runs the (much faster) unstable
+    sort and only re-sorts the runs of tied scores.
+    """
+    keys = -scores
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    same = sorted_keys[1:] == sorted_keys[:-1]
+    if same.any():
+        tied = np.flatnonzero(np.concatenate([same, [False]]) | np.concatenate([[False], same]))
+        group = np.cumsum(np.concatenate([[True], ~same]))[tied]
+        order[tied] = order[tied][np.lexsort((order[tied], group))]
+    return order
+
+
+def greedy_fill(weights: np.ndarray, capacity: List[float], block_size: int = 4096) -> np.ndarray:
+    """
+    Greedily adds items, in the given order, while they fit in the capacity.
+
+    Equivalent to checking `current + weights[i] <= capacity` item by item, but
+    the items are processed in blocks. The longest run of items that fits is
+    found with one sequential cumulative sum per block (so the loads match the
+    item by item loop exactly) and a binary search per lane, since with
+    non-negative weights the loads never decrease. After a rejection, the items
+    of the block that no longer fit on their own are dropped at once, as they
+    can never fit again, and once an item has been rejected every new block is
+    filtered that way before its loads are summed. Item by item work only
+    happens close to saturation, where accepted runs are short.
+
+    Args:
+        weights: (n, d) array of non-negative weights, in the order to be tried.
+        capacity: A list of capacities for each dimension.
+        block_size: Number of items examined per block.
+
+    Returns:
+        np.ndarray: Boolean mask of the chosen items.
+    """
+    n, num_dimensions = weights.shape
+    capacity = np.asarray(capacity, dtype=float)
+    current_capacity = np.zeros(num_dimensions)
+    chosen = np.zeros(n, dtype=bool)
+    saturated = False
+
+    for start in range(0, n, block_size):
+        idx = np.arange(start, min(start + block_size, n))
+        block = weights[start:start + block_size]
+        if saturated:
+            fits = np.all(current_capacity + block <= capacity, axis=1)
+            idx, block = idx[fits], block[fits]
+        while len(idx):
+            load = np.cumsum(np.concatenate([(current_capacity + block[0])[None], block[1:]]), axis=0)
+            run = min(int(np.searchsorted(load[:, d], capacity[d], side='right')) for d in range(num_dimensions))
+
+            chosen[idx[:run]] = True
+            if run:
+                current_capacity = load[run - 1]
+            if run == len(idx):
+                break
+            # item idx[run] does not fit on top of the run; drop the rest that no longer fits
+            saturated = True
+            idx, block = idx[run + 1:], block[run + 1:]
+            fits = np.all(current_capacity + block <= capacity, axis=1)
+            idx, block = idx[fits], block[fits]
+
+    return chosen
+
+
+def lagrangian_bound(values, weights, capacity, prices) -> float:
+    """
+    Upper bound on the value of any feasible selection, for non-negative lane prices.
+
+    For prices p >= 0, sum_d p_d * capacity_d + sum_i max(0, values_i - p . weights_i)
+    bounds the LP relaxation, and so the binary program. Its minimum over p is
+    the LP optimum (LP duality).
+
+    Args:
+        values: A sequence of values for each item.
+        weights: An (n, d) array with the weights of each item in each dimension.
+        capacity: A list of capacities for each dimension.
+        prices: Price of a unit of weight in each dimension.
+
+    Returns:
+        float: The bound.
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape(len(values), len(capacity))
+    prices = np.asarray(prices, dtype=float)
+    reduced = values - weights @ prices
+    return float(prices @ np.asarray(capacity, dtype=float) + reduced[reduced > 0].sum())
+
+
+def lp_bound(values, weights, capacity, incumbent: float = 0., max_iter: int = 100, tol: float = 1e-4) -> float:
+    """
+    Upper bound on the value of any feasible selection, from the LP relaxation.
+
+    The best lagrangian_bound found by the subgradient steps of
+    multidimensional_knapsack_lp. Items that cannot fit on their own are left
+    out, and the bound is exact when all the others fit together.
+
+    Args:
+        values: A sequence of values for each item.
+        weights: An (n, d) array with the weights of each item in each dimension.
+        capacity: A list of capacities for each dimension.
+        incumbent: Value of a known feasible selection, the target of the steps.
+        max_iter: Maximum number of subgradient steps.
+        tol: Relative gap to the incumbent at which the steps stop.
+
+    Returns:
+        float: The bound.
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape(len(values), len(capacity))
+    capacity = np.asarray(capacity, dtype=float)
+    candidates = np.flatnonzero(np.all(weights <= capacity, axis=1) & (values > 0))
+    scaled = weights[candidates] / np.where(capacity > 0, capacity, 1)
+    if len(candidates) == 0 or np.all(scaled.sum(axis=0) <= 1):
+        return float(values[candidates].sum())
+    return float(_dual_prices(values[candidates], scaled, incumbent, max_iter, tol)[1])
+
+
+def multidimensional_knapsack_lp(values, weights, capacity: List[float], max_iter: int = 100,
+                                 n_swaps: int = 256, tol: float = 1e-4) -> Tuple[List[int], float]:
+    """
+    LP relaxation based solution to the multidimensional knapsack problem.
+
+    Sits between multidimensional_knapsack_approx_vectorized (one greedy pass)
+    and multidimensional_knapsack (exact, slow). The LP relaxation is solved in
+    its dual, by projected subgradient descent on one price per dimension, each
+    step costing one pass over the items. The selection is then rounded
+    greedily in order of value over priced weight, and improved by local
+    search: swapping a chosen item for a more valuable one that fits in its
+    place, then adding any item that still fits. The result is never worse
+    than the greedy one, and its gap is measured against the best dual bound.
+
+    Args:
+        values: A sequence of values for each item.
+        weights: An (n, d) array (or list of lists) with the weights of each item in each dimension.
+        capacity: A list of capacities for each dimension.
+        max_iter: Maximum number of subgradient steps.
+        n_swaps: Number of unchosen items (the most valuable) tried in swaps.
+        tol: Relative gap at which the subgradient steps stop.
+
+    Returns:
+        tuple: The indices of the chosen items in increasing order, and the
+        relative gap between their value and the LP bound (an upper bound on
+        the optimality gap).
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape(len(values), len(capacity))
+    capacity = np.asarray(capacity, dtype=float)
+
+    greedy = np.asarray(multidimensional_knapsack_approx_vectorized(values, weights, capacity), dtype=np.intp)
+    chosen = np.zeros(len(values), dtype=bool)
+    chosen[greedy] = True
+    incumbent = values[chosen].sum()
+
+    # Items that can never fit do not enter the relaxation. Prices are per unit
+    # of capacity, so that all the dimensions have a comparable scale.
+    candidates = np.flatnonzero(np.all(weights <= capacity, axis=1) & (values > 0))
+    scaled = weights[candidates] / np.where(capacity > 0, capacity, 1)
+    v = values[candidates]
+    if len(candidates) == 0 or np.all(scaled.sum(axis=0) <= 1):
+        # everything that can fit fits together
+        chosen = np.zeros(len(values), dtype=bool)
+        chosen[candidates] = True
+        return np.flatnonzero(chosen).tolist(), 0.0
+
+    prices, bound = _dual_prices(v, scaled, incumbent, max_iter, tol)
+
+    # Round: best value per priced weight first, then the most valuable
+    priced = scaled @ prices
+    with np.errstate(divide='ignore'):
+        score = np.where(priced > 0, v / priced, np.inf)
+    order = candidates[np.lexsort((-v, -score))]
+    rounded = np.zeros(len(values), dtype=bool)
+    rounded[order[greedy_fill(weights[order], capacity)]] = True
+    _local_search(values, weights, capacity, rounded, order, n_swaps)
+    if values[rounded].sum() >= incumbent:
+        chosen = rounded
+
+    value = values[chosen].sum()
+    gap = max(bound - value, 0.) / bound if bound > 0 else 0.
+    return np.flatnonzero(chosen).tolist(), gap
+
+
+def _dual_prices(values, weights, incumbent, max_iter, tol):
+    # Projected subgradient descent on the Lagrangian dual of
+    # max v.x, weights.T x <= 1, 0 <= x <= 1, with Polyak steps towards the
+    # value of the incumbent. Returns the best prices found and their bound.
+    n_dims = weights.shape[1]
+    prices = np.full(n_dims, values.sum() / max(weights.sum(), 1e-300))
+    best_prices, best_bound = prices, np.inf
+    theta, stalled = 1.0, 0
+    for _ in range(max_iter):
+        reduced = values - weights @ prices
+        take = (reduced > 0).astype(float)
+        bound = prices.sum() + take @ reduced
+        if bound < best_bound:
+            best_prices, best_bound, stalled = prices, bound, 0
+        else:
+            stalled += 1
+            if stalled >= 5:
+                theta, stalled = theta / 2, 0
+        if best_bound - incumbent <= tol * best_bound:
+            break
+        subgradient = 1 - take @ weights
+        subgradient[(prices <= 0) & (subgradient > 0)] = 0
+        norm = subgradient @ subgradient
+        if norm == 0:
+            break
+        prices = np.maximum(prices - theta * (bound - incumbent) / norm * subgradient, 0)
+    return best_prices, best_bound
+
+
+def _local_search(values, weights, capacity, chosen, order, n_swaps):
+    # Swap moves: replace a chosen item by a more valuable unchosen one that fits
+    # in the capacity it frees, taking the least valuable such item. Then add
+    # moves: any unchosen item, in the given order, that still fits.
+    inside = np.flatnonzero(chosen)
+    inside_values = values[inside]
+    # One contiguous row per lane, so that the most demanding lane is scanned first
+    inside_weights = np.ascontiguousarray(weights[inside].T)
+    residual = capacity - inside_weights.sum(axis=1)
+    # Margin absorbing the rounding errors of the running residual
+    margin = 1e-9 * capacity
+    scale = np.where(capacity > 0, capacity, 1)
+    unchosen = np.flatnonzero(~chosen)
+    tries = unchosen[argsort_descending(values[unchosen])[:n_swaps]]
+    if len(inside):
+        tries = tries[values[tries] > inside_values.min()]
+    for j in tries.tolist():
+        need = weights[j] - residual + margin
+        lane = int(np.argmax(need / scale))
+        fits = np.flatnonzero(inside_weights[lane] >= need[lane])
+        fits = fits[(inside_values[fits] < values[j]) & np.all(inside_weights[:, fits].T >= need, axis=1)]
+        if not len(fits):
+            continue
+        k = fits[np.argmin(inside_values[fits])]
+        chosen[inside[k]], chosen[j] = False, True
+        residual = residual + inside_weights[:, k] - weights[j]
+        inside[k], inside_values[k], inside_weights[:, k] = j, values[j], weights[j]
+
+    residual = capacity - weights[chosen].sum(axis=0)
+    rest = order[~chosen[order]]
+    rest = rest[np.all(weights[rest] <= residual, axis=1)]
+    chosen[rest[greedy_fill(weights[rest], residual)]] = True
+
+def multidimensional_knapsack_dual(values, weights, capacity: List[float], prices=None, max_iter: int = 8,
+                                   step: float = 1.0, tol: float = 0.02) -> Tuple[List[int], np.ndarray]:
+    """
+    Greedy solution to the multidimensional knapsack problem with lane prices.
+
+    Items are scored by their value over the priced sum of their weights,
+    value / sum_d prices_d * weights_d, instead of by their smallest
+    value-to-weight ratio, so only the weight in the lanes that are actually
+    scarce counts against an item. After each greedy pass, the prices of the
+    lanes filled above the mean utilisation are raised and those of the others
+    lowered (a multiplicative subgradient step), and the greedy is run again,
+    until the lanes are all full or equally used, or after max_iter passes. The
+    best selection found is returned, and it is never worse than the one of
+    multidimensional_knapsack_approx_vectorized. The prices of that selection
+    (the initial ones if no pass beat the greedy) are returned too, so that
+    the next block can start from them.
+
+    Args:
+        values: A sequence of values for each item.
+        weights: An (n, d) array (or list of lists) with the weights of each item in each dimension.
+        capacity: A list of capacities for each dimension.
+        prices: Initial price of a unit of weight in each dimension, e.g. the
+            final prices of the previous block. Only their ratios matter.
+            Defaults to the same price for a whole lane in every lane.
+        max_iter: Maximum number of greedy passes.
+        step: Size of the price updates.
+        tol: Utilisation gap under which the lanes are considered balanced.
+
+    Returns:
+        tuple: A list with the indices of the chosen items, in increasing
+        order, and the price of a unit of weight in each dimension with which
+        they were chosen.
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape(len(values), len(capacity))
+    capacity = np.asarray(capacity, dtype=float)
+    scale = np.where(capacity > 0, capacity, 1)
+    # Prices of a whole lane, so that lanes of different widths are comparable
+    prices = np.ones(len(capacity)) if prices is None else np.asarray(prices, dtype=float) * scale
+    if not np.all(prices > 0):
+        prices = np.where(prices > 0, prices, prices[prices > 0].min(initial=1.))
+
+    best = np.asarray(multidimensional_knapsack_approx_vectorized(values, weights, capacity), dtype=np.intp)
+    best_value = values[best].sum()
+    best_prices = prices
+    for _ in range(max_iter):
+        priced = weights @ (prices / scale)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.where(priced > 0, values / priced, np.inf)
+        order = argsort_descending(score)
+        chosen = order[greedy_fill(weights[order], capacity)]
+        value = values[chosen].sum()
+        if value > best_value:
+            best, best_value, best_prices = chosen, value, prices
+
+        utilisation = weights[chosen].sum(axis=0) / scale
+        if np.all(utilisation >= 1 - tol) or np.ptp(utilisation) <= tol:
+            break
+        prices = prices * np.exp(step * (utilisation - utilisation.mean()))
+    # Back to prices of a unit of weight, normalised to a geometric mean of 1
+    prices = best_prices / scale
+    return np.sort(best).tolist(), prices / np.exp(np.mean(np.log(prices)))
+
+
+def compress_prices(prices, max_ratio: float = 100.) -> np.ndarray:
+    """
+    Brings positive prices within a factor max_ratio of each other.
+
+    The logarithms of the prices are centred and shrunk linearly, so their order
+    is kept, e.g. to start multidimensional_knapsack_dual from base fees whose
+    ratios across lanes span many orders of magnitude. Non-positive prices are
+    replaced by the smallest positive one.
+
+    Args:
+        prices: The prices.
+        max_ratio: Largest ratio between two of the compressed prices.
+
+    Returns:
+        np.ndarray: The compressed prices, with a geometric mean of 1.
+    """
+    prices = np.asarray(prices, dtype=float)
+    positive = prices > 0
+    if not np.any(positive):
+        return np.ones(len(prices))
+    logs = np.log(np.where(positive, prices, prices[positive].min()))
+    logs -= logs.mean()
+    spread = np.ptp(logs)
+    if spread > np.log(max_ratio):
+        logs *= np.log(max_ratio) / spread
+    return np.exp(logs)
+
+
+class IncrementalKnapsackBuilder:
+    # The min-ratio score does not depend on the capacities, so the order never
+    # needs to be rebuilt when they change.
+    capacity_dependent = False
+
+    def __init__(self, N_lanes: int, block_size: int = 1024):
+        """
+        Stateful version of multidimensional_knapsack_approx.
+
+        Keeps the items sorted by decreasing score (ties broken by increasing
+        key) across blocks, in a blocked sorted list: consecutive runs of at
+        most 2 * block_size items, each stored in its own arrays. Arriving and
+        departing items are found by a binary search over the first item of
+        each run, then inserted or deleted within their run, so an update costs
+        O(log n + block_size) whatever the number n of items, and the order is
+        never rebuilt from scratch. Given the same items, select returns the
+        same selection as multidimensional_knapsack_approx as long as keys
+        increase in the order the items were added (as mempool keys do).
+
+        The builder is meant to be attached to a Mempool, which calls
+        on_insert/on_remove whenever its content changes.
+
+        Args:
+            N_lanes: Number of dimensions of the weights.
+            block_size: Target number of items per run.
+        """
+        self.N_lanes = N_lanes
+        self.block_size = block_size
+        self.capacity = None
+        # Runs of [scores, keys, values, weights], and the (score, key) of their first item
+        self._blocks = []
+        self._firsts = []
+        self._score_of = {}
+        self._ordered = None
+
+    def __len__(self):
+        return len(self._score_of)
+
+    def score(self, values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Sort key of each item (lower is better): minus the smallest value-to-weight ratio over lanes.
+        """
+        return -np.min(values[:, None] / (weights + 1), axis=1)
+
+    def on_insert(self, keys, columns: dict):
+        """
+        Adds items to the sorted index.
+
+        Args:
+            keys: Keys of the new items.
+            columns: Dict with the 'value' and 'gas_limit' (weights) of the new items.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(keys):
+            return
+        values = np.asarray(columns['value'], dtype=float)
+        weights = np.asarray(columns['gas_limit'], dtype=float).reshape(len(keys), self.N_lanes)
+        scores = self.score(values, weights)
+
+        order = np.lexsort((keys, scores))
+        keys, values, weights, scores = keys[order], values[order], weights[order], scores[order]
+        items = list(zip(scores.tolist(), keys.tolist()))
+        self._score_of.update(zip(keys.tolist(), scores.tolist()))
+        if not self._blocks:
+            self._blocks.append(_empty_run(self.N_lanes))
+            self._firsts.append(items[0])
+
+        # Runs of the new items, processed from the last so that splitting a run
+        # leaves the indices of the previous ones valid
+        runs = [max(bisect.bisect_right(self._firsts, item) - 1, 0) for item in items]
+        for b, start, end in reversed(_groups(runs)):
+            run = self._blocks[b]
+            positions = [_locate(run, sc, k) for sc, k in items[start:end]]
+            self._set_run(b, [np.insert(run[0], positions, scores[start:end]),
+                              np.insert(run[1], positions, keys[start:end]),
+                              np.insert(run[2], positions, values[start:end]),
+                              np.insert(run[3], positions, weights[start:end], axis=0)])
+
+    def on_remove(self, keys):
+        """
+        Removes items from the sorted index.
+
+        Args:
+            keys: Keys of the items to be removed.
+        """
+        items = sorted((self._score_of.pop(k), k) for k in np.asarray(keys, dtype=np.int64).tolist())
+        runs = [bisect.bisect_right(self._firsts, item) - 1 for item in items]
+        for b, start, end in reversed(_groups(runs)):
+            run = self._blocks[b]
+            positions = [_locate(run, sc, k) for sc, k in items[start:end]]
+            self._set_run(b, [np.delete(run[0], positions), np.delete(run[1], positions),
+                              np.delete(run[2], positions), np.delete(run[3], positions, axis=0)])
+
+    def rescore(self):
+        """
+        Recomputes the score of every item and rebuilds the sorted index.
+        """
+        _, keys, values, weights = self._concatenate()
+        scores = self.score(values, weights)
+        order = np.lexsort((keys, scores))
+        self._blocks, self._firsts = [], []
+        self._score_of = dict(zip(keys[order].tolist(), scores[order].tolist()))
+        if len(order):
+            self._blocks.append([scores[order], keys[order], values[order], weights[order]])
+            self._firsts.append(None)
+            self._set_run(0, self._blocks[0])
+
+    def select(self, capacity: List[float]) -> np.ndarray:
+        """
+        Greedily fills the capacity in score order.
+
+        Args:
+            capacity: A list of capacities for each dimension.
+
+        Returns:
+            np.ndarray: The keys of the chosen items, in increasing order.
+        """
+        if self.capacity_dependent and self.capacity is not None and list(capacity) != list(self.capacity):
+            self.rescore()
+        self.capacity = list(capacity)
+
+        if self._ordered is None:
+            _, keys, _, weights = self._concatenate()
+            self._ordered = keys, weights
+        keys, weights = self._ordered
+        chosen = greedy_fill(weights, capacity)
+        return np.sort(keys[chosen])
+
+    def _set_run(self, b: int, run: list):
+        # Replaces run b, splitting it if it grew too long and dropping it if empty
+        self._ordered = None
+        n = len(run[1])
+        if n == 0:
+            del self._blocks[b], self._firsts[b]
+            return
+        chunks = [run] if n <= 2 * self.block_size else \
+            [[column[i:i + self.block_size] for column in run] for i in range(0, n, self.block_size)]
+        self._blocks[b:b + 1] = chunks
+        self._firsts[b:b + 1] = [(float(chunk[0][0]), int(chunk[1][0])) for chunk in chunks]
+
+    def _concatenate(self):
+        if not self._blocks:
+            return _empty_run(self.N_lanes)
+        return [np.concatenate([run[c] for run in self._blocks]) for c in range(4)]
+
+
+def _empty_run(N_lanes: int) -> list:
+    return [np.empty(0), np.empty(0, dtype=np.int64), np.empty(0), np.empty((0, N_lanes))]
+
+
+def _locate(run: list, score: float, key: int) -> int:
+    # Position of (score, key) in the lexicographic order of a run
+    scores, keys = run[0], run[1]
+    lo = np.searchsorted(scores, score, side='left')
+    hi = np.searchsorted(scores, score, side='right')
+    return int(lo + np.searchsorted(keys[lo:hi], key))
+
+
+def _groups(labels: list) -> list:
+    # (label, start, end) of each run of equal consecutive labels
+    groups, start = [], 0
+    for i in range(1, len(labels) + 1):
+        if i == len(labels) or labels[i] != labels[start]:
+            groups.append((labels[start], start, i))
+            start = i
+    return groups
+
+
+class ExactKnapsackSolver:
+    def __init__(self, N_lanes: int, time_limit: Optional[float] = None):
+        """
+        Persistent version of multidimensional_knapsack.
+
+        The binary program is kept across blocks: arriving items add a column
+        (a variable with its objective and capacity coefficients) and departing
+        items remove theirs, instead of rebuilding the model for every block.
+        This only saves building the PuLP model in Python: PULP_CBC_CMD still
+        writes the whole model to a temporary MPS file (removed afterwards, so
+        nothing is left in the working directory) and starts CBC for every solve.
+        Each solve can be seeded with an incumbent (typically the greedy
+        selection) and is stopped after time_limit seconds, returning the best
+        solution found so far and its gap to the LP relaxation bound.
+
+        The solver is meant to be attached to a Mempool, which calls
+        on_insert/on_remove whenever its content changes.
+
+        Args:
+            N_lanes: Number of dimensions of the weights.
+            time_limit: Wall-clock budget of CBC per solve, in seconds. None means no limit.
+        """
+        self.N_lanes = N_lanes
+        self.time_limit = time_limit
+        self.gap = None
+        self._vars = {}
+        self._columns = {}
+        self._n_stale = 0
+        self._prob = self._new_problem()
+
+    def __len__(self):
+        return len(self._vars)
+
+    def on_insert(self, keys, columns: dict):
+        """
+        Adds a column to the model for each new item.
+
+        Args:
+            keys: Keys of the new items.
+            columns: Dict with the 'value' and 'gas_limit' (weights) of the new items.
+        """
+        pulp = _pulp()
+        values = np.asarray(columns['value'], dtype=float).tolist()
+        weights = np.asarray(columns['gas_limit'], dtype=float).reshape(len(values), self.N_lanes).tolist()
+        objective = self._prob.objective
+        lanes = [_expression(self._prob.constraints[f"weight_{d}"]) for d in range(self.N_lanes)]
+
+        for k, v, w in zip(np.asarray(keys).tolist(), values, weights):
+            var = pulp.LpVariable(f"Chosen_{k}", cat=pulp.LpBinary)
+            self._vars[k] = var
+            self._columns[k] = (v, w)
+            objective[var] = v
+            for d in range(self.N_lanes):
+                lanes[d][var] = w[d]
+
+    def on_remove(self, keys):
+        """
+        Removes the columns of departing items from the model.
+
+        Columns are first disabled by fixing their variable to 0, and dropped
+        from the model once disabled columns outnumber the live ones.
+
+        Args:
+            keys: Keys of the items to be removed.
+        """
+        for k in np.asarray(keys).tolist():
+            var = self._vars.pop(k)
+            del self._columns[k]
+            var.upBound = 0
+            var.setInitialValue(0)
+        self._n_stale += len(keys)
+
+        if self._n_stale > max(len(self._vars), 1000):
+            self._prob = self._new_problem(self._prob)
+            self._n_stale = 0
+
+    def solve(self, capacity: List[float], incumbent=None) -> Tuple[np.ndarray, Optional[float]]:
+        """
+        Solves the model for the given capacities.
+
+        Args:
+            capacity: A list of capacities for each dimension.
+            incumbent: Keys of a feasible selection used to warm start CBC.
+
+        Returns:
+            tuple: The keys of the chosen items (in increasing order) and the
+            relative gap between their value and an upper bound on the optimum:
+            0 if CBC proved the selection optimal, otherwise the LP relaxation
+            bound. None if CBC found no solution.
+        """
+        if not self._vars:
+            self.gap = 0.0
+            return np.empty(0, dtype=np.int64), self.gap
+
+        for d in range(self.N_lanes):
+            self._prob.constraints[f"weight_{d}"].changeRHS(capacity[d])
+
+        warm_start = incumbent is not None
+        if warm_start:
+            incumbent = set(np.asarray(incumbent).tolist())
+            for k, var in self._vars.items():
+                var.setInitialValue(1 if k in incumbent else 0)
+
+        pulp = _pulp()
+        self._prob.solve(pulp.PULP_CBC_CMD(msg=0, warmStart=warm_start, timeLimit=self.time_limit,
+                                           keepFiles=False))
+
+        if any(var.varValue is None for var in self._vars.values()):
+            # no feasible solution within the budget
+            self.gap = None
+            chosen = sorted(incumbent) if warm_start else []
+            return np.asarray(chosen, dtype=np.int64), self.gap
+
+        chosen = [k for k, var in self._vars.items() if var.varValue > 0.5]
+        if self._prob.sol_status == pulp.LpSolutionOptimal:
+            self.gap = 0.0
+        else:
+            values = np.array([self._columns[k][0] for k in self._vars], dtype=float)
+            weights = np.array([self._columns[k][1] for k in self._vars], dtype=float).reshape(-1, self.N_lanes)
+            value = sum(self._columns[k][0] for k in chosen)
+            bound = lp_bound(values, weights, capacity, incumbent=value)
+            self.gap = max(bound - value, 0.) / bound if bound > 0 else 0.
+        return np.sort(np.asarray(chosen, dtype=np.int64)), self.gap
+
+    def _new_problem(self, old=None):
+        pulp = _pulp()
+        prob = pulp.LpProblem("Multidimensional_Knapsack_Problem", pulp.LpMaximize)
+        live = set(self._vars.values())
+        if old is None:
+            prob += pulp.LpAffineExpression(), "Total value of items"
+        else:
+            prob += pulp.LpAffineExpression({var: c for var, c in old.objective.items() if var in live}), \
+                "Total value of items"
+
+        for d in range(self.N_lanes):
+            terms = {}
+            if old is not None:
+                terms = {var: c for var, c in _expression(old.constraints[f"weight_{d}"]).items() if var in live}
+            prob += pulp.LpConstraint(pulp.LpAffineExpression(terms), pulp.LpConstraintLE, f"weight_{d}", 0), \
+                f"weight_{d}"
+        return prob
+
 
+def _expression(constraint):
+    # PuLP >= 3 wraps the expression of a constraint, older versions subclass it
+    return getattr(constraint, 'expr', constraint)
 
 
 if __name__=='__main__':
@@ -1,118 +1,137 @@
 import numpy as np
-import tqdm
-import matplotlib.pyplot as plt
-from message import Message
 from mempool import Mempool
 from miner import Miner
-from opcodes import Opcode
+from demand import MessageGenerator, RandomDemand
 import params
 from TFM import EIP1559MultiDimensionalMechanism
-from block import Block
+from recorder import MetricsRecorder
+from rng import RandomStreams
+from simulation import run_step
 
 # Load environment and lane parameters
 ENV_PARAMS = params.env_params()
-LANE_PARAMS = params.gas_lanes_params()
+LANE_PARAMS = params.gas_lanes_params(ENV_PARAMS)
 N_STEPS = 2880  # Number of steps in the simulation
 
 # Instantiates the code
 tfm = EIP1559MultiDimensionalMechanism(LANE_PARAMS)
-mempool = Mempool()
+mempool = Mempool(eviction_policy=ENV_PARAMS.get('eviction_policy'), base_fees=tfm.get_fees(),
+                  prune_priced_out=ENV_PARAMS.get('prune_priced_out', False), ttl=ENV_PARAMS.get('ttl'))
 miner = Miner(account_balance=0)
-opcodes_names = list(params.eth_opcodes().keys())
+message_generator = MessageGenerator(ENV_PARAMS['N_lanes'], rate_opcodes=ENV_PARAMS['rate_opcodes'],
+                                     rate_sps=ENV_PARAMS['rate_sps'], lane_rules=ENV_PARAMS.get('lane_rules'))
 
-# Chain and lists to store simulation results
-chain = []
-ml = []
-mg = []
+# Per-block metrics of the simulation
+recorder = MetricsRecorder(ENV_PARAMS['N_lanes'], capacity=N_STEPS)
 
 # Function to compute the number of messages based on base_fees
-def compute_rate_message(base_fees):
-    N_messages = np.random.poisson(10)
+def compute_rate_message(base_fees, rate_messages=ENV_PARAMS['rate_messages'], rng=None):
+    if rng is None:
+        rng = np.random
+    N_messages = rng.poisson(rate_messages)
     return N_messages
 
 # Function to generate random messages
-def generate_random_messages(N_messages,base_fees):
-    # Constants for Poisson distributions
-    rate_opcodes = 100
-    rate_sps = 2
-    # Create empty list for storing messages
-    list_of_messages = []
-
-    for _ in range(N_messages):
-        oc_list = []
-        K = np.random.poisson(rate_opcodes)
-        S = np.random.poisson(rate_sps)
-        sampled_opcodes = np.random.choice(opcodes_names, K)
-
-        aux_list = list(sampled_opcodes)
-        oc_list = [Opcode(name=a) for a in aux_list]
-        for _ in range(S):
-            oc_list.append(Opcode(name='SP', gas_used=1e8 * np.random.random()))
-
-        MESSAGE_NAME = 'msg'
-        gas_fee_cap = [bf * (1 + 0.2 * np.random.random()) for bf in base_fees]
-        gas_premium = [gas_fee_cap[i] - base_fees[i] for i in range(len(base_fees))]
-
-        list_of_messages.append(Message(MESSAGE_NAME, gas_fee_cap, gas_premium, oc_list))
-    return list_of_messages
-
-# Function to sample OOM (Out of Memory) value
-def sample_oom():
-    r = np.random.randint(7, 10)
-    return np.random.random() * 10 ** -r
+def generate_random_messages(N_messages,base_fees,generator=None):
+    if generator is None:
+        generator = message_generator
+    return generator.generate(N_messages, base_fees)
+
+# Function to advance a simulation by one step
+def simulation_step(tfm, mempool, miner, max_mempool_length=2000, env_params=None, generator=None, streams=None,
+                    demand=None, trace=None, profiler=None):
+    """
+    Runs one step of the simulation: message arrivals, eviction, block proposal
+    and fee update (see simulation.run_step), defaulting to the components of
+    this module.
+
+    Args:
+        tfm: The EIP1559MultiDimensionalMechanism of the simulation.
+        mempool: The Mempool of the simulation.
+        miner: The Miner proposing the block.
+        max_mempool_length: Maximum number of messages kept in the mempool.
+        env_params: Environment parameters of the simulation. Defaults to ENV_PARAMS.
+        generator: MessageGenerator of the simulation. Defaults to message_generator.
+        streams: RandomStreams of the arrivals and capacity shocks. Defaults to the global np.random state.
+        demand: Demand source of the step. Defaults to a RandomDemand built from
+            env_params, generator and streams.
+        trace: Optional demand_trace.TraceWriter recording the arrivals of the step.
+        profiler: Optional profiling.StepProfiler timing the phases of the step.
+
+    Returns:
+        Block: The proposed block, or None if the proposal failed.
+    """
+    if env_params is None:
+        env_params = ENV_PARAMS
+    if demand is None:
+        demand = RandomDemand(env_params, message_generator if generator is None else generator, streams)
+    return run_step(tfm, mempool, miner, demand, env_params['N_lanes'], max_mempool_length, trace, profiler)
 
 # Function to run the simulation
-def run_simulation(max_mempool_length=2000):
-    for _ in tqdm.tqdm(range(N_STEPS)):
-        # samples number of messages to be added to the Mempool
-        N_messages = compute_rate_message(tfm.get_fees())
-        list_of_messages = generate_random_messages(N_messages,tfm.get_fees())
-
-        # Add messages to the mempool
-        [mempool.add_message(m) for m in list_of_messages]
-        capacity = ENV_PARAMS['lane_widths']
-
-        # Half the capacity of the lanes if a certain condition is met
-        if np.random.random() < 0.5:
-            bfs = np.array([tfm.tfms[i].base_fee for i in range(ENV_PARAMS['N_lanes'])])
-            if all(bfs < sample_oom()):
-                capacity = ENV_PARAMS['lane_widths']
-            else:
-                capacity = list(np.array(ENV_PARAMS['lane_widths']) * 0.5 * np.random.random())
-
-        # Caps the maximum mempool size to solve a faster knapsack problem
-        if max_mempool_length < len(mempool.messages):
-            diff = len(mempool.messages) - max_mempool_length
-            diff = list(np.arange(diff))
-            to_remove = [mempool.messages[i] for i in diff]
-            mempool.remove(to_remove)
-
-        # Try to propose a block and add it to the chain
-        try:
-            proposed_block = miner.propose_block(mempool, capacity)
-            to_remove = [mempool.messages[i] for i in proposed_block]
-            block = Block(to_remove, N_lanes=ENV_PARAMS['N_lanes'])
-            mempool.remove(block.messages)
-            chain.append(block)
-            tfm.update_fees(block.gas_used)
-            ml.append(len(mempool.messages))
-            mg.append(sum([sum(m.gas_used) for m in mempool.messages]))
-        except Exception as e:
-            print(f"Error occurred while proposing a block: {str(e)}")
+def run_simulation(max_mempool_length=2000, writer=None, seed=None, demand=None, trace=None, profiler=None,
+                   summary=None):
+    """
+    Runs the simulation for N_STEPS steps, recording every block.
+
+    Args:
+        max_mempool_length: Maximum number of messages kept in the mempool.
+        writer: Optional output.SimulationWriter to which every step is streamed.
+        seed: Seed of the RandomStreams of the run. By default the global
+            np.random state is used.
+        demand: Demand source of the run, e.g. a demand_trace.TraceReplay. By
+            default the demand is sampled.
+        trace: Optional demand_trace.TraceWriter recording the arrivals of the run.
+        profiler: Optional profiling.StepProfiler timing the phases of every step.
+        summary: Optional recorder.SummaryRecorder also recording every block,
+            in constant memory.
+    """
+    generator, streams = message_generator, None
+    if seed is not None:
+        streams = RandomStreams(seed)
+        generator = MessageGenerator(ENV_PARAMS['N_lanes'], rate_opcodes=ENV_PARAMS['rate_opcodes'],
+                                     rate_sps=ENV_PARAMS['rate_sps'], lane_rules=ENV_PARAMS.get('lane_rules'),
+                                     rng=streams.opcodes, fee_rng=streams.fees)
+    import tqdm
+
+    for step in tqdm.tqdm(range(N_STEPS)):
+        if profiler is not None:
+            profiler.start_step(step)
+        block = simulation_step(tfm, mempool, miner, max_mempool_length, generator=generator, streams=streams,
+                                demand=demand, trace=trace, profiler=profiler)
+        if profiler is not None:
+            profiler.end_step()
+        if writer is not None:
+            writer.write(step, block, tfm.get_fees(), mempool)
+        if block is None:
             continue
-
-
-def plot_base_fee_evolution():
-    for i in range(ENV_PARAMS['N_lanes']):
-        if ENV_PARAMS['N_lanes']>1:
+        recorder.record(block, tfm.get_fees(), mempool)
+        if summary is not None:
+            summary.record(block, tfm.get_fees(), mempool)
+    if profiler is not None:
+        profiler.stop()
+
+
+def _epochs(metrics):
+    # Downsampled summaries have one point per bucket of blocks
+    steps = getattr(metrics, 'steps', None)
+    return steps if steps is not None else np.arange(len(metrics.base_fee))
+
+def plot_base_fee_evolution(metrics=None):
+    import matplotlib.pyplot as plt
+
+    if metrics is None:
+        metrics = recorder
+    for i in range(metrics.N_lanes):
+        bf=metrics.base_fee[:,i]
+        if metrics.N_lanes>1:
             if i==0:
-                plt.semilogy(tfm.tfms[i].base_fee_list,label='priority lane')
+                plt.semilogy(_epochs(metrics),bf,label='priority lane')
 
             else:
-                plt.semilogy(tfm.tfms[i].base_fee_list,label='other lane ')
+                plt.semilogy(_epochs(metrics),bf,label='other lane ')
 
         else:
-            plt.semilogy(tfm.tfms[i].base_fee_list,label='unique')
+            plt.semilogy(_epochs(metrics),bf,label='unique')
 
         
     plt.xlabel("Epochs")
@@ -123,17 +142,21 @@ def plot_base_fee_evolution():
     #plt.show()
     
     
-def plot_gas_usage_evolution():
+def plot_gas_usage_evolution(metrics=None):
+    import matplotlib.pyplot as plt
+
+    if metrics is None:
+        metrics = recorder
     
-    for i in range(ENV_PARAMS['N_lanes']):
-        gu=[chain[n].gas_used[i] for n in range(len(chain))]
-        if ENV_PARAMS['N_lanes']>1:
+    for i in range(metrics.N_lanes):
+        gu=metrics.gas_used[:,i]
+        if metrics.N_lanes>1:
             if i==0:
-                plt.plot(gu,label='priority lane')
+                plt.plot(_epochs(metrics),gu,label='priority lane')
             else:
-                plt.plot(gu,label='Other lane')
+                plt.plot(_epochs(metrics),gu,label='Other lane')
         else:
-            plt.plot(gu,label='One dimensional case')
+            plt.plot(_epochs(metrics),gu,label='One dimensional case')
 
 
     plt.xlabel("Epochs")
@@ -143,9 +166,13 @@ def plot_gas_usage_evolution():
     plt.grid(True)
     #plt.show()
 
-def plot_mempool_size_evolution():
+def plot_mempool_size_evolution(metrics=None):
+    import matplotlib.pyplot as plt
+
+    if metrics is None:
+        metrics = recorder
     
-    plt.plot(ml)
+    plt.plot(_epochs(metrics),metrics.mempool_count)
     plt.xlabel("Epochs")
     plt.ylabel("number of messages in mempool")
     plt.title("Evolution of mempool size")
@@ -153,9 +180,13 @@ def plot_mempool_size_evolution():
     plt.grid(True)
     #plt.show()
 
-def plot_mempool_gas_evolution():
+def plot_mempool_gas_evolution(metrics=None):
+    import matplotlib.pyplot as plt
+
+    if metrics is None:
+        metrics = recorder
     
-    plt.plot(mg)
+    plt.plot(_epochs(metrics),metrics.mempool_gas.sum(axis=1))
     plt.xlabel("Epochs")
     plt.ylabel("Total gas in mempool")
     plt.title("Evolution of mempool gas demand")
@@ -164,7 +195,8 @@ def plot_mempool_gas_evolution():
     #plt.show()
 
 if __name__ == '__main__':
-    
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(16,16))
     plt.rcParams.update({'font.size': 22})
 
@@ -5,13 +5,105 @@ Created on Fri Jun 16 12:31:57 2023
 
 @author: juanpablomadrigalcianci
 """
-from message import Message
+import numpy as np
+import params
+from eviction import EvictionIndex
+from pruning import PruningIndex
+
+env_params = params.defaults()
+N_lanes = env_params['N_lanes']
+
+
 class Mempool:
-    def __init__(self,initial_messages:list=[]):
+    def __init__(self, initial_messages: list = None, N_lanes: int = N_lanes, capacity: int = 1024,
+                 eviction_policy: str = None, max_length: int = None, base_fees=None,
+                 prune_priced_out: bool = False, ttl: int = None):
         """
         Represents a mempool that holds a collection of messages.
+
+        The message parameters are stored column-wise in preallocated NumPy
+        arrays. Rows are appended in arrival order and deleted by clearing their
+        bit in a tombstone bitmap. A Fenwick tree counts the dead rows, so that
+        positions (ranks among the live rows) and storage slots are converted in
+        O(log n): removing k messages, by key or by position, costs
+        O(k log n) and never scans the pool. Dead rows are squeezed out
+        (keeping the arrival order) once they outnumber the live ones or when
+        the storage is full, so compaction is amortised over the removals.
+        Until then, reading a whole column gathers its live rows into a cached
+        copy.
+
+        Args:
+            initial_messages (list, optional): Messages to start the mempool with.
+            N_lanes (int): Number of lanes of the gas vectors.
+            capacity (int): Number of rows to preallocate. The columns grow when full.
+            eviction_policy (str, optional): Policy of the messages dropped by evict (see
+                eviction.EvictionIndex). By default the oldest messages are dropped.
+            max_length (int, optional): If given, the lowest priority messages are
+                evicted on every insertion that takes the pool over this size.
+            base_fees (optional): Current base fees, needed by price dependent eviction
+                policies and used by the 'dual' block building strategy.
+            prune_priced_out (bool): If True, set_base_fees removes the messages whose
+                fee cap is below the base fee of some lane.
+            ttl (int, optional): If given, tick removes the messages that have been in
+                the mempool for ttl steps.
+        """
+        self.N_lanes = N_lanes
+        self._capacity = max(int(capacity), 1)
+        self._top = 0
+        self._n_live = 0
+        self._next_key = 0
+        self._key_of = {}
+        self._cache = {}
+        self._listeners = []
+        self._total_gas_used = np.zeros(N_lanes)
+        self.max_length = max_length
+        self.n_evicted = 0
+        self.n_pruned = 0
+        self.n_expired = 0
+        self.step = 0
+
+        self._gas_fee_cap = np.zeros((self._capacity, N_lanes))
+        self._gas_premium = np.zeros((self._capacity, N_lanes))
+        self._gas_used = np.zeros((self._capacity, N_lanes))
+        self._gas_limit = np.zeros((self._capacity, N_lanes))
+        self._value = np.zeros(self._capacity)
+        self._key = np.zeros(self._capacity, dtype=np.int64)
+        self._arrival = np.zeros(self._capacity, dtype=np.int64)
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._objects = np.empty(self._capacity, dtype=object)
+        self._dead = _Tombstones(self._capacity)
+
+        self.base_fees = None if base_fees is None else np.asarray(base_fees, dtype=float)
+        self.eviction = None
+        if eviction_policy is not None:
+            self.eviction = EvictionIndex(eviction_policy, base_fees)
+            self.attach(self.eviction)
+        self.pruning = None
+        if prune_priced_out or ttl is not None:
+            self.pruning = PruningIndex(N_lanes, priced_out=prune_priced_out, ttl=ttl)
+            self.attach(self.pruning)
+
+        if initial_messages:
+            self.add_messages(initial_messages)
+
+    def __len__(self):
+        return self._n_live
+
+    @property
+    def messages(self) -> list:
+        """
+        The messages in the mempool, oldest first.
+        """
+        return list(self._objects[self._live_slots()])
+
+    def get_messages(self, indices) -> list:
         """
-        self.messages = initial_messages
+        Returns the messages at the given positions of the mempool.
+
+        Args:
+            indices: Positions, as returned by the knapsack solvers.
+        """
+        return list(self._objects[self._slots(indices)])
 
     def add_message(self, message):
         """
@@ -20,13 +112,103 @@ class Mempool:
         Args:
             message (Message): The message to be added.
         """
-        self.messages.append(message)
-        
-    def remove(self,list_of_messages):
-        for m in list_of_messages:
-            self.remove_message(m)
-        
-        
+        self.add_messages([message])
+
+    def add_messages(self, messages: list):
+        """
+        Add a batch of messages to the mempool.
+
+        Args:
+            messages (list): The messages to be added.
+
+        Raises:
+            ValueError: If a message is already in the mempool, or given twice.
+        """
+        n_new = len(messages)
+        if n_new == 0:
+            return
+        ids = [id(m) for m in messages]
+        if len(set(ids)) != n_new or any(i in self._key_of for i in ids):
+            raise ValueError("Message is already in the mempool")
+        self._reserve(n_new)
+        self._cache.clear()
+
+        rows = slice(self._top, self._top + n_new)
+        self._gas_fee_cap[rows] = [m.gas_fee_cap for m in messages]
+        self._gas_premium[rows] = [m.gas_premium for m in messages]
+        self._gas_used[rows] = [m.gas_used for m in messages]
+        self._gas_limit[rows] = [m.gas_limit for m in messages]
+        self._value[rows] = self._gas_premium[rows].sum(axis=1)
+        self._total_gas_used += self._gas_used[rows].sum(axis=0)
+        self._key[rows] = np.arange(self._next_key, self._next_key + n_new)
+        self._arrival[rows] = self.step
+        self._alive[rows] = True
+        self._objects[rows] = messages
+
+        self._key_of.update(zip(ids, range(self._next_key, self._next_key + n_new)))
+
+        self._next_key += n_new
+        self._top += n_new
+        self._n_live += n_new
+
+        for listener in self._listeners:
+            listener.on_insert(self._key[rows], self._rows(rows))
+
+        if self.max_length is not None and self._n_live > self.max_length:
+            self.evict(self._n_live - self.max_length)
+
+    def attach(self, listener):
+        """
+        Registers a listener that is kept in sync with the content of the mempool.
+
+        The listener must implement on_insert(keys, columns), which receives the
+        keys of the new messages and a dict with their 'gas_fee_cap',
+        'gas_premium', 'gas_used', 'gas_limit', 'value' and 'arrival' rows, and
+        on_remove(keys). The messages already in the mempool are passed to
+        on_insert right away.
+
+        Args:
+            listener: The object to be notified.
+        """
+        self.compact()
+        self._listeners.append(listener)
+        if self._n_live:
+            listener.on_insert(self._key[:self._n_live], self._rows(slice(0, self._n_live)))
+
+    def detach(self, listener):
+        """
+        Unregisters a listener added with attach.
+        """
+        self._listeners.remove(listener)
+
+    def positions(self, keys) -> np.ndarray:
+        """
+        Returns the positions of the messages with the given keys.
+
+        Args:
+            keys: Keys of messages in the mempool.
+
+        Returns:
+            np.ndarray: Their positions, as used by get_parameters_for_knapsack.
+        """
+        slots = np.searchsorted(self._key[:self._top], keys)
+        if self._dead.count:
+            slots = slots - self._dead.before(slots)
+        return slots
+
+    def remove(self, list_of_messages):
+        """
+        Remove a batch of messages from the mempool.
+
+        Args:
+            list_of_messages (list): The messages to be removed.
+        """
+        try:
+            keys = [self._key_of[id(m)] for m in list_of_messages]
+        except KeyError:
+            raise ValueError("Message is not in the mempool")
+        self.remove_keys(keys)
+
     def remove_message(self, message):
         """
         Remove a message from the mempool.
@@ -34,24 +216,283 @@ class Mempool:
         Args:
             message (Message): The message to be removed.
         """
-        self.messages.remove(message)
+        self.remove([message])
+
+    def remove_keys(self, keys):
+        """
+        Remove messages by their mempool key.
+
+        Keys are assigned in arrival order and never reused, so the row of a key
+        is found by binary search on the (sorted) key column.
+
+        Args:
+            keys: Keys of the messages to be removed.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        slots = np.searchsorted(self._key[:self._top], keys)
+        found = slots < self._top
+        found[found] = self._key[slots[found]] == keys[found]
+        if not np.all(found):
+            raise ValueError("Message is not in the mempool")
+        self._kill(slots)
+
+    def remove_indices(self, indices):
+        """
+        Remove the messages at the given positions of the mempool.
+
+        Args:
+            indices: Positions, as returned by the knapsack solvers.
+        """
+        self._kill(self._slots(indices))
+
+    def remove_mask(self, mask):
+        """
+        Remove the messages selected by a boolean mask over the positions of the mempool.
+
+        Args:
+            mask: Boolean array of length len(mempool).
+        """
+        self.remove_indices(np.flatnonzero(mask))
+
+    def evict_oldest(self, n: int):
+        """
+        Remove the n oldest messages from the mempool.
+
+        Only the head of the pool is scanned, so the cost depends on n and on
+        the number of tombstones in front of the n-th oldest message, not on the
+        size of the pool.
+
+        Args:
+            n (int): Number of messages to be removed.
+        """
+        n = min(int(n), self._n_live)
+        if n <= 0:
+            return
+        window = 2 * n
+        while True:
+            slots = np.flatnonzero(self._alive[:min(window, self._top)])
+            if len(slots) >= n:
+                break
+            window *= 2
+        self._kill(slots[:n])
+
+    def evict(self, n: int) -> int:
+        """
+        Remove the n lowest priority messages according to the eviction policy
+        (the n oldest ones if the mempool has none).
+
+        Args:
+            n (int): Number of messages to be removed.
+
+        Returns:
+            int: The number of messages removed.
+        """
+        n = min(max(int(n), 0), self._n_live)
+        if n == 0:
+            return 0
+        if self.eviction is None:
+            self.evict_oldest(n)
+        else:
+            self.remove_keys(self.eviction.worst(n))
+        self.n_evicted += n
+        return n
+
+    def set_base_fees(self, base_fees):
+        """
+        Updates the base fees used by price dependent eviction policies and
+        block builders, and removes the messages priced out by them if pruning
+        is enabled.
+        """
+        self.base_fees = np.asarray(base_fees, dtype=float)
+        if self.pruning is not None:
+            keys = self.pruning.priced_out(base_fees)
+            if keys:
+                self.remove_keys(keys)
+                self.n_pruned += len(keys)
+        if self.eviction is not None:
+            self.eviction.reprice(self, base_fees)
+
+    def tick(self, n: int = 1):
+        """
+        Advances the clock of the mempool (the arrival step of new messages) by n
+        steps, and removes the messages whose time to live is over.
+        """
+        self.step += n
+        if self.pruning is not None:
+            keys = self.pruning.expired(self.step)
+            if keys:
+                self.remove_keys(keys)
+                self.n_expired += len(keys)
 
     def calculate_total_gas_used(self):
         """
         Calculate the total gas used in the mempool.
 
+        The total is kept up to date on every insertion and removal (and
+        recomputed exactly whenever the pool is compacted), so this is O(1).
+
         Returns:
-            float: The total gas used in the mempool.
+            np.ndarray: The total gas used in the mempool, per lane.
         """
-        total_gas_used = sum(message.gas_used for message in self.messages)
-        return total_gas_used
-    
+        return self._total_gas_used.copy()
+
+    def column(self, name: str, indices=None) -> np.ndarray:
+        """
+        Returns one of the columns of the mempool, read-only.
+
+        The column is a view on the storage if no message was removed since the
+        last compaction, and otherwise a copy of its live rows, cached until the
+        mempool is next modified.
+
+        Args:
+            name (str): One of 'gas_fee_cap', 'gas_premium', 'gas_used', 'gas_limit', 'value', 'key' or 'arrival'.
+            indices (optional): If given, only the rows at these positions are
+                returned (a copy), without touching the rest of the column.
+
+        Returns:
+            np.ndarray: The column, with one row per message, oldest first.
+        """
+        if indices is not None:
+            return getattr(self, '_' + name)[self._slots(indices)]
+        if not self._dead.count:
+            view = getattr(self, '_' + name)[:self._n_live]
+        else:
+            view = self._cache.get(name)
+            if view is None:
+                view = self._cache[name] = getattr(self, '_' + name)[self._live_slots()]
+        view.flags.writeable = False
+        return view
+
     def get_parameters_for_knapsack(self):
-        
-        values=[]
-        weights=[]
-        
-        for m in self.messages:
-            values.append(sum(m.gas_premium))
-            weights.append(m.gas_limit)
-        return values,weights
\ No newline at end of file
+        """
+        Returns the knapsack input for the messages in the mempool.
+
+        Both arrays are read-only columns (see column) and are valid until the
+        mempool is next modified.
+
+        Returns:
+            tuple: The value (total premium) of each message and its gas limit per lane.
+        """
+        return self.column('value'), self.column('gas_limit')
+
+    def _rows(self, rows) -> dict:
+        return {'gas_fee_cap': self._gas_fee_cap[rows],
+                'gas_premium': self._gas_premium[rows],
+                'gas_used': self._gas_used[rows],
+                'gas_limit': self._gas_limit[rows],
+                'value': self._value[rows],
+                'arrival': self._arrival[rows]}
+
+    def compact(self):
+        """
+        Squeezes out the removed rows, so that the columns are views on the
+        storage again. This is done automatically when needed.
+        """
+        if not self._dead.count:
+            return
+        n = self._n_live
+        slots = np.flatnonzero(self._alive[:self._top])
+        for col in (self._gas_fee_cap, self._gas_premium, self._gas_used, self._gas_limit,
+                    self._value, self._key, self._arrival, self._objects):
+            col[:n] = col[slots]
+        self._alive[:n] = True
+        self._alive[n:self._top] = False
+        self._objects[n:self._top] = None
+        self._top = n
+        self._total_gas_used = self._gas_used[:n].sum(axis=0)
+        self._dead = _Tombstones(self._capacity)
+        self._cache.clear()
+
+    def _slots(self, indices) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.intp)
+        if not self._dead.count:
+            return indices
+        if len(indices) and (indices.max() >= self._n_live or indices.min() < -self._n_live):
+            raise IndexError("Position out of range of the mempool")
+        return self._dead.select(np.where(indices < 0, indices + self._n_live, indices)).astype(np.intp)
+
+    def _live_slots(self) -> np.ndarray:
+        if '_slots' not in self._cache:
+            self._cache['_slots'] = np.flatnonzero(self._alive[:self._top])
+        return self._cache['_slots']
+
+    def _kill(self, slots):
+        slots = np.asarray(slots, dtype=np.intp)
+        if len(slots) == 0:
+            return
+        if not np.all(self._alive[slots]) or len(np.unique(slots)) != len(slots):
+            raise ValueError("Message is not in the mempool")
+        for m in self._objects[slots]:
+            del self._key_of[id(m)]
+        for listener in self._listeners:
+            listener.on_remove(self._key[slots])
+        self._alive[slots] = False
+        self._objects[slots] = None
+        self._dead.add(slots)
+        self._cache.clear()
+        self._n_live -= len(slots)
+        self._total_gas_used -= self._gas_used[slots].sum(axis=0)
+        if self._n_live == 0:
+            self._total_gas_used[:] = 0
+        if self._dead.count > self._n_live:
+            self.compact()
+
+    def _reserve(self, n_new: int):
+        if self._top + n_new <= self._capacity:
+            return
+        self.compact()
+        # Only reuse the storage if at least half of it is left free, so that
+        # compactions stay amortised over the insertions
+        if 2 * (self._top + n_new) <= self._capacity:
+            return
+
+        capacity = max(2 * self._capacity, 2 * (self._top + n_new))
+        for name in ('_gas_fee_cap', '_gas_premium', '_gas_used', '_gas_limit',
+                     '_value', '_key', '_arrival', '_alive', '_objects'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype) if name != '_objects' \
+                else np.empty(capacity, dtype=object)
+            new[:self._top] = old[:self._top]
+            setattr(self, name, new)
+        self._capacity = capacity
+        self._dead = _Tombstones(capacity)
+
+
+class _Tombstones:
+    # Fenwick tree over the removed rows of the storage
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self._tree = np.zeros(size + 1, dtype=np.int64)
+
+    def add(self, slots):
+        i = np.asarray(slots, dtype=np.int64) + 1
+        self.count += len(i)
+        while len(i):
+            np.add.at(self._tree, i, 1)
+            i = i + (i & -i)
+            i = i[i <= self.size]
+
+    def before(self, slots) -> np.ndarray:
+        # Number of removed rows in front of each slot
+        i = np.minimum(np.asarray(slots, dtype=np.int64), self.size)
+        total = np.zeros(len(i), dtype=np.int64)
+        while np.any(i > 0):
+            total += self._tree[i]
+            i = i - (i & -i)
+        return total
+
+    def select(self, positions) -> np.ndarray:
+        # Slot of the live row at each position, by binary lifting on the tree
+        rest = np.asarray(positions, dtype=np.int64) + 1
+        slots = np.zeros(len(rest), dtype=np.int64)
+        step = 1 << self.size.bit_length()
+        while step:
+            ahead = slots + step
+            inside = ahead <= self.size
+            live = np.where(inside, step - self._tree[np.minimum(ahead, self.size)], 0)
+            take = inside & (live < rest)
+            slots[take] = ahead[take]
+            rest[take] -= live[take]
+            step >>= 1
+        return slots
@@ -5,12 +5,24 @@ This is the message module
 """
 import numpy as np
 import params 
+from opcodes import OPCODE_TABLE, FOREIGN_LANE
 
-env_params = params.env_params()
+env_params = params.defaults()
 N_lanes = env_params['N_lanes']
 
+# Shared opcode arrays of messages without opcodes of one kind
+_NO_OPCODE_IDS = np.empty(0, dtype=OPCODE_TABLE.dtype)
+_NO_CUSTOM_GAS = np.empty(0)
+_NO_OPCODE_IDS.flags.writeable = False
+_NO_CUSTOM_GAS.flags.writeable = False
+
 class Message:
-    def __init__(self, ID: str, gas_fee_cap: list, gas_premium: list, opcode_list: list, params: list = None):
+    __slots__ = ('ID', 'gas_fee_cap', 'gas_premium', 'opcode_ids', 'custom_gas', 'custom_names',
+                 '_gas_used', '_gas_limit', '_overestimation', 'params')
+
+    def __init__(self, ID: str, gas_fee_cap: list, gas_premium: list, opcode_list: list, params: list = None,
+                 gas_used: list = None, gas_limit: list = None, opcode_ids=None, custom_gas=None,
+                 rng: np.random.Generator = None):
         """
         Represents a message included in the blockchain.
 
@@ -19,48 +31,151 @@ class Message:
             gas_fee_cap (float): The maximum fee that the sender is willing to pay.
             gas_premium (float): The additional fee that the sender is willing to pay to get the transaction included
                 in a block quickly.
-            opcode_list (list): List of opcode instances representing the operations in the message.
+            opcode_list (list): List of opcode instances representing the operations in the message. Only
+                their indices in opcodes.OPCODE_TABLE (and the gas of the opcodes outside the table) are kept.
             params (list, optional): Additional parameters for the message. Defaults to None.
+            gas_used (list, optional): Precomputed gas used per lane. Otherwise it is computed from the opcodes
+                the first time it is needed.
+            gas_limit (list, optional): Precomputed gas limit per lane. Otherwise the overestimation factors
+                are sampled here, and applied to the gas used the first time the limit is needed.
+            opcode_ids (array, optional): Indices in opcodes.OPCODE_TABLE of the opcodes, if opcode_list is None.
+            custom_gas (array, optional): Gas used by the 'SP' opcodes, if opcode_list is None.
+            rng (np.random.Generator, optional): Stream of the overestimation factors.
+                Defaults to the global np.random state.
         """
         self.ID = ID
         self.gas_fee_cap = gas_fee_cap
         self.gas_premium = gas_premium
-        self.opcode_list = opcode_list
-        self.gas_used = self.get_gas_used()
-        self.gas_limit = self.calculate_gas_limit()
+        self.custom_names = None
+        if opcode_list is not None:
+            opcode_ids, custom_gas, custom_names = OPCODE_TABLE.encode(opcode_list)
+            if any(name != 'SP' for name in custom_names):
+                self.custom_names = custom_names
+        self.opcode_ids = _NO_OPCODE_IDS if opcode_ids is None or len(opcode_ids) == 0 \
+            else np.asarray(opcode_ids, dtype=OPCODE_TABLE.dtype)
+        self.custom_gas = _NO_CUSTOM_GAS if custom_gas is None or len(custom_gas) == 0 \
+            else np.asarray(custom_gas, dtype=float)
+        self.gas_used = gas_used
+        self.gas_limit = gas_limit
+        self._overestimation = None
+        if gas_limit is None:
+            # Drawn now, so that the factors follow the construction order of the
+            # messages rather than the order in which their limits are first read
+            random = np.random.random if rng is None else rng.random
+            self._overestimation = 1 + 0.2*random(N_lanes if self._gas_used is None else len(self._gas_used))
         self.params = params
 
-    def get_gas_used(self) -> list:
+    @classmethod
+    def batch(cls, ID: str, gas_fee_cap, gas_premium, gas_used, gas_limit=None, opcode_ids: list = None,
+              custom_gas: list = None, rng: np.random.Generator = None) -> list:
         """
-        Calculates the total gas used for each lane by summing up the gas used by each opcode in the opcode list.
+        Builds a batch of messages from per-message arrays.
+
+        The messages keep views on the rows of the arrays. If no gas limits are
+        given, the overestimation factors of the whole batch are drawn at once.
+
+        Args:
+            ID (str): The identifier of the messages.
+            gas_fee_cap: Array of shape (N_messages, N_lanes) with the fee caps.
+            gas_premium: Array of shape (N_messages, N_lanes) with the premiums.
+            gas_used: Array of shape (N_messages, N_lanes) with the gas used.
+            gas_limit (optional): Array of shape (N_messages, N_lanes) with the gas limits.
+            opcode_ids (list, optional): Table indices of the opcodes of each message.
+            custom_gas (list, optional): Gas used by the 'SP' opcodes of each message.
+            rng (np.random.Generator, optional): Stream of the overestimation factors.
+                Defaults to the global np.random state.
 
         Returns:
-            list: The gas used for each lane.
+            list: The messages.
+        """
+        gas_used = np.asarray(gas_used, dtype=float)
+        if gas_limit is None:
+            random = np.random.random if rng is None else rng.random
+            gas_limit = (gas_used * (1 + 0.2 * random(gas_used.shape))).astype(np.int64)
+        N_messages = len(gas_used)
+        if opcode_ids is None:
+            opcode_ids = [None] * N_messages
+        if custom_gas is None:
+            custom_gas = [None] * N_messages
+        return [cls(ID, gas_fee_cap[n], gas_premium[n], None, gas_used=gas_used[n], gas_limit=gas_limit[n],
+                    opcode_ids=opcode_ids[n], custom_gas=custom_gas[n])
+                for n in range(N_messages)]
+
+    @property
+    def gas_used(self) -> np.ndarray:
+        """
+        The gas used per lane, computed from the opcodes on first access.
+        """
+        if self._gas_used is None:
+            self._gas_used = self.get_gas_used()
+        return self._gas_used
+
+    @gas_used.setter
+    def gas_used(self, gas_used):
+        self._gas_used = None if gas_used is None else np.asarray(gas_used, dtype=float)
+
+    @property
+    def gas_limit(self) -> np.ndarray:
+        """
+        The gas limit per lane, the gas used times the overestimation factors drawn at construction.
         """
-        gas_used = [ 0 for i in range(N_lanes)]
-        for opcode in self.opcode_list:
-            if len(gas_used)>1:
-                lane = opcode.belongs_to_lane
+        if self._gas_limit is None:
+            if self._overestimation is None:
+                self._gas_limit = self.calculate_gas_limit()
             else:
-                lane=0
-            gas_used[lane] += opcode.gas_used
+                self._gas_limit = (self.gas_used*self._overestimation).astype(np.int64)
+        return self._gas_limit
 
-        return gas_used
+    @gas_limit.setter
+    def gas_limit(self, gas_limit):
+        self._gas_limit = None if gas_limit is None else np.asarray(gas_limit)
 
-    def calculate_gas_limit(self) ->list:
+    @property
+    def opcode_list(self) -> list:
         """
-        Calculates the gas limit for each lane by adding a random factor to the gas used.
+        The opcodes of the message, table opcodes first, rebuilt from the opcode indices.
+        """
+        return OPCODE_TABLE.decode(self.opcode_ids, self.custom_gas, self.custom_names)
+
+    def get_gas_used(self, classifier=None) -> np.ndarray:
+        """
+        Calculates the total gas used for each lane by summing up the gas used by each opcode in the opcode list.
+
+        Args:
+            classifier (LaneClassifier, optional): Lanes of the opcodes. Defaults to the lanes of the opcode table.
 
         Returns:
-            list: The calculated gas limit for each lane.
+            np.ndarray: The gas used for each lane.
         """
-        gas_limit = [ 0 for i in range(N_lanes)]
+        if classifier is not None:
+            lanes = np.concatenate([classifier.lanes(self.opcode_ids),
+                                    np.full(len(self.custom_gas), classifier.foreign_lane, dtype=np.intp)])
+            n_lanes = classifier.N_lanes
+        elif N_lanes > 1:
+            lanes = np.concatenate([OPCODE_TABLE.lanes[self.opcode_ids],
+                                    np.full(len(self.custom_gas), FOREIGN_LANE, dtype=np.intp)])
+            n_lanes = N_lanes
+        else:
+            lanes = np.zeros(len(self.opcode_ids) + len(self.custom_gas), dtype=np.intp)
+            n_lanes = N_lanes
+        gas = np.concatenate([OPCODE_TABLE.gas[self.opcode_ids], self.custom_gas])
+        return np.bincount(lanes, weights=gas, minlength=n_lanes)
 
-        for l in range(N_lanes):
-            overestimation_factor=(1 + 0.2*np.random.random())
-            gas_limit[l]=int(self.gas_used[l]*overestimation_factor)
+    def calculate_gas_limit(self, rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Calculates the gas limit for each lane by adding a random factor to the gas used.
+
+        Args:
+            rng (np.random.Generator, optional): Stream of the overestimation factors.
+                Defaults to the global np.random state.
 
-        return gas_limit
+        Returns:
+            np.ndarray: The calculated gas limit for each lane.
+        """
+        gas_used = self.gas_used
+        random = np.random.random if rng is None else rng.random
+        overestimation_factor = 1 + 0.2*random(len(gas_used))
+        return (gas_used*overestimation_factor).astype(np.int64)
     
 if __name__ == '__main__':
     from opcodes import Opcode
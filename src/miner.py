@@ -6,43 +6,205 @@ Created on Fri Jun 16 14:55:04 2023
 @author: juanpablomadrigalcianci
 """
 from user import User
-from knapsack import multidimensional_knapsack_approx,multidimensional_knapsack
+import numpy as np
+from knapsack import (multidimensional_knapsack_approx_vectorized, multidimensional_knapsack_lp,
+                      multidimensional_knapsack_dual, compress_prices, IncrementalKnapsackBuilder,
+                      ExactKnapsackSolver, argsort_descending, greedy_fill)
 import params
 
-env_params = params.env_params()
+env_params = params.defaults()
 N_lanes = env_params['N_lanes']
 lane_widths= env_params['lane_widths']
 
+STRATEGIES = ('greedy', 'incremental', 'exact', 'lp', 'dual', 'tip_only', 'lane')
+# Largest ratio across lanes of the base fees the 'dual' strategy starts from
+DUAL_MAX_RATIO = 4.
+
+
+def select_block(strategy, values, weights, capacity, lane=0, prices=None, time_limit=None):
+    """
+    Stateless block selection of a strategy (see build_block).
+
+    Returns:
+        list: Positions of the chosen messages, in increasing order.
+    """
+    return build_block(strategy, values, weights, capacity, lane, prices, time_limit)[0]
+
+
+def build_block(strategy, values, weights, capacity, lane=0, prices=None, time_limit=None):
+    """
+    Stateless block building of a strategy, e.g. to be run in another process.
+
+    'incremental' selects like 'greedy', and 'exact' solves the binary program
+    with a fresh ExactKnapsackSolver, warm started with the greedy selection.
+
+    Args:
+        strategy (str): One of STRATEGIES.
+        values: Value (total premium) of each message.
+        weights: (n, d) array with the gas limit of each message in each lane.
+        capacity: Capacity of each lane.
+        lane (int): Lane of the 'lane' strategy.
+        prices (optional): Initial lane prices of the 'dual' strategy.
+        time_limit (float, optional): Time budget of the 'exact' strategy, in seconds.
+
+    Returns:
+        tuple: Positions of the chosen messages, in increasing order, and a
+        dict with the state a Miner keeps from the block (see Miner.keep_state):
+        'last_gap' for 'exact' and 'lp', 'lane_prices' for 'dual'.
+    """
+    if strategy in ('greedy', 'incremental'):
+        return multidimensional_knapsack_approx_vectorized(values=values, weights=weights, capacity=capacity), {}
+    if strategy == 'exact':
+        solver = ExactKnapsackSolver(len(capacity), time_limit=time_limit)
+        solver.on_insert(np.arange(len(values)), {'value': values, 'gas_limit': weights})
+        greedy = multidimensional_knapsack_approx_vectorized(values, weights, capacity)
+        positions, gap = solver.solve(capacity, incumbent=greedy)
+        return positions.tolist(), {'last_gap': gap}
+    if strategy == 'lp':
+        chosen, gap = multidimensional_knapsack_lp(values, weights, capacity)
+        return chosen, {'last_gap': gap}
+    if strategy == 'dual':
+        chosen, lane_prices = multidimensional_knapsack_dual(values, weights, capacity, prices)
+        return chosen, {'lane_prices': lane_prices}
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown block building strategy '{strategy}'")
+
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape(len(values), len(capacity))
+    if strategy == 'tip_only':
+        # Highest premium first, whatever the gas it takes
+        items = argsort_descending(values)
+    else:
+        # Premium per unit of gas in one lane only, the others just have to fit
+        items = argsort_descending(values / (weights[:, lane] + 1))
+    chosen = greedy_fill(weights[items], capacity)
+    return np.sort(items[chosen]).tolist(), {}
+
 
 class Miner(User):
-    def __init__(self, account_balance: float):
+    def __init__(self, account_balance: float, strategy: str = 'greedy', time_limit: float = None, lane: int = 0,
+                 dual_prices: str = 'uniform'):
+        """
+        A miner that proposes blocks out of the messages in the mempool.
+
+        Args:
+            account_balance (float): Initial balance of the miner.
+            strategy (str): Block building strategy. One of
+                'greedy': rebuilds the greedy knapsack each block,
+                'incremental': same selection, but keeps the greedy order in an
+                IncrementalKnapsackBuilder attached to the mempool,
+                'exact': solves the binary program with a persistent
+                ExactKnapsackSolver, warm started with the greedy selection,
+                'lp': rounds the LP relaxation and improves it by local search
+                (knapsack.multidimensional_knapsack_lp),
+                'dual': greedy on value over gas priced per lane, rebalancing the
+                prices between passes (knapsack.multidimensional_knapsack_dual),
+                'tip_only': takes the messages with the highest premium first,
+                'lane': takes the messages with the highest premium per unit of
+                gas in one lane first (a builder specialised in that lane).
+            time_limit (float, optional): Per block time budget of the 'exact' strategy, in seconds.
+            lane (int): Lane of the 'lane' strategy.
+            dual_prices (str): Initial lane prices of the 'dual' strategy. The
+                prices of each block (lane_prices) are kept for the next one,
+                starting from the same price for a whole lane with 'uniform'.
+                With 'base_fees', they start from the base fees of the mempool
+                and are moved by the relative change of the base fees since the
+                previous block. Either way, the initial prices are compressed
+                to a ratio of at most DUAL_MAX_RATIO across lanes.
+        """
         super().__init__()
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown block building strategy '{strategy}'")
+        if dual_prices not in ('uniform', 'base_fees'):
+            raise ValueError(f"Unknown initial dual prices '{dual_prices}'")
         self.account_balance = account_balance
+        self.strategy = strategy
+        self.time_limit = time_limit
+        self.lane = lane
+        self.dual_prices = dual_prices
+        self.n_blocks = 0
+        self.builder = None
+        self.last_gap = None
+        self.lane_prices = None
+        self._lane_prices_base_fees = None
+        self._builder_mempool = None
+
     def propose_block(self,mempool,capacity):
+        self.prepare(mempool)
+        if self.strategy == 'incremental':
+            return mempool.positions(self.builder.select(capacity))
+
+        if self.strategy == 'exact':
+            values,weights=mempool.get_parameters_for_knapsack()
+            greedy=multidimensional_knapsack_approx_vectorized(values,weights,capacity)
+            keys,self.last_gap=self.builder.solve(capacity,incumbent=mempool.column('key')[greedy])
+            return mempool.positions(keys)
+
         values,weights=mempool.get_parameters_for_knapsack()
-        list_of_messages=multidimensional_knapsack_approx(values=values,
-                                                          weights=weights,
-                                                          capacity=capacity) 
-        
-        
+        list_of_messages,state=build_block(self.strategy,values,weights,capacity,self.lane,self.prices(mempool),
+                                           self.time_limit)
+        self.keep_state(state,mempool)
         return list_of_messages
-    
-    
-        
-        
-        
-        
-        
-            
-            
-        
-        
-        
-        
-        
-        
-        
-        
-
-    
 
+    def prepare(self, mempool):
+        """
+        Attaches the stateful builder of the strategy (if any) to a mempool.
+
+        Done by propose_block when needed; calling it beforehand lets several
+        miners then build from the same mempool concurrently.
+        """
+        if self.strategy == 'incremental':
+            self._attach(mempool, lambda: IncrementalKnapsackBuilder(mempool.N_lanes))
+        elif self.strategy == 'exact':
+            self._attach(mempool, lambda: ExactKnapsackSolver(mempool.N_lanes, time_limit=self.time_limit))
+
+    def prices(self, mempool):
+        """
+        Initial lane prices of the 'dual' strategy for a mempool (None for the
+        same price for a whole lane, and for the other strategies).
+        """
+        if self.strategy != 'dual':
+            return None
+        base_fees = mempool.base_fees
+        if self.dual_prices == 'uniform' or base_fees is None:
+            prices = self.lane_prices
+        elif self.lane_prices is None or self._lane_prices_base_fees is None:
+            prices = base_fees
+        else:
+            previous = self._lane_prices_base_fees
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = np.where((previous > 0) & (base_fees > 0), base_fees / previous, 1.)
+            prices = self.lane_prices * change
+        return None if prices is None else compress_prices(prices, DUAL_MAX_RATIO)
+
+    def keep_state(self, state: dict, mempool):
+        """
+        Keeps the state returned by build_block for the next blocks.
+
+        Args:
+            state (dict): May hold 'last_gap' (the optimality gap bound of the
+                block) and 'lane_prices' (the lane prices of the 'dual' strategy).
+            mempool (Mempool): The mempool the block was built from.
+        """
+        if 'last_gap' in state:
+            self.last_gap = state['last_gap']
+        if 'lane_prices' in state:
+            self.lane_prices = state['lane_prices']
+            self._lane_prices_base_fees = mempool.base_fees
+
+    def credit(self, revenue: float):
+        """
+        Credits the revenue of an included block to the miner.
+        """
+        self.account_balance += revenue
+        self.n_blocks += 1
+
+    def _attach(self, mempool, make_builder):
+        # Keeps a stateful builder in sync with the mempool it builds blocks from
+        if self._builder_mempool is mempool:
+            return
+        if self._builder_mempool is not None:
+            self._builder_mempool.detach(self.builder)
+        self.builder = make_builder()
+        mempool.attach(self.builder)
+        self._builder_mempool = mempool
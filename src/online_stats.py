@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Online (single pass, constant memory) statistics over arrays of cells.
+
+Each estimator keeps one running statistic per cell of an array of a fixed
+shape, and every update feeds one new observation to each cell of a block of
+cells along the first axis. This is what is needed to aggregate, step by step,
+trajectories that arrive in chunks from several replicates.
+
+EWMA, QuantileSketch and DownsampledSeries summarise a single long run in
+constant memory: exponentially weighted windows, quantiles with a relative
+error bound, and series at a resolution that coarsens as the run grows.
+"""
+from typing import Tuple
+import numpy as np
+
+
+class RunningMoments:
+    def __init__(self, shape: Tuple[int, ...]):
+        """
+        Running count, mean and variance per cell (Welford's algorithm).
+
+        Args:
+            shape (tuple): Shape of the array of cells.
+        """
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+    def update(self, x: np.ndarray, index=slice(None)):
+        """
+        Adds one observation to each cell of a block.
+
+        Args:
+            x: Observations, with the shape of the block.
+            index: Slice along the first axis selecting the block of cells.
+        """
+        count = self.count[index] + 1
+        delta = x - self.mean[index]
+        mean = self.mean[index] + delta / count
+        self._m2[index] += delta * (x - mean)
+        self.mean[index] = mean
+        self.count[index] = count
+
+    @property
+    def variance(self) -> np.ndarray:
+        """
+        Sample variance per cell (NaN for cells with fewer than two observations).
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self._m2 / (self.count - 1), np.nan)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+
+class P2Quantile:
+    def __init__(self, p: float, shape: Tuple[int, ...]):
+        """
+        Streaming estimate of the p-quantile per cell, using the P-square
+        algorithm (Jain & Chlamtac, 1985), which tracks five markers per cell.
+
+        Args:
+            p (float): The quantile to be estimated, in (0, 1).
+            shape (tuple): Shape of the array of cells.
+        """
+        if not 0 < p < 1:
+            raise ValueError("The quantile must be in (0, 1)")
+        self.p = p
+        self.count = np.zeros(shape, dtype=np.int64)
+        self._q = np.zeros((5,) + tuple(shape))
+        self._n = np.broadcast_to(np.arange(1., 6.).reshape((5,) + (1,) * len(shape)), self._q.shape).copy()
+        self._dn = np.array([0, p / 2, p, (1 + p) / 2, 1])
+        self._desired = np.broadcast_to((1 + 4 * self._dn).reshape((5,) + (1,) * len(shape)), self._q.shape).copy()
+
+    def update(self, x: np.ndarray, index=slice(None)):
+        """
+        Adds one observation to each cell of a block.
+
+        Args:
+            x: Observations, with the shape of the block.
+            index: Slice along the first axis selecting the block of cells.
+        """
+        block = (slice(None), index)
+        shape = self.count[index].shape
+        x = np.asarray(x, dtype=float).reshape(-1)
+        count = self.count[index].reshape(-1)
+        q = self._q[block].reshape(5, -1)
+        n = self._n[block].reshape(5, -1)
+        desired = self._desired[block].reshape(5, -1)
+
+        # The first five observations of a cell are stored as they come
+        init = np.flatnonzero(count < 5)
+        if len(init):
+            q[count[init], init] = x[init]
+            full = init[count[init] == 4]
+            q[:, full] = np.sort(q[:, full], axis=0)
+
+        j = np.flatnonzero(count >= 5)
+        if len(j):
+            Q, N, D, xj = q[:, j], n[:, j], desired[:, j], x[j]
+            Q[0] = np.minimum(Q[0], xj)
+            Q[4] = np.maximum(Q[4], xj)
+            k = (xj >= Q[1:4]).sum(axis=0)
+            N += np.arange(5)[:, None] > k
+            D += self._dn[:, None]
+
+            for i in (1, 2, 3):
+                d = D[i] - N[i]
+                move = ((d >= 1) & (N[i + 1] - N[i] > 1)) | ((d <= -1) & (N[i - 1] - N[i] < -1))
+                s = np.where(move, np.sign(d), 0.)
+
+                parabolic = Q[i] + s / (N[i + 1] - N[i - 1]) * (
+                    (N[i] - N[i - 1] + s) * (Q[i + 1] - Q[i]) / (N[i + 1] - N[i])
+                    + (N[i + 1] - N[i] - s) * (Q[i] - Q[i - 1]) / (N[i] - N[i - 1]))
+                q_next = np.where(s > 0, Q[i + 1], Q[i - 1])
+                n_next = np.where(s > 0, N[i + 1], N[i - 1])
+                linear = Q[i] + s * (q_next - Q[i]) / (n_next - N[i])
+
+                Q[i] = np.where((Q[i - 1] < parabolic) & (parabolic < Q[i + 1]), parabolic, linear)
+                N[i] += s
+            q[:, j], n[:, j], desired[:, j] = Q, N, D
+
+        self._q[block] = q.reshape((5,) + shape)
+        self._n[block] = n.reshape((5,) + shape)
+        self._desired[block] = desired.reshape((5,) + shape)
+        self.count[index] = (count + 1).reshape(shape)
+
+    @property
+    def value(self) -> np.ndarray:
+        """
+        Current estimate of the quantile per cell (NaN for cells without observations).
+        """
+        value = self._q[2].copy()
+        count = self.count
+        for c in range(5):
+            few = count == c
+            if not few.any():
+                continue
+            if c == 0:
+                value[few] = np.nan
+            else:
+                value[few] = np.quantile(self._q[:c][:, few], self.p, axis=0)
+        return value
+
+
+class EWMA:
+    def __init__(self, alpha: float, shape: Tuple[int, ...] = ()):
+        """
+        Exponentially weighted moving mean and variance per cell.
+
+        Args:
+            alpha (float): Weight of the newest observation, in (0, 1]. The
+                window spans about 1 / alpha observations.
+            shape (tuple): Shape of the array of cells.
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.variance = np.zeros(shape)
+
+    def update(self, x: np.ndarray):
+        """
+        Adds one observation to each cell.
+        """
+        x = np.asarray(x, dtype=float)
+        if self.count == 0:
+            self.mean = x.copy()
+        else:
+            delta = x - self.mean
+            self.mean = self.mean + self.alpha * delta
+            self.variance = (1 - self.alpha) * (self.variance + self.alpha * delta ** 2)
+        self.count += 1
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+
+class QuantileSketch:
+    def __init__(self, shape: Tuple[int, ...] = (), relative_accuracy: float = 0.01,
+                 min_value: float = 1e-30, max_value: float = 1e30):
+        """
+        Streaming quantiles per cell with a relative error guarantee.
+
+        Positive observations are counted in logarithmic bins whose bounds grow
+        by a factor gamma = (1 + a) / (1 - a), so any quantile is estimated
+        within a relative error a (as in DDSketch). Observations below
+        min_value (including zeros and negatives) are counted as zero, those
+        above max_value in the last bin. Updates cost O(1) per observation and
+        two sketches of the same parameters can be merged, e.g. across replicates.
+
+        Args:
+            shape (tuple): Shape of the array of cells.
+            relative_accuracy (float): Relative accuracy a of the quantiles, in (0, 1).
+            min_value (float): Smallest value distinguished from zero.
+            max_value (float): Largest value represented exactly.
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("The relative accuracy must be in (0, 1)")
+        self.shape = tuple(shape)
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self._offset = int(np.floor(np.log(min_value) / self._log_gamma))
+        n_bins = int(np.ceil(np.log(max_value) / self._log_gamma)) - self._offset + 1
+        n_cells = int(np.prod(self.shape, dtype=int))
+        self.counts = np.zeros((n_cells, n_bins), dtype=np.int64)
+        self.zeros = np.zeros(n_cells, dtype=np.int64)
+
+    @property
+    def count(self) -> np.ndarray:
+        """
+        Number of observations per cell.
+        """
+        return (self.counts.sum(axis=1) + self.zeros).reshape(self.shape)
+
+    def update(self, x: np.ndarray):
+        """
+        Adds one observation to each cell.
+
+        Args:
+            x: Observations, with the shape of the cells.
+        """
+        x = np.asarray(x, dtype=float).reshape(-1)
+        self.add(x, np.arange(len(x)))
+
+    def add(self, values, cells):
+        """
+        Adds any number of observations to any cells.
+
+        Args:
+            values: Observations.
+            cells: Flat index of the cell of each observation.
+        """
+        values = np.asarray(values, dtype=float).reshape(-1)
+        cells = np.broadcast_to(np.asarray(cells, dtype=np.intp), values.shape)
+        small = ~(values > self.min_value)
+        if small.any():
+            np.add.at(self.zeros, cells[small], 1)
+        big = ~small
+        if big.any():
+            bins = np.ceil(np.log(values[big]) / self._log_gamma).astype(np.int64) - self._offset
+            np.add.at(self.counts, (cells[big], np.clip(bins, 0, self.counts.shape[1] - 1)), 1)
+
+    def merge(self, other: 'QuantileSketch'):
+        """
+        Adds the observations of another sketch with the same parameters.
+        """
+        if other.counts.shape != self.counts.shape or other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same parameters can be merged")
+        self.counts += other.counts
+        self.zeros += other.zeros
+
+    def quantile(self, p: float) -> np.ndarray:
+        """
+        Estimate of the p-quantile per cell (NaN for cells without observations).
+        """
+        if not 0 <= p <= 1:
+            raise ValueError("The quantile must be in [0, 1]")
+        cumulative = np.cumsum(self.counts, axis=1) + self.zeros[:, None]
+        total = cumulative[:, -1]
+        rank = p * (total - 1)
+        value = np.full(len(total), np.nan)
+        for cell in np.flatnonzero(total):
+            if rank[cell] < self.zeros[cell]:
+                value[cell] = 0.
+            else:
+                b = np.searchsorted(cumulative[cell], rank[cell], side='right')
+                value[cell] = 2 * self.gamma ** (b + self._offset) / (self.gamma + 1)
+        return value.reshape(self.shape)
+
+
+class DownsampledSeries:
+    def __init__(self, shape: Tuple[int, ...] = (), max_points: int = 1024):
+        """
+        Series of observations (one per step) kept at a bounded resolution.
+
+        Consecutive steps are grouped in buckets of a common width, keeping
+        their mean, minimum and maximum. When max_points buckets are full,
+        adjacent buckets are merged and the width doubles, so the memory used
+        does not depend on the length of the run.
+
+        Args:
+            shape (tuple): Shape of one observation.
+            max_points (int): Maximum number of buckets (even).
+        """
+        self.shape = tuple(shape)
+        self.max_points = max(2, max_points + max_points % 2)
+        self.width = 1
+        self.n_points = 0
+        self.n_steps = 0
+        self._sum = np.zeros((self.max_points,) + self.shape)
+        self._min = np.zeros((self.max_points,) + self.shape)
+        self._max = np.zeros((self.max_points,) + self.shape)
+        self._reset_bucket()
+
+    def _reset_bucket(self):
+        self._bucket_n = 0
+        self._bucket_sum = np.zeros(self.shape)
+        self._bucket_min = np.full(self.shape, np.inf)
+        self._bucket_max = np.full(self.shape, -np.inf)
+
+    def update(self, x: np.ndarray):
+        """
+        Adds the observation of the next step.
+        """
+        x = np.asarray(x, dtype=float)
+        self._bucket_sum = self._bucket_sum + x
+        self._bucket_min = np.minimum(self._bucket_min, x)
+        self._bucket_max = np.maximum(self._bucket_max, x)
+        self._bucket_n += 1
+        self.n_steps += 1
+        if self._bucket_n < self.width:
+            return
+
+        i = self.n_points
+        self._sum[i], self._min[i], self._max[i] = self._bucket_sum, self._bucket_min, self._bucket_max
+        self.n_points += 1
+        self._reset_bucket()
+        if self.n_points == self.max_points:
+            self._sum[:self.max_points // 2] = self._sum[0::2] + self._sum[1::2]
+            self._min[:self.max_points // 2] = np.minimum(self._min[0::2], self._min[1::2])
+            self._max[:self.max_points // 2] = np.maximum(self._max[0::2], self._max[1::2])
+            self.n_points //= 2
+            self.width *= 2
+
+    def _with_bucket(self, points, bucket):
+        if self._bucket_n == 0:
+            return points[:self.n_points].copy()
+        return np.concatenate([points[:self.n_points], bucket[None]])
+
+    @property
+    def steps(self) -> np.ndarray:
+        """
+        First step of each bucket.
+        """
+        return np.arange(self.n_points + (self._bucket_n > 0)) * self.width
+
+    @property
+    def mean(self) -> np.ndarray:
+        """
+        Mean of the observations of each bucket, oldest first.
+        """
+        sizes = np.full(self.n_points + (self._bucket_n > 0), float(self.width))
+        if self._bucket_n:
+            sizes[-1] = self._bucket_n
+        return self._with_bucket(self._sum, self._bucket_sum) / sizes.reshape((-1,) + (1,) * len(self.shape))
+
+    @property
+    def min(self) -> np.ndarray:
+        return self._with_bucket(self._min, self._bucket_min)
+
+    @property
+    def max(self) -> np.ndarray:
+        return self._with_bucket(self._max, self._bucket_max)
+
+
+if __name__ == '__main__':
+    # Checks the vectorized P-square estimator against a scalar, observation by
+    # observation implementation of the algorithm, and both estimators against
+    # np.quantile, on 16 independent cells of 10000 lognormal observations
+    def p2_scalar(xs, p):
+        q = sorted(xs[:5])
+        n = [1., 2., 3., 4., 5.]
+        desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        dn = [0, p / 2, p, (1 + p) / 2, 1]
+        for x in xs[5:]:
+            if x < q[0]:
+                q[0] = x
+            if x > q[4]:
+                q[4] = x
+            k = sum(x >= q[i] for i in (1, 2, 3))
+            for i in range(5):
+                n[i] += i > k
+                desired[i] += dn[i]
+            for i in (1, 2, 3):
+                d = desired[i] - n[i]
+                if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                    s = 1. if d > 0 else -1.
+                    parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                        + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                    if q[i - 1] < parabolic < q[i + 1]:
+                        q[i] = parabolic
+                    else:
+                        j = i + int(s)
+                        q[i] = q[i] + s * (q[j] - q[i]) / (n[j] - n[i])
+                    n[i] += s
+        return q[2]
+
+    rng = np.random.default_rng(0)
+    data = rng.lognormal(0, 1, (10000, 16))
+    for p in (0.05, 0.5, 0.95):
+        p2 = P2Quantile(p, (16,))
+        sketch = QuantileSketch((16,))
+        for row in data:
+            p2.update(row)
+            sketch.update(row)
+        scalar = np.array([p2_scalar(data[:, c].tolist(), p) for c in range(16)])
+        exact = np.quantile(data, p, axis=0)
+        print(f'p={p}: P2 vs scalar P2 max abs diff {np.max(np.abs(p2.value - scalar)):.3g}, '
+              f'P2 vs np.quantile max rel error {np.max(np.abs(p2.value / exact - 1)):.3g}, '
+              f'sketch vs np.quantile max rel error {np.max(np.abs(sketch.quantile(p) / exact - 1)):.3g}')
@@ -5,13 +5,16 @@ Created on Fri Jun 16 11:09:03 2023
 
 @author: juanpablomadrigalcianci
 """
-from params import eth_opcodes
-from aux import classify
+import numpy as np
+from params import opcode_gas
+from aux import classify, DEFAULT_CLASSIFIER, LaneClassifier
 
-ETH_OPCODES=eth_opcodes()
+ETH_OPCODES=opcode_gas()
 
 
 class Opcode:
+    __slots__ = ('id', 'name', 'gas_used', 'belongs_to_lane')
+
     def __init__(self, id: int=None, name: str=None, gas_used: float=0):
         """
         Represents an opcode in a message.
@@ -23,19 +26,89 @@ class Opcode:
         """
         self.id = id
         self.name = name
-        
+
         if name in ETH_OPCODES:
             self.gas_used = ETH_OPCODES[name]
         else:
             self.gas_used=gas_used
-        
+
         self.belongs_to_lane=classify(self.name,self.id)
-    
-        
-    
-        
-        
 
 
+class OpcodeTable:
+    def __init__(self, opcodes: dict, classifier: LaneClassifier = None):
+        """
+        Shared table of the known opcodes.
+
+        Messages refer to table opcodes by their index in the table, stored in
+        a small unsigned integer array, instead of holding one Opcode object per
+        opcode. The table keeps a single (flyweight) Opcode instance per entry
+        for code that still needs the objects.
+
+        Args:
+            opcodes (dict): Opcode name to gas used, e.g. params.eth_opcodes().
+            classifier (LaneClassifier): Lanes of the opcodes. Defaults to aux.DEFAULT_CLASSIFIER.
+        """
+        self.names = list(opcodes.keys())
+        self.gas = np.array([opcodes[name] for name in self.names], dtype=float)
+        if classifier is None:
+            classifier = DEFAULT_CLASSIFIER if DEFAULT_CLASSIFIER.names == self.names \
+                else LaneClassifier(names=self.names)
+        self.classifier = classifier
+        self.lanes = classifier.lookup
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.dtype = np.uint8 if len(self.names) <= 256 else np.uint16
+        self._opcodes = [Opcode(i, name) for i, name in enumerate(self.names)]
+
+    def __len__(self):
+        return len(self.names)
+
+    def opcode(self, index: int) -> Opcode:
+        """
+        Returns the shared Opcode instance of a table entry.
+        """
+        return self._opcodes[index]
+
+    def encode(self, opcode_list: list):
+        """
+        Splits a list of opcodes into table indices and custom opcodes.
+
+        Args:
+            opcode_list (list): Opcode instances.
+
+        Returns:
+            tuple: The table indices (in the table dtype), the gas used by the
+            opcodes that are not in the table, and their names.
+        """
+        ids = [self.index[op.name] for op in opcode_list if op.name in self.index]
+        custom = [op for op in opcode_list if op.name not in self.index]
+        return (np.array(ids, dtype=self.dtype),
+                np.array([op.gas_used for op in custom], dtype=float),
+                [op.name for op in custom])
+
+    def decode(self, opcode_ids, custom_gas, custom_names=None) -> list:
+        """
+        Rebuilds the opcode list of a message, table opcodes first.
+
+        Args:
+            opcode_ids: Table indices.
+            custom_gas: Gas used by the opcodes that are not in the table.
+            custom_names (list, optional): Their names. Defaults to 'SP'.
+
+        Returns:
+            list: Opcode instances (shared ones for the table opcodes).
+        """
+        if custom_names is None:
+            custom_names = ['SP'] * len(custom_gas)
+        return ([self._opcodes[i] for i in opcode_ids]
+                + [Opcode(name=name, gas_used=float(gas)) for name, gas in zip(custom_names, custom_gas)])
+
+
+OPCODE_TABLE = OpcodeTable(ETH_OPCODES)
 
-    
+# Dense lookup arrays over the opcode table, indexed by position in ETH_OPCODES
+OPCODE_NAMES = OPCODE_TABLE.names
+OPCODE_GAS = OPCODE_TABLE.gas
+OPCODE_LANES = OPCODE_TABLE.lanes
+# Lane of opcodes outside the table (e.g. 'SP')
+FOREIGN_LANE = OPCODE_TABLE.classifier.foreign_lane
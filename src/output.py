@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming storage of the per-step results of a simulation.
+
+SimulationWriter buffers one record per step (base fee, gas used and mempool gas
+per lane, number of messages and revenue of the block, number of messages left
+in the mempool) in preallocated columns and appends them to an Arrow IPC or
+Parquet file every chunk_size steps, so the memory used by a run does not grow
+with its length. SimulationReader maps the file back and exposes the same
+attributes as MetricsRecorder, so the plot functions of mainLoop can draw a run
+from disk.
+
+pyarrow is only needed by this module and is imported when a file is opened.
+"""
+import numpy as np
+
+FORMATS = ('arrow', 'parquet')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Storing simulation output requires pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _format(path: str, format: str = None) -> str:
+    if format is None:
+        format = 'parquet' if str(path).endswith('.parquet') else 'arrow'
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format '{format}', expected one of {FORMATS}")
+    return format
+
+
+def column_names(N_lanes: int) -> list:
+    """
+    Names of the columns written by SimulationWriter, in order.
+    """
+    return (['step', 'block_size', 'revenue', 'mempool_count']
+            + [f'base_fee_{i}' for i in range(N_lanes)]
+            + [f'gas_used_{i}' for i in range(N_lanes)]
+            + [f'mempool_gas_{i}' for i in range(N_lanes)])
+
+
+class SimulationWriter:
+    def __init__(self, path: str, N_lanes: int, chunk_size: int = 4096, format: str = None):
+        """
+        Writes the per-step results of a simulation to disk in fixed-size chunks.
+
+        Every chunk becomes a record batch of an Arrow IPC file or a row group
+        of a Parquet file. The file is only complete (readable) once the writer
+        is closed; use it as a context manager.
+
+        Args:
+            path (str): Path of the output file.
+            N_lanes (int): Number of lanes.
+            chunk_size (int): Number of steps buffered before they are written.
+            format (str): 'arrow' or 'parquet'. Defaults to 'parquet' for paths
+                ending in .parquet and 'arrow' otherwise.
+        """
+        pa = _pyarrow()
+        self.path = path
+        self.N_lanes = N_lanes
+        self.format = _format(path, format)
+        self.chunk_size = max(int(chunk_size), 1)
+        self.n_written = 0
+        self._n_buffered = 0
+
+        self._step = np.zeros(self.chunk_size, dtype=np.int64)
+        self._block_size = np.zeros(self.chunk_size, dtype=np.int64)
+        self._revenue = np.zeros(self.chunk_size)
+        self._mempool_count = np.zeros(self.chunk_size, dtype=np.int64)
+        self._base_fee = np.zeros((self.chunk_size, N_lanes))
+        self._gas_used = np.zeros((self.chunk_size, N_lanes))
+        self._mempool_gas = np.zeros((self.chunk_size, N_lanes))
+
+        fields = [pa.field(name, pa.int64() if name in ('step', 'block_size', 'mempool_count') else pa.float64())
+                  for name in column_names(N_lanes)]
+        self.schema = pa.schema(fields, metadata={'N_lanes': str(N_lanes)})
+        if self.format == 'arrow':
+            self._sink = pa.OSFile(path, 'wb')
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+        else:
+            self._sink = None
+            self._writer = pa.parquet.ParquetWriter(path, self.schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, step: int, block, base_fees, mempool):
+        """
+        Buffers the results of a step, writing the buffer out when it is full.
+
+        Args:
+            step (int): Index of the step.
+            block (Block): The block of the step, or None if no block was produced.
+            base_fees: Base fees per lane after the block.
+            mempool (Mempool): The mempool after removing the messages of the block.
+        """
+        row = self._n_buffered
+        self._step[row] = step
+        if block is None:
+            self._block_size[row] = 0
+            self._revenue[row] = 0
+            self._gas_used[row] = 0
+        else:
+            self._block_size[row] = len(block.messages)
+            self._revenue[row] = block.get_revenue()
+            self._gas_used[row] = block.gas_used
+        self._base_fee[row] = base_fees
+        self._mempool_count[row] = len(mempool)
+        self._mempool_gas[row] = mempool.calculate_total_gas_used()
+        self._n_buffered += 1
+        if self._n_buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered steps to the file.
+        """
+        if self._n_buffered == 0:
+            return
+        pa = _pyarrow()
+        n = self._n_buffered
+        columns = [self._step[:n], self._block_size[:n], self._revenue[:n], self._mempool_count[:n]]
+        for lanes in (self._base_fee, self._gas_used, self._mempool_gas):
+            columns += [lanes[:n, i] for i in range(self.N_lanes)]
+        batch = pa.record_batch([pa.array(c) for c in columns], schema=self.schema)
+        if self.format == 'arrow':
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        self.n_written += n
+        self._n_buffered = 0
+
+    def close(self):
+        """
+        Writes the remaining steps and closes the file.
+        """
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        self._writer = None
+
+
+class SimulationReader:
+    def __init__(self, path: str, format: str = None):
+        """
+        Reads a file written by SimulationWriter.
+
+        The file is memory-mapped: a column is only read from disk when it is
+        requested, and Arrow IPC columns are not copied unless they span several
+        chunks.
+
+        Args:
+            path (str): Path of the file.
+            format (str): 'arrow' or 'parquet'. Inferred from the path by default.
+        """
+        pa = _pyarrow()
+        self.path = path
+        self.format = _format(path, format)
+        if self.format == 'arrow':
+            self._source = pa.memory_map(path, 'r')
+            self._table = pa.ipc.open_file(self._source).read_all()
+            schema = self._table.schema
+        else:
+            self._source = None
+            self._file = pa.parquet.ParquetFile(path, memory_map=True)
+            schema = self._file.schema_arrow
+        self.N_lanes = int(schema.metadata[b'N_lanes'])
+        self.names = schema.names
+
+    def __len__(self):
+        if self.format == 'arrow':
+            return self._table.num_rows
+        return self._file.metadata.num_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Returns one of the stored columns (see column_names).
+        """
+        if self.format == 'arrow':
+            data = self._table.column(name)
+        else:
+            data = self._file.read(columns=[name]).column(name)
+        return data.to_numpy()
+
+    def iter_chunks(self, columns: list = None):
+        """
+        Iterates over the file one chunk at a time.
+
+        Args:
+            columns (list): Names of the columns to be read. Defaults to all of them.
+
+        Yields:
+            dict: Column name to the values of the chunk.
+        """
+        if self.format == 'arrow':
+            batches = self._table.select(columns or self.names).to_batches()
+        else:
+            # One batch per row group: iter_batches would merge them up to its batch size
+            batches = (batch for i in range(self._file.num_row_groups)
+                       for batch in self._file.read_row_group(i, columns=columns).to_batches())
+        for batch in batches:
+            yield {name: batch.column(name).to_numpy() for name in batch.schema.names}
+
+    def close(self):
+        if self._source is not None:
+            self._table = None
+            self._source.close()
+            self._source = None
+
+    @property
+    def step(self) -> np.ndarray:
+        """
+        Index of each recorded step.
+        """
+        return self.column('step')
+
+    @property
+    def gas_used(self) -> np.ndarray:
+        """
+        Gas used per lane by the block of each step.
+        """
+        return self._lanes('gas_used')
+
+    @property
+    def base_fee(self) -> np.ndarray:
+        """
+        Base fee per lane after each step.
+        """
+        return self._lanes('base_fee')
+
+    @property
+    def block_size(self) -> np.ndarray:
+        """
+        Number of messages in the block of each step.
+        """
+        return self.column('block_size')
+
+    @property
+    def revenue(self) -> np.ndarray:
+        """
+        Premiums collected by the proposer of each block.
+        """
+        return self.column('revenue')
+
+    @property
+    def mempool_count(self) -> np.ndarray:
+        """
+        Number of messages left in the mempool after each step.
+        """
+        return self.column('mempool_count')
+
+    @property
+    def mempool_gas(self) -> np.ndarray:
+        """
+        Gas used per lane by the messages left in the mempool after each step.
+        """
+        return self._lanes('mempool_gas')
+
+    def _lanes(self, prefix: str) -> np.ndarray:
+        return np.column_stack([self.column(f'{prefix}_{i}') for i in range(self.N_lanes)])
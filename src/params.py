@@ -4,7 +4,13 @@
 Created on Fri Jun 16 11:35:39 2023
 
 @author: juanpablomadrigalcianci
+
+env_params() and eth_opcodes() build new, mutable dicts on every call. Modules
+that only read the default parameters use defaults() and opcode_gas(), which
+are built once per process and cannot be modified.
 """
+from functools import lru_cache
+from types import MappingProxyType
 
 def env_params():
     env_params={
@@ -13,7 +19,17 @@ def env_params():
         'lane_widths':[6e9,4e9],
         'lane_targets':[3e9,2e9],
         'initial_base_fee':[1e-10,1e-10],
-        'min_fee':[1e-16,1e-16]
+        'min_fee':[1e-16,1e-16],
+        'rate_messages':10,
+        'rate_opcodes':100,
+        'rate_sps':2,
+        # opcode to lane rules of aux.LaneClassifier, None for the default 2-lane split
+        'lane_rules':None,
+        # policy of eviction.EvictionIndex used when the mempool is full, None for oldest first
+        'eviction_policy':None,
+        # drop messages priced out by the base fees / after this many steps (None for never)
+        'prune_priced_out':False,
+        'ttl':None
         }
     # env_params={
     #     'N_lanes':1,
@@ -21,21 +37,38 @@ def env_params():
     #     'lane_widths':[10e9],
     #     'lane_targets':[5e9],
     #     'initial_base_fee':[1e-11],
-    #     'min_fee':[1e-16]
+    #     'min_fee':[1e-16],
+    #     'rate_messages':10,
+    #     'rate_opcodes':100,
+    #     'rate_sps':2,
+    #     'lane_rules':None,
+    #     'eviction_policy':None,
+    #     'prune_priced_out':False,
+    #     'ttl':None
     #     }
 
     return env_params
 
-def gas_lanes_params():
+@lru_cache(maxsize=None)
+def defaults():
+    """
+    Read-only view of the default environment parameters (lists become tuples).
+    """
+    return MappingProxyType({k: tuple(v) if isinstance(v, list) else v for k, v in env_params().items()})
+
+def gas_lanes_params(P=None):
     '''each lane need to be instantiated with the following parameters:
       Id: int, 
       base_fee: float, 
       min_fee: float,
       target: float, 
       capacity: float)
+    
+    P are the environment parameters, defaults to env_params()
     '''
     
-    P=env_params()
+    if P is None:
+        P=env_params()
     
     lane_params=[]
     for i in range(P['N_lanes']):
@@ -215,3 +248,10 @@ def eth_opcodes():
 
     return opcode_gas_limits
 
+
+@lru_cache(maxsize=None)
+def opcode_gas():
+    """
+    Read-only view of eth_opcodes().
+    """
+    return MappingProxyType(eth_opcodes())
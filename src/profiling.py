@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-phase timing and counters of the simulation steps.
+
+A StepProfiler is passed to mainLoop.simulation_step (or run_simulation), which
+times each phase of the step (message generation, mempool insertion, eviction,
+block selection, block construction, fee update) and counts the messages
+generated, evicted and included, and the messages in the mempool when the block
+is selected (mempool_size, the size of the knapsack problem, whatever part of it
+the strategy actually looks at). The totals are printed with summary(); the
+values of every step are kept if trace is enabled.
+
+cProfile, or a simple sampling profiler, can be switched on for a window of
+steps only, so the profile of a long run is not dominated by its warm-up.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+
+PHASES = ('expiry', 'generation', 'insertion', 'eviction', 'selection', 'block', 'fee_update')
+COUNTERS = ('generated', 'evicted', 'included', 'mempool_size', 'pruned', 'expired')
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.001):
+        """
+        Statistical profiler sampling the stack of a thread at a fixed interval.
+
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self.functions = Counter()
+        self.lines = Counter()
+        self.n_samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def enable(self):
+        """
+        Starts sampling the calling thread.
+        """
+        target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(target,), daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        """
+        Stops sampling.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, target):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                continue
+            code = frame.f_code
+            self.lines[(code.co_filename, frame.f_lineno, code.co_name)] += 1
+            # Every function on the stack is counted once per sample (inclusive time)
+            functions = set()
+            while frame is not None:
+                functions.add((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            self.functions.update(functions)
+            self.n_samples += 1
+
+    def top(self, n: int = 20) -> str:
+        """
+        The functions found in most samples, and the lines most often being executed.
+        """
+        total = max(self.n_samples, 1)
+        lines = [f"{self.n_samples} samples every {self.interval * 1e3:g} ms", "functions (inclusive):"]
+        for (filename, name), count in self.functions.most_common(n):
+            lines.append(f"{100 * count / total:6.1f}%  {name} ({filename})")
+        lines.append("lines (self):")
+        for (filename, lineno, name), count in self.lines.most_common(n):
+            lines.append(f"{100 * count / total:6.1f}%  {filename}:{lineno} ({name})")
+        return '\n'.join(lines)
+
+
+class StepProfiler:
+    def __init__(self, trace: bool = False, profile_steps: range = None, profiler: str = 'cprofile',
+                 interval: float = 0.001):
+        """
+        Collects the time spent in each phase of the steps and step counters.
+
+        Args:
+            trace (bool): If True, the phase times and counters of every step are kept.
+            profile_steps (range): Steps during which a profiler runs. None to never profile.
+            profiler (str): 'cprofile' or 'sampling'.
+            interval (float): Seconds between samples of the sampling profiler.
+        """
+        if profiler not in ('cprofile', 'sampling'):
+            raise ValueError(f"Unknown profiler '{profiler}'")
+        self.profile_steps = profile_steps
+        self.profiler = cProfile.Profile() if profiler == 'cprofile' else SamplingProfiler(interval)
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.n_steps = 0
+        self.step_time = 0.
+        self.trace: Optional[List[Dict]] = [] if trace else None
+        self._step = None
+        self._current = None
+        self._step_start = None
+        self._profiling = False
+
+    def start_step(self, step: int):
+        """
+        Marks the start of a step.
+        """
+        self._step = step
+        self._current = {'step': step} if self.trace is not None else None
+        in_window = self.profile_steps is not None and step in self.profile_steps
+        if in_window and not self._profiling:
+            self.profiler.enable()
+            self._profiling = True
+        elif not in_window and self._profiling:
+            self.profiler.disable()
+            self._profiling = False
+        self._step_start = time.perf_counter()
+
+    def end_step(self):
+        """
+        Marks the end of the current step.
+        """
+        elapsed = time.perf_counter() - self._step_start
+        self.step_time += elapsed
+        self.n_steps += 1
+        if self._current is not None:
+            self._current['total'] = elapsed
+            self.trace.append(self._current)
+        self._step = None
+
+    def stop(self):
+        """
+        Stops the profiler if the run ended inside the profiled window.
+        """
+        if self._profiling:
+            self.profiler.disable()
+            self._profiling = False
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager timing a phase of the current step.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.totals[name] += elapsed
+            if self._current is not None:
+                self._current[name] = self._current.get(name, 0.) + elapsed
+
+    def count(self, name: str, n: int = 1):
+        """
+        Adds n to a counter of the current step.
+        """
+        self.counts[name] += n
+        if self._current is not None:
+            self._current[name] = self._current.get(name, 0) + n
+
+    def summary(self) -> str:
+        """
+        Table of the time per phase and of the counters.
+        """
+        steps = max(self.n_steps, 1)
+        lines = [f"{'phase':<12}{'total (s)':>12}{'per step (ms)':>15}{'share':>8}"]
+        for name in list(PHASES) + sorted(set(self.totals) - set(PHASES)):
+            if name not in self.totals:
+                continue
+            total = self.totals[name]
+            share = total / self.step_time if self.step_time else 0.
+            lines.append(f"{name:<12}{total:>12.4f}{1e3 * total / steps:>15.4f}{share:>8.1%}")
+        lines.append(f"{'step':<12}{self.step_time:>12.4f}{1e3 * self.step_time / steps:>15.4f}{'':>8}")
+        lines.append('')
+        lines.append(f"{'counter':<12}{'total':>12}{'per step':>15}")
+        for name in list(COUNTERS) + sorted(set(self.counts) - set(COUNTERS)):
+            if name in self.counts:
+                lines.append(f"{name:<12}{self.counts[name]:>12d}{self.counts[name] / steps:>15.2f}")
+        return '\n'.join(lines)
+
+    def profile_report(self, n: int = 20, sort: str = 'cumulative') -> str:
+        """
+        Report of the profiler over the profiled window.
+
+        Args:
+            n (int): Number of entries.
+            sort (str): pstats sort key (cProfile only).
+        """
+        if isinstance(self.profiler, SamplingProfiler):
+            return self.profiler.top(n)
+        out = io.StringIO()
+        try:
+            pstats.Stats(self.profiler, stream=out).sort_stats(sort).print_stats(n)
+        except TypeError:
+            return "No steps were profiled"
+        return out.getvalue()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Populations of proposers with competing block builders.
+
+A ProposerPool stands in for the single Miner of a simulation: it has the same
+propose_block(mempool, capacity) method. At each slot it draws a proposer
+(in proportion to the stakes), and either lets it build its own block or, with
+competition, collects a candidate block from every miner and includes the one
+paying the most premiums. The premiums of the included block are credited
+(through credit, called by the simulation) to the miner that built it.
+
+Candidates are built in parallel in a thread or process pool. Threads share
+the mempool and the stateful builders of the miners; the exact strategy runs
+CBC in a subprocess, so its solves overlap fully. Processes receive a copy of
+the knapsack input and build with miner.build_block, which is stateless: the
+'incremental' and 'exact' strategies build from scratch there (the latter
+within the time limit of its miner), and the state kept by the miners between
+blocks (last_gap, lane_prices) is sent back with the candidates.
+
+Failures of the builders or of the worker pool raise a ProposerPoolError, which
+the simulation does not catch, instead of silently skipping the block.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Sequence
+import numpy as np
+from miner import Miner, build_block
+
+
+class ProposerPoolError(RuntimeError):
+    """
+    A candidate block could not be built.
+    """
+
+
+class ProposerPool:
+    def __init__(self, miners: List[Miner], stakes: Sequence[float] = None, competition: bool = True,
+                 executor=None, max_workers: int = None, rng: np.random.Generator = None):
+        """
+        Population of miners taking turns to propose blocks.
+
+        Args:
+            miners (list): The miners, each with its own strategy and balance.
+            stakes: Relative probability of each miner to propose a slot. Uniform by default.
+            competition (bool): If True, every miner builds a candidate and the
+                proposer includes the most profitable one. Otherwise the proposer
+                builds its block alone.
+            executor: None to build the candidates one after the other, 'thread'
+                or 'process' for a pool of max_workers workers owned by the pool,
+                or an existing concurrent.futures.Executor (a ProcessPoolExecutor
+                is used as in 'process' mode, any other one as in 'thread' mode).
+            max_workers (int, optional): Number of workers of the owned pool.
+            rng (np.random.Generator, optional): Stream of the proposer draws.
+                Defaults to the global np.random state.
+        """
+        if not miners:
+            raise ValueError("A proposer pool needs at least one miner")
+        if stakes is None:
+            stakes = np.ones(len(miners))
+        stakes = np.asarray(stakes, dtype=float)
+        if stakes.shape != (len(miners),) or np.any(stakes < 0) or stakes.sum() <= 0:
+            raise ValueError("The stakes must be one non-negative weight per miner, not all zero")
+        self.miners = list(miners)
+        self.stakes = stakes / stakes.sum()
+        self.competition = competition
+        self.rng = rng
+        self.processes = executor == 'process' or isinstance(executor, ProcessPoolExecutor)
+        self._owns_executor = executor in ('thread', 'process')
+        if executor == 'thread':
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        elif executor == 'process':
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif executor is not None and not isinstance(executor, Executor):
+            raise ValueError(f"Unknown executor '{executor}'")
+        self.executor = executor
+
+        self.proposer = None
+        self.builder = None
+        self.revenues = np.zeros(len(miners))
+        self.wins = np.zeros(len(miners), dtype=np.int64)
+        self.proposals = np.zeros(len(miners), dtype=np.int64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the worker pool, if the ProposerPool created it.
+        """
+        if self._owns_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    @property
+    def balances(self) -> np.ndarray:
+        """
+        Account balance of each miner.
+        """
+        return np.array([miner.account_balance for miner in self.miners])
+
+    def propose_block(self, mempool, capacity):
+        """
+        Proposes the block of the next slot.
+
+        Returns:
+            list: Positions in the mempool of the messages of the block.
+        """
+        rng = np.random if self.rng is None else self.rng
+        self.proposer = int(rng.choice(len(self.miners), p=self.stakes))
+        self.proposals[self.proposer] += 1
+
+        builders = list(range(len(self.miners))) if self.competition else [self.proposer]
+        candidates = self.build(builders, mempool, capacity)
+
+        revenues = [float(np.sum(mempool.column('gas_premium', c) * mempool.column('gas_used', c)))
+                    for c in candidates]
+        # Ties go to the proposer, then to the first miner
+        best = max(range(len(builders)), key=lambda i: (revenues[i], builders[i] == self.proposer, -i))
+
+        self.builder = builders[best]
+        self.wins[self.builder] += 1
+        return candidates[best]
+
+    def credit(self, revenue: float):
+        """
+        Credits the revenue of the included block to the miner that built it.
+        """
+        self.miners[self.builder].credit(revenue)
+        self.revenues[self.builder] += revenue
+
+    def build(self, builders: List[int], mempool, capacity) -> List[np.ndarray]:
+        """
+        Builds the candidate block of each of a list of miners.
+
+        Args:
+            builders (list): Indices of the miners.
+            mempool (Mempool): The mempool to build from.
+            capacity: Capacity of each lane.
+
+        Returns:
+            list: Positions of the messages of each candidate.
+
+        Raises:
+            ProposerPoolError: If a candidate could not be built.
+        """
+        miners = [self.miners[b] for b in builders]
+        try:
+            if self.executor is None or len(miners) == 1:
+                return [np.asarray(miner.propose_block(mempool, capacity), dtype=np.intp) for miner in miners]
+
+            if self.processes:
+                values, weights = (np.array(column) for column in mempool.get_parameters_for_knapsack())
+                futures = [self.executor.submit(build_block, miner.strategy, values, weights, capacity, miner.lane,
+                                                miner.prices(mempool), miner.time_limit)
+                           for miner in miners]
+                results = [future.result() for future in futures]
+                for miner, (_, state) in zip(miners, results):
+                    miner.keep_state(state, mempool)
+                return [np.asarray(chosen, dtype=np.intp) for chosen, _ in results]
+
+            # Compacting the mempool and attaching the stateful builders up front
+            # leaves the workers only reading the shared state
+            mempool.compact()
+            for miner in miners:
+                miner.prepare(mempool)
+            futures = [self.executor.submit(miner.propose_block, mempool, capacity) for miner in miners]
+            return [np.asarray(future.result(), dtype=np.intp) for future in futures]
+        except Exception as e:
+            raise ProposerPoolError(f"Building the candidate blocks failed: {e}") from e
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruning of messages that can no longer be included.
+
+A PruningIndex is a mempool listener that keeps, for every lane, a min-heap of
+the messages on their fee cap in that lane (FeeCapHeaps, shared with the
+'underpriced' eviction policy), and a queue of the messages in order of
+expiry. After a base fee update, the messages priced out in some lane
+are popped from the top of the heaps, and at each step the expired ones from
+the front of the queue, so both cost time proportional to the number of
+messages removed (plus the lazily deleted entries skipped on the way), not to
+the size of the pool.
+"""
+from collections import deque
+from typing import List
+import heapq
+import numpy as np
+
+
+class FeeCapHeaps:
+    def __init__(self, N_lanes: int, live):
+        """
+        Min-heaps of messages on their fee cap, one per lane, with lazy deletion.
+
+        Entries of messages that are no longer live are skipped when they reach
+        the top of a heap, and dropped all at once by compact when they
+        outnumber the live ones. Used by PruningIndex and by the 'underpriced'
+        policy of eviction.EvictionIndex.
+
+        Args:
+            N_lanes (int): Number of lanes.
+            live: Container of the keys of the live messages, owned by the caller.
+        """
+        self.heaps = [[] for _ in range(N_lanes)]
+        self._live = live
+
+    def push(self, keys: list, caps):
+        """
+        Adds messages.
+
+        Args:
+            keys (list): Their mempool keys.
+            caps: (n, N_lanes) array with their fee caps.
+        """
+        caps = np.array(caps, dtype=float).reshape(len(keys), len(self.heaps))
+        # NaN never compares, it would stop any heap it reaches the top of
+        caps[np.isnan(caps)] = np.inf
+        for lane, heap in enumerate(self.heaps):
+            push_all(heap, list(zip(caps[:, lane].tolist(), keys)))
+
+    def top(self, lane: int):
+        """
+        Lowest (fee cap, key) entry of a live message in a lane, or None.
+        """
+        heap = self.heaps[lane]
+        while heap and heap[0][1] not in self._live:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def pop(self, lane: int):
+        """
+        Removes and returns the top entry of a lane (see top).
+        """
+        return heapq.heappop(self.heaps[lane])
+
+    def pop_below(self, lane: int, fee: float) -> List[int]:
+        """
+        Removes the entries of a lane with a fee cap below a fee.
+
+        Returns:
+            list: The keys of the live messages among them.
+        """
+        heap = self.heaps[lane]
+        keys = []
+        while heap and heap[0][0] < fee:
+            key = heapq.heappop(heap)[1]
+            if key in self._live:
+                keys.append(key)
+        return keys
+
+    def compact(self):
+        """
+        Drops the entries of the messages that are no longer live, if they
+        outnumber the live ones.
+        """
+        if self.heaps and len(self.heaps[0]) > 2 * len(self._live) + 64:
+            for lane, heap in enumerate(self.heaps):
+                self.heaps[lane] = [entry for entry in heap if entry[1] in self._live]
+                heapq.heapify(self.heaps[lane])
+
+
+def push_all(heap: list, entries: list):
+    """
+    Pushes entries on a heap, heapifying from scratch when there are more
+    entries than the heap already holds.
+    """
+    if len(entries) > len(heap):
+        heap.extend(entries)
+        heapq.heapify(heap)
+    else:
+        for entry in entries:
+            heapq.heappush(heap, entry)
+
+
+class PruningIndex:
+    def __init__(self, N_lanes: int, priced_out: bool = True, ttl: int = None):
+        """
+        Index of the mempool messages by fee cap per lane and by expiry step.
+
+        Args:
+            N_lanes (int): Number of lanes.
+            priced_out (bool): If True, the fee cap heaps are kept.
+            ttl (int, optional): Number of steps a message stays in the mempool.
+                None for no expiry.
+        """
+        self.N_lanes = N_lanes
+        self.ttl = ttl
+        self._live = set()
+        self._heaps = FeeCapHeaps(N_lanes, self._live) if priced_out else None
+        self._expiry = deque() if ttl is not None else None
+
+    def __len__(self):
+        return len(self._live)
+
+    def on_insert(self, keys, columns: dict):
+        keys = np.asarray(keys).tolist()
+        self._live.update(keys)
+        if self._heaps is not None:
+            self._heaps.push(keys, columns['gas_fee_cap'])
+        if self._expiry is not None:
+            # Arrival steps never decrease, so the queue stays sorted by expiry
+            expiry = (np.asarray(columns['arrival']) + self.ttl).tolist()
+            self._expiry.extend(zip(expiry, keys))
+
+    def on_remove(self, keys):
+        self._live.difference_update(np.asarray(keys).tolist())
+        if self._heaps is not None:
+            self._heaps.compact()
+
+    def priced_out(self, base_fees) -> List[int]:
+        """
+        Finds the messages whose fee cap is below the base fee of some lane.
+
+        Their entries are dropped from the fee cap heaps. The caller is expected
+        to remove them from the mempool.
+
+        Args:
+            base_fees: Current base fee of each lane.
+
+        Returns:
+            list: Their mempool keys, in increasing order.
+        """
+        if self._heaps is None:
+            return []
+        out = set()
+        for lane, base_fee in enumerate(np.asarray(base_fees, dtype=float).tolist()):
+            out.update(self._heaps.pop_below(lane, base_fee))
+        return sorted(out)
+
+    def expired(self, step: int) -> List[int]:
+        """
+        Finds the messages whose time to live is over at a step.
+
+        Args:
+            step (int): Current step of the mempool.
+
+        Returns:
+            list: Their mempool keys, in increasing order.
+        """
+        if self._expiry is None:
+            return []
+        out = []
+        while self._expiry and self._expiry[0][0] <= step:
+            key = self._expiry.popleft()[1]
+            if key in self._live:
+                out.append(key)
+        return out
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-block metrics of a simulation, stored in typed, preallocated columns.
+
+A SummaryRecorder has the same interface but keeps constant memory: running
+moments, quantile sketches and exponentially weighted windows per lane, and
+downsampled series for plotting.
+"""
+from collections import deque
+from typing import Sequence
+import numpy as np
+from online_stats import DownsampledSeries, EWMA, QuantileSketch, RunningMoments
+
+
+class MetricsRecorder:
+    def __init__(self, N_lanes: int, capacity: int = 2880, ring: bool = False, keep_blocks: bool = False):
+        """
+        Records, for every block, the gas used and base fee per lane, the number
+        of messages in the block, and the number of messages and total gas left
+        in the mempool.
+
+        Args:
+            N_lanes (int): Number of lanes.
+            capacity (int): Number of blocks to preallocate the columns for.
+            ring (bool): If True, only the last `capacity` blocks are kept.
+                Otherwise the columns grow when full.
+            keep_blocks (bool): If True, the Block objects themselves are kept
+                as well (only the last `capacity` of them when ring is True).
+                By default only their summary in the columns is kept.
+        """
+        self.N_lanes = N_lanes
+        self.ring = ring
+        self.n_recorded = 0
+        self._capacity = max(int(capacity), 1)
+
+        self._gas_used = np.zeros((self._capacity, N_lanes))
+        self._base_fee = np.zeros((self._capacity, N_lanes))
+        self._block_size = np.zeros(self._capacity, dtype=np.int64)
+        self._mempool_count = np.zeros(self._capacity, dtype=np.int64)
+        self._mempool_gas = np.zeros((self._capacity, N_lanes))
+        self.blocks = (deque(maxlen=self._capacity) if ring else []) if keep_blocks else None
+
+    def __len__(self):
+        return min(self.n_recorded, self._capacity) if self.ring else self.n_recorded
+
+    def record(self, block, base_fees, mempool):
+        """
+        Records a block.
+
+        Args:
+            block (Block): The block added to the chain.
+            base_fees: Base fees per lane after the block.
+            mempool (Mempool): The mempool after removing the messages of the block.
+        """
+        if not self.ring and self.n_recorded == self._capacity:
+            self._grow()
+        row = self.n_recorded % self._capacity
+
+        self._gas_used[row] = block.gas_used
+        self._base_fee[row] = base_fees
+        self._block_size[row] = len(block.messages)
+        self._mempool_count[row] = len(mempool)
+        self._mempool_gas[row] = mempool.calculate_total_gas_used()
+        if self.blocks is not None:
+            self.blocks.append(block)
+        self.n_recorded += 1
+
+    @property
+    def gas_used(self) -> np.ndarray:
+        """
+        Gas used per lane by each recorded block, oldest first.
+        """
+        return self._chronological(self._gas_used)
+
+    @property
+    def base_fee(self) -> np.ndarray:
+        """
+        Base fee per lane after each recorded block, oldest first.
+        """
+        return self._chronological(self._base_fee)
+
+    @property
+    def block_size(self) -> np.ndarray:
+        """
+        Number of messages in each recorded block, oldest first.
+        """
+        return self._chronological(self._block_size)
+
+    @property
+    def mempool_count(self) -> np.ndarray:
+        """
+        Number of messages left in the mempool after each recorded block, oldest first.
+        """
+        return self._chronological(self._mempool_count)
+
+    @property
+    def mempool_gas(self) -> np.ndarray:
+        """
+        Gas used per lane by the messages left in the mempool after each recorded block, oldest first.
+        """
+        return self._chronological(self._mempool_gas)
+
+    def _chronological(self, column: np.ndarray) -> np.ndarray:
+        if self.n_recorded <= self._capacity:
+            return column[:self.n_recorded]
+        start = self.n_recorded % self._capacity
+        return np.concatenate([column[start:], column[:start]])
+
+    def _grow(self):
+        for name in ('_gas_used', '_base_fee', '_block_size', '_mempool_count', '_mempool_gas'):
+            old = getattr(self, name)
+            setattr(self, name, np.concatenate([old, np.zeros_like(old)]))
+        self._capacity *= 2
+
+
+class SummaryRecorder:
+    def __init__(self, N_lanes: int, lane_widths: Sequence[float], quantiles: Sequence[float] = (0.05, 0.5, 0.95),
+                 alpha: float = 0.01, relative_accuracy: float = 0.01, max_points: int = 1024):
+        """
+        Streaming summary of the blocks of a simulation, updated in O(1) per block.
+
+        Per lane, the base fee, the utilisation (gas used over lane width) and
+        the inclusion delay (steps between the arrival of a message in the
+        mempool and its inclusion, for the messages using the lane) are
+        summarised by their running mean and variance, a quantile sketch and an
+        exponentially weighted window. The base fee, gas used, block size and
+        mempool size are also kept as downsampled series, so the plot functions
+        of mainLoop accept a SummaryRecorder in place of a MetricsRecorder.
+
+        Args:
+            N_lanes (int): Number of lanes.
+            lane_widths: Width of each lane.
+            quantiles: Quantiles reported by describe.
+            alpha (float): Weight of the newest block in the exponentially weighted windows.
+            relative_accuracy (float): Relative accuracy of the quantile sketches.
+            max_points (int): Maximum number of points of the downsampled series.
+        """
+        self.N_lanes = N_lanes
+        self.lane_widths = np.asarray(lane_widths, dtype=float)
+        self.quantiles = tuple(quantiles)
+        self.n_recorded = 0
+
+        self.moments = {name: RunningMoments((N_lanes,)) for name in ('base_fee', 'utilisation')}
+        self.sketches = {name: QuantileSketch((N_lanes,), relative_accuracy)
+                         for name in ('base_fee', 'utilisation', 'delay')}
+        self.windows = {name: EWMA(alpha, (N_lanes,)) for name in ('base_fee', 'utilisation', 'delay')}
+        self.series = {'base_fee': DownsampledSeries((N_lanes,), max_points),
+                       'gas_used': DownsampledSeries((N_lanes,), max_points),
+                       'block_size': DownsampledSeries((), max_points),
+                       'mempool_count': DownsampledSeries((), max_points),
+                       'mempool_gas': DownsampledSeries((N_lanes,), max_points)}
+        self._delay_count = np.zeros(N_lanes, dtype=np.int64)
+        self._delay_sum = np.zeros(N_lanes)
+
+    def __len__(self):
+        return self.n_recorded
+
+    def record(self, block, base_fees, mempool):
+        """
+        Records a block.
+
+        Args:
+            block (Block): The block added to the chain.
+            base_fees: Base fees per lane after the block.
+            mempool (Mempool): The mempool after removing the messages of the block.
+        """
+        base_fees = np.asarray(base_fees, dtype=float)
+        utilisation = np.asarray(block.gas_used, dtype=float) / self.lane_widths
+        for name, x in (('base_fee', base_fees), ('utilisation', utilisation)):
+            self.moments[name].update(x)
+            self.sketches[name].update(x)
+            self.windows[name].update(x)
+
+        if block.arrivals is not None and len(block.messages):
+            delays = (mempool.step - block.arrivals).astype(float)
+            uses = np.array([message.gas_used for message in block.messages]).reshape(len(delays), -1) > 0
+            messages, lanes = np.nonzero(uses)
+            self.sketches['delay'].add(delays[messages], lanes)
+            count = np.bincount(lanes, minlength=self.N_lanes)
+            total = np.bincount(lanes, weights=delays[messages], minlength=self.N_lanes)
+            self._delay_count += count
+            self._delay_sum += total
+            with np.errstate(invalid='ignore'):
+                mean = total / count
+            window = self.windows['delay']
+            window.update(np.where(count > 0, mean, window.mean if window.count else 0.))
+
+        self.series['base_fee'].update(base_fees)
+        self.series['gas_used'].update(block.gas_used)
+        self.series['block_size'].update(len(block.messages))
+        self.series['mempool_count'].update(len(mempool))
+        self.series['mempool_gas'].update(mempool.calculate_total_gas_used())
+        self.n_recorded += 1
+
+    @property
+    def steps(self) -> np.ndarray:
+        """
+        First recorded block of each point of the downsampled series.
+        """
+        return self.series['base_fee'].steps
+
+    @property
+    def gas_used(self) -> np.ndarray:
+        """
+        Mean gas used per lane over each point of the series.
+        """
+        return self.series['gas_used'].mean
+
+    @property
+    def base_fee(self) -> np.ndarray:
+        """
+        Mean base fee per lane over each point of the series.
+        """
+        return self.series['base_fee'].mean
+
+    @property
+    def block_size(self) -> np.ndarray:
+        """
+        Mean number of messages per block over each point of the series.
+        """
+        return self.series['block_size'].mean
+
+    @property
+    def mempool_count(self) -> np.ndarray:
+        """
+        Mean number of messages in the mempool over each point of the series.
+        """
+        return self.series['mempool_count'].mean
+
+    @property
+    def mempool_gas(self) -> np.ndarray:
+        """
+        Mean gas used per lane by the mempool over each point of the series.
+        """
+        return self.series['mempool_gas'].mean
+
+    @property
+    def mean_delay(self) -> np.ndarray:
+        """
+        Mean inclusion delay per lane (NaN for lanes no included message used).
+        """
+        with np.errstate(invalid='ignore'):
+            return self._delay_sum / self._delay_count
+
+    def describe(self) -> dict:
+        """
+        Summary statistics per lane.
+
+        Returns:
+            dict: For 'base_fee', 'utilisation' and 'delay', a dict with the
+            'mean', 'std' (not for delay), 'ewma' and one entry per quantile
+            (e.g. 'q0.5'), each an array with one value per lane.
+        """
+        out = {}
+        for name in ('base_fee', 'utilisation', 'delay'):
+            stats = {}
+            if name == 'delay':
+                stats['mean'] = self.mean_delay
+            else:
+                stats['mean'] = self.moments[name].mean.copy()
+                stats['std'] = self.moments[name].std
+            stats['ewma'] = self.windows[name].mean.copy()
+            for p in self.quantiles:
+                stats[f'q{p:g}'] = self.sketches[name].quantile(p)
+            out[name] = stats
+        return out
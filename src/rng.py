@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Seedable random streams of the simulation.
+
+A single top-level seed is split into independent numpy Generators, one per
+source of randomness, so that changing how one component uses its stream (e.g.
+the number of lanes the fees are drawn for) does not shift the draws of the
+others. Two runs with the same seed therefore see the same arrivals, opcodes and
+capacity shocks whatever block building strategy or fee mechanism they use.
+
+Components that are not given a Generator fall back to the global np.random
+state, as before.
+"""
+import numpy as np
+
+# Names of the streams, in spawn order. Do not reorder: it changes every stream.
+STREAMS = ('arrivals', 'opcodes', 'fees', 'capacity')
+
+
+class RandomStreams:
+    def __init__(self, seed=None):
+        """
+        Independent random streams spawned from one seed.
+
+        Attributes (numpy Generators):
+            arrivals: Number of messages arriving at each step.
+            opcodes: Opcodes of the messages.
+            fees: Fee caps and gas limit overestimation of the messages.
+            capacity: Capacity shocks of the blocks.
+
+        Args:
+            seed: Seed of the simulation, an int, None (fresh entropy) or a
+                np.random.SeedSequence (e.g. spawned for a replicate).
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        for i, name in enumerate(STREAMS):
+            child = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,),
+                                           pool_size=seed.pool_size)
+            setattr(self, name, np.random.default_rng(child))
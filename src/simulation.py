@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discrete-time simulation kernel.
+
+A Simulation owns all the components of one run (fee mechanism, mempool,
+miner, demand source and recorder) and advances them with step() or run(n).
+Nothing is kept at module level, so several independent kernels can live in
+the same process, and any component can be replaced by another one with the
+same interface:
+
+    tfm: update_fees(gas_used) and get_fees(), e.g. TFM.EIP1559MultiDimensionalMechanism.
+    mempool: a mempool.Mempool.
+    miner: propose_block(mempool, capacity), returning mempool positions, and
+        credit(revenue), e.g. miner.Miner or proposers.ProposerPool.
+    demand: next_step(base_fees) -> (messages, capacity), e.g. demand.RandomDemand
+        or demand_trace.TraceReplay.
+    recorder: record(block, base_fees, mempool), e.g. recorder.MetricsRecorder
+        or recorder.SummaryRecorder.
+"""
+from contextlib import nullcontext
+import params
+from block import Block
+from demand import MessageGenerator, RandomDemand
+from mempool import Mempool
+from miner import Miner
+from proposers import ProposerPoolError
+from recorder import MetricsRecorder
+from rng import RandomStreams
+from TFM import EIP1559MultiDimensionalMechanism
+
+
+def run_step(tfm, mempool, miner, demand, N_lanes: int, max_mempool_length: int = 2000, trace=None, profiler=None):
+    """
+    Runs one step of the simulation: expiry, message arrivals, eviction, block
+    proposal, fee update and crediting of the premiums of the block to the miner.
+
+    As in the original main loop, a failed proposal is reported and the step
+    yields no block, except for failures of a proposers.ProposerPool, which are
+    raised.
+
+    Args:
+        tfm: Fee mechanism.
+        mempool (Mempool): The mempool.
+        miner: The miner proposing the block.
+        demand: Demand source of the step.
+        N_lanes (int): Number of lanes.
+        max_mempool_length (int): Maximum number of messages kept in the mempool.
+        trace: Optional demand_trace.TraceWriter recording the arrivals of the step.
+        profiler: Optional profiling.StepProfiler timing the phases of the step.
+
+    Returns:
+        Block: The proposed block, or None if the proposal failed.
+    """
+    phase = profiler.phase if profiler is not None else _untimed
+    n_pruned, n_expired = mempool.n_pruned, mempool.n_expired
+
+    # Advance the mempool clock, dropping the expired messages
+    with phase('expiry'):
+        mempool.tick()
+
+    with phase('generation'):
+        list_of_messages, capacity = demand.next_step(tfm.get_fees())
+        if trace is not None:
+            trace.write_step(list_of_messages, capacity)
+
+    # Add messages to the mempool
+    with phase('insertion'):
+        mempool.add_messages(list_of_messages)
+
+    # Caps the maximum mempool size to solve a faster knapsack problem
+    n_evicted = max(len(mempool) - max_mempool_length, 0)
+    with phase('eviction'):
+        if n_evicted:
+            mempool.evict(n_evicted)
+
+    if profiler is not None:
+        profiler.count('generated', len(list_of_messages))
+        profiler.count('evicted', n_evicted)
+        profiler.count('mempool_size', len(mempool))
+
+    # Try to propose a block
+    try:
+        with phase('selection'):
+            proposed_block = miner.propose_block(mempool, capacity)
+        with phase('block'):
+            to_remove = mempool.get_messages(proposed_block)
+            arrivals = mempool.column('arrival', proposed_block)
+            block = Block(to_remove, N_lanes=N_lanes, arrivals=arrivals)
+            mempool.remove_indices(proposed_block)
+        with phase('fee_update'):
+            tfm.update_fees(block.gas_used)
+            mempool.set_base_fees(tfm.get_fees())
+    except ProposerPoolError:
+        raise
+    except Exception as e:
+        print(f"Error occurred while proposing a block: {str(e)}")
+        return None
+    # Only a block that made it through the fee update pays its premiums
+    miner.credit(block.get_revenue())
+    if profiler is not None:
+        profiler.count('included', len(block.messages))
+        profiler.count('pruned', mempool.n_pruned - n_pruned)
+        profiler.count('expired', mempool.n_expired - n_expired)
+    return block
+
+
+def _untimed(name):
+    return nullcontext()
+
+
+class Simulation:
+    def __init__(self, env_params: dict = None, seed=None, tfm=None, mempool: Mempool = None, miner=None,
+                 demand=None, recorder=None, max_mempool_length: int = 2000, strategy: str = 'greedy',
+                 writer=None, trace=None, profiler=None):
+        """
+        Simulation kernel owning its components.
+
+        Components that are not given are built from env_params. The recorder
+        keeps every block by default; for very long runs pass a
+        recorder.SummaryRecorder (constant memory) or a ring MetricsRecorder.
+
+        Args:
+            env_params (dict, optional): Environment parameters. Defaults to params.env_params().
+            seed: Seed of the RandomStreams of the built demand. By default the
+                global np.random state is used.
+            tfm: Fee mechanism.
+            mempool (Mempool): The mempool.
+            miner: The miner proposing the blocks.
+            demand: Demand source.
+            recorder: Recorder of the blocks.
+            max_mempool_length (int): Maximum number of messages kept in the mempool.
+            strategy (str): Block building strategy of the built miner.
+            writer: Optional output.SimulationWriter to which every step is streamed.
+            trace: Optional demand_trace.TraceWriter recording the arrivals.
+            profiler: Optional profiling.StepProfiler timing the phases of every step.
+        """
+        if env_params is None:
+            env_params = params.env_params()
+        self.env_params = env_params
+        self.N_lanes = env_params['N_lanes']
+        self.max_mempool_length = max_mempool_length
+        self.streams = RandomStreams(seed) if seed is not None else None
+
+        if tfm is None:
+            tfm = EIP1559MultiDimensionalMechanism(params.gas_lanes_params(env_params))
+        if mempool is None:
+            mempool = Mempool(N_lanes=self.N_lanes, eviction_policy=env_params.get('eviction_policy'),
+                              base_fees=tfm.get_fees(), prune_priced_out=env_params.get('prune_priced_out', False),
+                              ttl=env_params.get('ttl'))
+        if miner is None:
+            miner = Miner(account_balance=0, strategy=strategy)
+        if demand is None:
+            streams = self.streams
+            generator = MessageGenerator(self.N_lanes, rate_opcodes=env_params['rate_opcodes'],
+                                         rate_sps=env_params['rate_sps'], lane_rules=env_params.get('lane_rules'),
+                                         rng=None if streams is None else streams.opcodes,
+                                         fee_rng=None if streams is None else streams.fees)
+            demand = RandomDemand(env_params, generator, streams)
+        if recorder is None:
+            recorder = MetricsRecorder(self.N_lanes, capacity=env_params.get('N_steps', 2880))
+
+        self.tfm = tfm
+        self.mempool = mempool
+        self.miner = miner
+        self.demand = demand
+        self.recorder = recorder
+        self.writer = writer
+        self.trace = trace
+        self.profiler = profiler
+        self.n_steps = 0
+
+    def step(self):
+        """
+        Advances the simulation by one step.
+
+        Returns:
+            Block: The block of the step, or None if the proposal failed.
+        """
+        if self.profiler is not None:
+            self.profiler.start_step(self.n_steps)
+        block = run_step(self.tfm, self.mempool, self.miner, self.demand, self.N_lanes, self.max_mempool_length,
+                         self.trace, self.profiler)
+        if self.profiler is not None:
+            self.profiler.end_step()
+
+        base_fees = self.tfm.get_fees()
+        if self.writer is not None:
+            self.writer.write(self.n_steps, block, base_fees, self.mempool)
+        if block is not None:
+            self.recorder.record(block, base_fees, self.mempool)
+        self.n_steps += 1
+        return block
+
+    def run(self, n_steps: int, progress: bool = False):
+        """
+        Advances the simulation by n_steps steps.
+
+        Args:
+            n_steps (int): Number of steps.
+            progress (bool): If True, shows a tqdm progress bar.
+
+        Returns:
+            The recorder of the simulation.
+        """
+        steps = range(n_steps)
+        if progress:
+            import tqdm
+            steps = tqdm.tqdm(steps)
+        for _ in steps:
+            self.step()
+        if self.profiler is not None:
+            self.profiler.stop()
+        return self.recorder
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over the environment parameters of params.env_params().
+
+A sweep is a list of points (dicts overriding some environment parameters),
+built with grid or random_design, and a list of seeds. Every (point, seed) run
+is executed in a worker pool and its per-step metrics are cached on disk under
+a hash of the parameters, the seed and the source code. Re-running an
+interrupted or extended sweep only computes the missing runs.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence
+import glob
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import numpy as np
+import params
+from ensemble import metric_names, replicate_metrics
+
+SWEEP_KEYS = ('N_lanes', 'lane_widths', 'lane_targets', 'initial_base_fee', 'min_fee',
+              'rate_messages', 'rate_opcodes', 'rate_sps', 'lane_rules',
+              'eviction_policy', 'prune_priced_out', 'ttl')
+LANE_KEYS = ('lane_widths', 'lane_targets', 'initial_base_fee', 'min_fee')
+
+
+def grid(**axes) -> List[Dict]:
+    """
+    Full factorial design.
+
+    The lane parameters are coupled with N_lanes: when N_lanes is swept, the
+    combinations whose per-lane lists do not have N_lanes entries are left
+    out, so grid(N_lanes=[1, 2], lane_widths=[[10e9], [6e9, 4e9]]) has the two
+    points {N_lanes: 1, lane_widths: [10e9]} and {N_lanes: 2, lane_widths: [6e9, 4e9]}.
+    Lane parameters that are not swept are derived from N_lanes (see make_env_params).
+
+    Args:
+        **axes: For each swept parameter, the list of values it takes. Lane
+            parameters take lists of per-lane lists, e.g. lane_widths=[[10e9], [6e9, 4e9]].
+
+    Returns:
+        list: One dict of parameter overrides per point.
+    """
+    names = list(axes)
+    points = (dict(zip(names, values)) for values in itertools.product(*(axes[n] for n in names)))
+    return [point for point in points
+            if 'N_lanes' not in point or all(len(point[key]) == point['N_lanes'] for key in LANE_KEYS if key in point)]
+
+
+def random_design(n_points: int, space: Dict, seed=None) -> List[Dict]:
+    """
+    Random design.
+
+    Args:
+        n_points: Number of points to draw.
+        space: For each swept parameter, either a list of values (drawn
+            uniformly), a (low, high) tuple (drawn uniformly in the interval) or
+            a callable taking a numpy Generator and returning a value.
+        seed: Seed of the design.
+
+    Returns:
+        list: One dict of parameter overrides per point.
+    """
+    rng = np.random.default_rng(seed)
+    points = []
+    for _ in range(n_points):
+        point = {}
+        for name, choices in space.items():
+            if callable(choices):
+                point[name] = choices(rng)
+            elif isinstance(choices, tuple):
+                point[name] = float(rng.uniform(*choices))
+            else:
+                point[name] = choices[rng.integers(len(choices))]
+        points.append(point)
+    return points
+
+
+def make_env_params(point: Dict) -> Dict:
+    """
+    Applies the overrides of a sweep point to params.env_params().
+
+    Lane parameters that the point does not set and whose default does not
+    have N_lanes entries are derived from N_lanes: the default total width is
+    split evenly across the lanes, the targets are half the widths, and every
+    lane starts from the initial base fee and minimum fee of the default lane 0.
+
+    Raises:
+        ValueError: If a parameter cannot be swept, the lane parameters do not
+            have one entry per lane, or a lane target is not positive and below
+            the lane width.
+    """
+    unknown = set(point) - set(SWEEP_KEYS)
+    if unknown:
+        raise ValueError(f"Parameters {sorted(unknown)} cannot be swept")
+    env_params = params.env_params()
+    env_params.update(point)
+    N_lanes = env_params['N_lanes']
+    if 'lane_widths' not in point and len(env_params['lane_widths']) != N_lanes:
+        env_params['lane_widths'] = [sum(env_params['lane_widths']) / N_lanes] * N_lanes
+    if 'lane_targets' not in point and len(env_params['lane_targets']) != N_lanes:
+        env_params['lane_targets'] = [width / 2 for width in env_params['lane_widths']]
+    for key in ('initial_base_fee', 'min_fee'):
+        if key not in point and len(env_params[key]) != N_lanes:
+            env_params[key] = [env_params[key][0]] * N_lanes
+    for key in LANE_KEYS:
+        if len(env_params[key]) != N_lanes:
+            raise ValueError(f"'{key}' must have one entry per lane ({N_lanes})")
+    for lane, (width, target) in enumerate(zip(env_params['lane_widths'], env_params['lane_targets'])):
+        if not 0 < target < width:
+            raise ValueError(f"Lane {lane} must have a positive target below its width, "
+                             f"got target {target:g} and width {width:g}")
+    return env_params
+
+
+def code_version() -> str:
+    """
+    Hash of the simulation source code, part of the cache key of each run.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def run_key(point: Dict, seed: int, n_steps: int, max_mempool_length: int, strategy: str,
+            version: str) -> str:
+    """
+    Cache key of a run.
+    """
+    description = json.dumps({'params': point, 'seed': seed, 'n_steps': n_steps,
+                              'max_mempool_length': max_mempool_length, 'strategy': strategy,
+                              'code': version}, sort_keys=True, default=_to_json)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def _to_json(value):
+    # NumPy scalars and arrays (e.g. grid axes built with np.linspace) as plain Python values
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class SweepRun:
+    def __init__(self, point: Dict, seed: int, path: str):
+        """
+        A finished run of a sweep, stored on disk.
+
+        Args:
+            point: The parameter overrides of the run.
+            seed: The seed of the run.
+            path: Path of the cached metrics.
+        """
+        self.point = point
+        self.seed = seed
+        self.path = path
+
+    def load(self) -> Dict[str, np.ndarray]:
+        """
+        Loads the per-step metrics of the run.
+
+        Returns:
+            dict: Metric name to array of one value per step.
+        """
+        with np.load(self.path) as data:
+            names = json.loads(str(data['names']))
+            return {name: data['metrics'][:, i] for i, name in enumerate(names)}
+
+
+def _run_point(point, seed, n_steps, max_mempool_length, strategy, path):
+    env_params = make_env_params(point)
+    metrics = np.array(list(replicate_metrics(np.random.SeedSequence(seed), n_steps, max_mempool_length,
+                                              strategy, env_params)))
+    # A unique temporary file, so that concurrent sweeps writing the same run do not collide
+    fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        np.savez(tmp_path, metrics=metrics, names=json.dumps(metric_names(env_params['N_lanes'])),
+                 point=json.dumps(point, default=_to_json), seed=seed)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def run_sweep(points: Sequence[Dict], seeds: Sequence[int] = (0,), n_steps: int = None,
+              cache_dir: str = 'sweep_cache', max_workers: int = None, max_mempool_length: int = 2000,
+              strategy: str = 'greedy') -> List[SweepRun]:
+    """
+    Runs every point of a sweep with every seed, reusing cached runs.
+
+    Args:
+        points: Parameter overrides of each point (see grid and random_design).
+        seeds: Seeds of the runs. The same seeds are used for every point.
+        n_steps: Steps per run. Defaults to N_steps of params.env_params().
+        cache_dir: Directory where finished runs are stored.
+        max_workers: Number of worker processes. Defaults to the number of cores.
+        max_mempool_length: Maximum number of messages kept in the mempool.
+        strategy: Block building strategy of the miners.
+
+    Returns:
+        list: A SweepRun per (point, seed), points first.
+    """
+    if n_steps is None:
+        n_steps = params.env_params()['N_steps']
+    for point in points:
+        make_env_params(point)
+    os.makedirs(cache_dir, exist_ok=True)
+    version = code_version()
+
+    runs, missing = [], {}
+    for point in points:
+        for seed in seeds:
+            key = run_key(point, seed, n_steps, max_mempool_length, strategy, version)
+            run = SweepRun(point, seed, os.path.join(cache_dir, key + '.npz'))
+            runs.append(run)
+            if not os.path.exists(run.path):
+                # Repeated (point, seed) pairs are computed once
+                missing.setdefault(key, run)
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_run_point, run.point, run.seed, n_steps, max_mempool_length, strategy, run.path)
+                       for run in missing.values()]
+            for future in futures:
+                future.result()
+
+    return runs
+
+
+if __name__ == '__main__':
+    points = grid(N_lanes=[2], lane_widths=[[6e9, 4e9], [8e9, 3e9]], rate_messages=[5, 10, 20])
+    for run in run_sweep(points, seeds=[0, 1], n_steps=200):
+        metrics = run.load()
+        print(run.point, run.seed, np.mean(metrics['mempool_size']))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import params
+from demand_trace import TraceReplay, TraceWriter
+from message import Message
+from simulation import Simulation
+
+
+def test_arrivals_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / 'demand.trace')
+    steps = []
+    with TraceWriter(path, N_lanes=2) as writer:
+        for n in (3, 0, 5):
+            gas_used = rng.random((n, 2)) * 1e9
+            gas_fee_cap = rng.random((n, 2))
+            messages = Message.batch('msg', gas_fee_cap, gas_fee_cap / 2, gas_used, rng=rng)
+            capacity = (rng.random(2) * 1e10).tolist()
+            writer.write_step(messages, capacity)
+            steps.append((messages, capacity))
+
+    replay = TraceReplay(path)
+    assert len(replay) == 3 and replay.n_messages == 8 and replay.N_lanes == 2
+    for messages, capacity in steps:
+        replayed, replayed_capacity = replay.next_step(None)
+        assert replayed_capacity == capacity
+        assert len(replayed) == len(messages)
+        for original, copy in zip(messages, replayed):
+            for name in ('gas_used', 'gas_limit', 'gas_fee_cap', 'gas_premium'):
+                np.testing.assert_array_equal(getattr(copy, name), getattr(original, name))
+    with pytest.raises(IndexError):
+        replay.next_step(None)
+
+    looping = TraceReplay(path, loop=True)
+    for _ in range(4):
+        looping.next_step(None)
+    assert looping.step == 1
+
+
+def test_replayed_simulation_matches_the_recorded_one(tmp_path):
+    path = str(tmp_path / 'demand.trace')
+    env_params = params.env_params()
+    with TraceWriter(path, env_params['N_lanes']) as writer:
+        recorded = Simulation(env_params, seed=0, trace=writer).run(30)
+    replayed = Simulation(env_params, demand=TraceReplay(path)).run(30)
+    for name in ('base_fee', 'gas_used', 'block_size', 'mempool_count', 'mempool_gas'):
+        np.testing.assert_array_equal(getattr(replayed, name), getattr(recorded, name))
+
+
+def test_incomplete_trace_is_rejected(tmp_path):
+    path = str(tmp_path / 'demand.trace')
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        TraceReplay(path)
@@ -0,0 +1,72 @@
+import numpy as np
+from eviction import EvictionIndex, POLICIES
+from pruning import PruningIndex
+
+
+def _columns(rng, n, N_lanes):
+    gas_fee_cap = rng.integers(1, 6, (n, N_lanes)).astype(float)
+    return {'gas_fee_cap': gas_fee_cap, 'value': rng.random(n), 'gas_limit': rng.random((n, N_lanes)),
+            'arrival': np.zeros(n, dtype=np.int64)}
+
+
+def test_worst_and_below_match_sorting_every_policy():
+    rng = np.random.default_rng(0)
+    for policy, priority_of in POLICIES.items():
+        for _ in range(100):
+            N_lanes, n = int(rng.integers(1, 4)), int(rng.integers(1, 60))
+            columns, keys = _columns(rng, n, N_lanes), np.arange(n)
+            index = EvictionIndex(policy, base_fees=np.ones(N_lanes))
+            index.on_insert(keys, columns)
+            removed = rng.choice(n, n // 3, replace=False)
+            index.on_remove(removed)
+            base_fees = rng.integers(1, 5, N_lanes).astype(float)
+            if rng.random() < 0.2:
+                base_fees[0] = 0
+            index.reprice(None, base_fees)
+
+            priorities = np.asarray(priority_of(columns, keys, base_fees), dtype=float)
+            live = sorted(set(range(n)) - set(removed.tolist()), key=lambda k: (priorities[k], k))
+            if rng.random() < 0.5:
+                k = int(rng.integers(0, len(live) + 1))
+                assert index.worst(k) == live[:k]
+            else:
+                threshold = float(rng.random() * 2 - 0.5)
+                assert index.below(threshold) == [k for k in live if priorities[k] < threshold]
+
+
+def test_priced_out_matches_scanning_the_pool():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        N_lanes = int(rng.integers(1, 4))
+        index, caps, next_key = PruningIndex(N_lanes), {}, 0
+        for step in range(6):
+            n = int(rng.integers(0, 40))
+            gas_fee_cap = rng.random((n, N_lanes))
+            if n and rng.random() < 0.2:
+                gas_fee_cap[0, 0] = np.nan
+            keys = list(range(next_key, next_key + n))
+            next_key += n
+            index.on_insert(keys, {'gas_fee_cap': gas_fee_cap})
+            caps.update(zip(keys, gas_fee_cap))
+            removed = [k for k in caps if rng.random() < 0.2]
+            index.on_remove(removed)
+            for k in removed:
+                del caps[k]
+
+            base_fees = rng.random(N_lanes) * 0.3 * step
+            priced_out = index.priced_out(base_fees)
+            assert priced_out == sorted(k for k, cap in caps.items() if np.any(cap < base_fees))
+            index.on_remove(priced_out)
+            for k in priced_out:
+                del caps[k]
+
+
+def test_expired_in_arrival_order():
+    index = PruningIndex(2, priced_out=False, ttl=3)
+    for step in range(5):
+        index.on_insert([2 * step, 2 * step + 1], {'arrival': np.array([step, step])})
+    index.on_remove([2])
+    assert index.expired(3) == [0, 1]
+    assert index.expired(4) == [3]
+    assert index.expired(4) == []
+    assert index.expired(10) == [4, 5, 6, 7, 8, 9]
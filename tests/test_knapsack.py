@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from knapsack import (multidimensional_knapsack_approx, multidimensional_knapsack_approx_vectorized,
+                      greedy_fill, IncrementalKnapsackBuilder)
+from mempool import Mempool
+from message import Message
+from miner import Miner
+
+
+def _instance(rng, n, d, ties=False, negative=False):
+    values = rng.random(n)
+    if negative:
+        values -= 0.3
+    if ties:
+        values = np.round(values, 1)
+    weights = rng.random((n, d)) * 1e6
+    if ties:
+        weights = np.round(weights, -5)
+    capacity = (weights.sum(axis=0) * rng.random()).tolist() if n else [1.] * d
+    return values, weights, capacity
+
+
+def _messages(rng, n, N_lanes=2):
+    gas_used = rng.random((n, N_lanes)) * 1e9
+    gas_fee_cap = 1e-10 * (1 + 0.2 * rng.random((n, N_lanes)))
+    return Message.batch('msg', gas_fee_cap, gas_fee_cap - 1e-10, gas_used, rng=rng)
+
+
+@pytest.mark.parametrize('ties', [False, True])
+@pytest.mark.parametrize('negative', [False, True])
+def test_vectorized_greedy_matches_loop(ties, negative):
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n, d = int(rng.integers(0, 300)), int(rng.integers(1, 9))
+        values, weights, capacity = _instance(rng, n, d, ties, negative)
+        expected = multidimensional_knapsack_approx(values.tolist(), weights.tolist(), capacity)
+        assert multidimensional_knapsack_approx_vectorized(values, weights, capacity) == expected
+
+
+def test_vectorized_greedy_matches_loop_on_large_instance():
+    rng = np.random.default_rng(1)
+    values, weights, capacity = _instance(rng, 20000, 4)
+    expected = multidimensional_knapsack_approx(values.tolist(), weights.tolist(), capacity)
+    assert multidimensional_knapsack_approx_vectorized(values, weights, capacity) == expected
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 4096])
+def test_greedy_fill_matches_item_by_item(block_size):
+    rng = np.random.default_rng(2)
+    weights = rng.random((500, 3))
+    capacity = weights.sum(axis=0) * 0.3
+    load, expected = np.zeros(3), np.zeros(500, dtype=bool)
+    for i, w in enumerate(weights):
+        if np.all(load + w <= capacity):
+            load += w
+            expected[i] = True
+    np.testing.assert_array_equal(greedy_fill(weights, capacity, block_size), expected)
+
+
+def test_incremental_builder_matches_greedy():
+    rng = np.random.default_rng(3)
+    mempool = Mempool(N_lanes=2)
+    builder = IncrementalKnapsackBuilder(2, block_size=16)
+    mempool.attach(builder)
+    for _ in range(50):
+        mempool.add_messages(_messages(rng, int(rng.integers(0, 40))))
+        if len(mempool):
+            mempool.remove_indices(rng.choice(len(mempool), len(mempool) // 5, replace=False))
+        values, weights = mempool.get_parameters_for_knapsack()
+        capacity = (weights.sum(axis=0) * 0.4).tolist()
+        expected = multidimensional_knapsack_approx(values.tolist(), weights.tolist(), capacity)
+        assert mempool.positions(builder.select(capacity)).tolist() == expected
+
+
+def test_greedy_and_incremental_miners_propose_the_same_blocks():
+    rng = np.random.default_rng(4)
+    messages = _messages(rng, 2000)
+    mempools = [Mempool(N_lanes=2), Mempool(N_lanes=2)]
+    miners = [Miner(0, strategy='greedy'), Miner(0, strategy='incremental')]
+    capacity = [6e9, 4e9]
+    for step in range(40):
+        blocks = []
+        for mempool, miner in zip(mempools, miners):
+            mempool.add_messages(messages[50 * step:50 * (step + 1)])
+            block = miner.propose_block(mempool, capacity)
+            blocks.append([id(m) for m in mempool.get_messages(block)])
+            mempool.remove_indices(block)
+        assert blocks[0] == blocks[1]
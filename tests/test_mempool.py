@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from mempool import Mempool
+from message import Message
+
+
+def _messages(rng, n, N_lanes=2):
+    gas_used = rng.random((n, N_lanes)) * 1e9
+    gas_fee_cap = 1e-10 * (1 + 0.2 * rng.random((n, N_lanes)))
+    return Message.batch('msg', gas_fee_cap, gas_fee_cap - 1e-10, gas_used, rng=rng)
+
+
+def _check(mempool, reference):
+    assert len(mempool) == len(reference)
+    assert [id(m) for m in mempool.messages] == [id(m) for m in reference]
+    values, weights = mempool.get_parameters_for_knapsack()
+    np.testing.assert_array_equal(values, [np.sum(m.gas_premium) for m in reference])
+    np.testing.assert_array_equal(weights, np.reshape([m.gas_limit for m in reference], (-1, 2)))
+    np.testing.assert_allclose(mempool.calculate_total_gas_used(),
+                               np.sum([m.gas_used for m in reference], axis=0) if reference else 0,
+                               rtol=1e-9)
+    if reference:
+        positions = np.sort(np.random.default_rng(len(reference)).choice(len(reference), 5))
+        assert [id(m) for m in mempool.get_messages(positions)] == [id(reference[p]) for p in positions]
+        keys = mempool.column('key', positions)
+        np.testing.assert_array_equal(mempool.positions(keys), positions)
+
+
+def test_add_remove_evict_match_a_reference_list():
+    rng = np.random.default_rng(0)
+    mempool = Mempool(N_lanes=2, capacity=16)
+    reference = []
+    for _ in range(300):
+        op = rng.integers(4)
+        if op == 0 or not reference:
+            batch = _messages(rng, int(rng.integers(1, 30)))
+            mempool.add_messages(batch)
+            reference += batch
+        elif op == 1:
+            positions = rng.choice(len(reference), int(rng.integers(1, len(reference) + 1)), replace=False)
+            mempool.remove_indices(positions)
+            removed = set(positions.tolist())
+            reference = [m for i, m in enumerate(reference) if i not in removed]
+        elif op == 2:
+            removed = [reference[i] for i in rng.choice(len(reference), min(3, len(reference)), replace=False)]
+            mempool.remove(removed)
+            reference = [m for m in reference if all(m is not r for r in removed)]
+        else:
+            n = int(rng.integers(0, len(reference) + 5))
+            assert mempool.evict(n) == min(n, len(reference))
+            reference = reference[n:]
+        _check(mempool, reference)
+
+
+def test_evict_lowest_premium_first():
+    rng = np.random.default_rng(1)
+    mempool = Mempool(N_lanes=2, eviction_policy='lowest_premium')
+    reference = []
+    for _ in range(30):
+        batch = _messages(rng, 20)
+        mempool.add_messages(batch)
+        reference += batch
+        positions = set(rng.choice(len(reference), 3, replace=False).tolist())
+        mempool.remove_indices(sorted(positions))
+        reference = [m for i, m in enumerate(reference) if i not in positions]
+        mempool.evict(10)
+        evicted = sorted(reference, key=lambda m: np.sum(m.gas_premium))[:10]
+        reference = [m for m in reference if all(m is not e for e in evicted)]
+        _check(mempool, reference)
+
+
+def test_max_length_keeps_the_newest_messages():
+    rng = np.random.default_rng(2)
+    mempool = Mempool(N_lanes=2, max_length=50)
+    reference = []
+    for _ in range(20):
+        batch = _messages(rng, 17)
+        mempool.add_messages(batch)
+        reference = (reference + batch)[-50:]
+        _check(mempool, reference)
+    assert mempool.n_evicted == 20 * 17 - 50
+
+
+def test_duplicate_and_missing_messages_are_rejected():
+    rng = np.random.default_rng(3)
+    batch = _messages(rng, 5)
+    mempool = Mempool(batch, N_lanes=2)
+    with pytest.raises(ValueError):
+        mempool.add_messages([batch[0]])
+    with pytest.raises(ValueError):
+        mempool.add_messages([_messages(rng, 1)[0]] * 2)
+    with pytest.raises(ValueError):
+        mempool.remove(_messages(rng, 1))
+    mempool.remove([batch[1]])
+    with pytest.raises(ValueError):
+        mempool.remove([batch[1]])
+    with pytest.raises(IndexError):
+        mempool.get_messages([4])
+    _check(mempool, [batch[0]] + batch[2:])
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import params
+from simulation import Simulation
+
+pytest.importorskip('pyarrow')
+from output import SimulationReader, SimulationWriter, column_names  # noqa: E402
+
+
+@pytest.mark.parametrize('suffix', ['.arrow', '.parquet'])
+def test_simulation_output_round_trip(tmp_path, suffix):
+    path = str(tmp_path / ('run' + suffix))
+    env_params = params.env_params()
+    with SimulationWriter(path, env_params['N_lanes'], chunk_size=7) as writer:
+        simulation = Simulation(env_params, seed=0, writer=writer)
+        recorder = simulation.run(20)
+    assert writer.n_written == 20
+
+    with SimulationReader(path) as reader:
+        assert reader.format == suffix[1:]
+        assert len(reader) == 20 and reader.N_lanes == env_params['N_lanes']
+        assert reader.names == column_names(env_params['N_lanes'])
+        np.testing.assert_array_equal(reader.step, np.arange(20))
+        for name in ('base_fee', 'gas_used', 'block_size', 'mempool_count', 'mempool_gas'):
+            np.testing.assert_array_equal(getattr(reader, name), getattr(recorder, name))
+        assert reader.revenue.sum() == pytest.approx(simulation.miner.account_balance)
+        chunks = list(reader.iter_chunks(['step', 'revenue']))
+        assert [len(chunk['step']) for chunk in chunks] == [7, 7, 6]
+        np.testing.assert_array_equal(np.concatenate([chunk['revenue'] for chunk in chunks]), reader.revenue)
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        SimulationWriter(str(tmp_path / 'run.csv'), 2, format='csv')
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import pytest
+import params
+from sweep import grid, make_env_params, run_sweep
+
+
+def test_grid_is_the_full_factorial():
+    points = grid(rate_messages=[5, 10], ttl=[None, 20, 40])
+    assert len(points) == 6
+    assert {'rate_messages': 10, 'ttl': 20} in points
+
+
+def test_grid_couples_lane_parameters_with_N_lanes():
+    points = grid(N_lanes=[1, 2], lane_widths=[[10e9], [6e9, 4e9]])
+    assert points == [{'N_lanes': 1, 'lane_widths': [10e9]}, {'N_lanes': 2, 'lane_widths': [6e9, 4e9]}]
+    for point in points:
+        make_env_params(point)
+
+
+def test_make_env_params_derives_the_lanes_of_N_lanes():
+    defaults = params.env_params()
+    env_params = make_env_params({'N_lanes': 4})
+    assert env_params['lane_widths'] == [sum(defaults['lane_widths']) / 4] * 4
+    assert env_params['lane_targets'] == [w / 2 for w in env_params['lane_widths']]
+    assert env_params['initial_base_fee'] == [defaults['initial_base_fee'][0]] * 4
+    assert env_params['min_fee'] == [defaults['min_fee'][0]] * 4
+    assert make_env_params({'N_lanes': 1, 'lane_widths': [8e9]})['lane_targets'] == [4e9]
+    assert make_env_params({})['lane_widths'] == defaults['lane_widths']
+
+
+@pytest.mark.parametrize('point, message', [
+    ({'N_steps': 10}, 'cannot be swept'),
+    ({'lane_widths': [10e9]}, 'one entry per lane'),
+    ({'N_lanes': 3, 'lane_targets': [1e9, 1e9]}, 'one entry per lane'),
+    ({'lane_widths': [8e9, 2e9]}, 'Lane 1'),
+    ({'lane_targets': [0, 2e9]}, 'Lane 0'),
+])
+def test_make_env_params_rejects_invalid_points(point, message):
+    with pytest.raises(ValueError, match=message):
+        make_env_params(point)
+
+
+def test_invalid_point_is_rejected_before_any_run(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    with pytest.raises(ValueError):
+        run_sweep([{'rate_messages': 5}, {'lane_widths': [8e9, 2e9]}], n_steps=5, cache_dir=cache_dir)
+    assert not os.path.exists(cache_dir)
+
+
+def test_runs_are_cached(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    points = grid(N_lanes=[1, 2], lane_widths=[[10e9], [6e9, 4e9]], rate_messages=np.array([5, 10]))
+    runs = run_sweep(points, seeds=[0, 0, 1], n_steps=5, cache_dir=cache_dir, max_workers=2)
+    assert len(runs) == 12
+    assert len(os.listdir(cache_dir)) == 8
+    first = {run.path: os.path.getmtime(run.path) for run in runs}
+    again = run_sweep(points, seeds=[0, 0, 1], n_steps=5, cache_dir=cache_dir, max_workers=2)
+    assert [run.path for run in again] == [run.path for run in runs]
+    assert {run.path: os.path.getmtime(run.path) for run in again} == first
+    metrics = runs[0].load()
+    assert len(metrics['mempool_size']) == 5
+    assert 'base_fee_0' in metrics and 'base_fee_1' not in metrics